@@ -1,7 +1,18 @@
+import os
 import math
 import sys
+import json
+import time
+import random
 import timeit
 import platform
+import threading
+import subprocess
+
+try:
+    xrange
+except NameError:
+    xrange = range
 
 
 def average(r):
@@ -17,8 +28,298 @@ def stdev(r):
     return math.sqrt(variance(r))
 
 
+def _stat_from_counts(values, counts, total, stat):
+    """Computes the mean (stat=None) or a percentile (0-100) of a histogram
+    given by parallel lists of sorted bucket values and counts.
+    """
+
+    if stat is None:
+        return sum(v * c for v, c in zip(values, counts)) / float(total)
+
+    rank = stat / 100.0 * (total - 1)
+    seen = 0
+    for value, count in zip(values, counts):
+        seen += count
+        if seen > rank:
+            return value
+    return values[-1]
+
+
+def _poisson(rand, mean):
+    """Returns a Poisson distributed random number"""
+
+    if mean >= 30:
+        # close enough to a normal distribution
+        return max(0, int(round(rand.gauss(mean, math.sqrt(mean)))))
+
+    limit = math.exp(-mean)
+    k = 0
+    p = rand.random()
+    while p > limit:
+        k += 1
+        p *= rand.random()
+    return k
+
+
+class Stats(object):
+    """Accumulates timings one at a time using constant memory.
+
+    Mean and variance are computed with Welford's method, percentiles are
+    approximated by a histogram with logarithmic buckets, so the result is
+    within `precision` (relative) of the real value. Bootstrap confidence
+    intervals are computed by resampling the histogram.
+
+    Args:
+        precision (float): relative bucket width of the histogram
+    """
+
+    def __init__(self, precision=0.01):
+        self._log_base = math.log(1 + precision)
+        self.n = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._zeros = 0
+        self._buckets = {}
+
+    @classmethod
+    def from_values(cls, values, *args, **kwargs):
+        stats = cls(*args, **kwargs)
+        for value in values:
+            stats.add(value)
+        return stats
+
+    def add(self, x):
+        """Adds one sample"""
+
+        self.n += 1
+        delta = x - self._mean
+        self._mean += delta / self.n
+        self._m2 += delta * (x - self._mean)
+
+        if self.n == 1:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+
+        if x <= 0:
+            self._zeros += 1
+        else:
+            key = int(math.floor(math.log(x) / self._log_base))
+            self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def variance(self):
+        if self.n < 2:
+            return 0.0
+        return self._m2 / (self.n - 1)
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    def _histogram(self):
+        """Returns sorted lists of bucket values and their counts"""
+
+        values = []
+        counts = []
+        if self._zeros:
+            values.append(min(self.min, 0.0))
+            counts.append(self._zeros)
+        for key in sorted(self._buckets):
+            # geometric middle of the bucket, clamped to the seen range
+            value = math.exp((key + 0.5) * self._log_base)
+            values.append(max(self.min, min(self.max, value)))
+            counts.append(self._buckets[key])
+        return values, counts
+
+    def percentile(self, p):
+        """Returns the approximated p-th percentile (0-100)"""
+
+        if not self.n:
+            raise ValueError("no samples")
+        if p <= 0:
+            return self.min
+        if p >= 100:
+            return self.max
+        values, counts = self._histogram()
+        return _stat_from_counts(values, counts, self.n, p)
+
+    def bootstrap_ci(self, percentile=None, level=0.95, rounds=200,
+                     seed=0):
+        """Returns a (low, high) bootstrap confidence interval for the mean,
+        or for the given percentile.
+
+        Uses the Poisson bootstrap on the histogram: each round draws a new
+        count for every bucket instead of drawing `n` samples, so this
+        takes O(buckets * rounds) time, independent of `n`.
+        """
+
+        if not self.n:
+            raise ValueError("no samples")
+
+        values, counts = self._histogram()
+
+        rand = random.Random(seed)
+        results = []
+        while len(results) < rounds:
+            resampled = [_poisson(rand, count) for count in counts]
+            total = sum(resampled)
+            if not total:
+                continue
+            results.append(
+                _stat_from_counts(values, resampled, total, percentile))
+        results.sort()
+
+        alpha = (1.0 - level) / 2
+        low = results[int(alpha * (rounds - 1))]
+        high = results[int(math.ceil((1 - alpha) * (rounds - 1)))]
+        return low, high
+
+    def summary(self):
+        """Returns a dict with all statistics, suitable for JSON"""
+
+        low, high = self.bootstrap_ci()
+        return {
+            "n": self.n,
+            "mean": self.mean,
+            "stdev": self.stdev,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "mean_ci95": [low, high],
+        }
+
+
+class Measurement(Stats):
+    """Per call timings as returned by measure().
+
+    `converged` is False if find_steady_state() gave up before the timings
+    were stable and None if the number of warmup rounds was fixed.
+    """
+
+    def __init__(self, loops, warmup_rounds, converged=None, *args,
+                 **kwargs):
+        super(Measurement, self).__init__(*args, **kwargs)
+        self.loops = loops
+        self.warmup_rounds = warmup_rounds
+        self.converged = converged
+
+    def summary(self):
+        summary = super(Measurement, self).summary()
+        summary["loops"] = self.loops
+        summary["warmup_rounds"] = self.warmup_rounds
+        summary["converged"] = self.converged
+        return summary
+
+
 timer = timeit.default_timer
 
+
+def run_loops(func, args, loops):
+    """Returns the time it takes to call func(*args) `loops` times"""
+
+    t = timer()
+    for i in xrange(loops):
+        func(*args)
+    return timer() - t
+
+
+def autorange(func, args=(), min_time=0.01):
+    """Returns the number of loops (1, 2, 5, 10, 20, 50, ...) needed for
+    calling func(*args) to take at least `min_time` seconds, like
+    timeit.Timer.autorange() in Python 3.6+.
+    """
+
+    base = 1
+    while True:
+        for factor in (1, 2, 5):
+            loops = base * factor
+            if run_loops(func, args, loops) >= min_time:
+                return loops
+        base *= 10
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def find_steady_state(func, args=(), loops=1, window=50, tolerance=0.05,
+                      max_rounds=3000):
+    """Runs rounds of `loops` calls until the timings are stationary and
+    returns the number of rounds this took.
+
+    After each `window` rounds the median of the window gets compared with
+    the one of the previous window, once they differ by less than
+    `tolerance` (relative) the JIT is considered warmed up. Medians are used
+    so single GC pauses don't prevent detection. Gives up after
+    `max_rounds`.
+
+    Returns:
+        tuple: (rounds, converged), converged is False if it gave up
+    """
+
+    previous = None
+    rounds = 0
+    while rounds < max_rounds:
+        current = [run_loops(func, args, loops) for i in xrange(window)]
+        rounds += window
+        current = _median(current)
+        if previous is not None and \
+                abs(current - previous) <= tolerance * previous:
+            return rounds, True
+        previous = current
+    return rounds, False
+
+
+def measure(func, args=(), rounds=1000, loops=None, warmup=None,
+            min_time=0.01):
+    """Measures func(*args) and returns a Measurement with per call timings.
+
+    Args:
+        rounds (int): number of measured rounds
+        loops (int): calls per round, or None to pick it with autorange()
+        warmup (int): rounds to discard, or None to use find_steady_state()
+        min_time (float): minimum round duration for autorange()
+    Returns:
+        Measurement
+    """
+
+    if loops is None:
+        # the first call can be a lot slower (allocations, lazy setup), so
+        # don't let it decide the number of loops
+        func(*args)
+        loops = autorange(func, args, min_time)
+
+    converged = None
+    if warmup is None:
+        warmup, converged = find_steady_state(func, args, loops)
+    else:
+        for i in xrange(warmup):
+            run_loops(func, args, loops)
+
+    stats = Measurement(loops, warmup, converged)
+    for i in xrange(rounds):
+        stats.add(run_loops(func, args, loops) / loops)
+    return stats
+
+
 def has_jit_enabled():
     try:
         import pypyjit
@@ -35,8 +336,239 @@ def has_jit_enabled():
     return res[0]
 
 
+def get_exec_metadata():
+    """Returns a dict describing the running interpreter"""
+
+    return {
+        "vm": platform.python_implementation(),
+        "version": ", ".join(sys.version.splitlines()),
+        "jit": has_jit_enabled(),
+    }
+
+
 def get_exec_info():
-    return "VM: %s, Version: %s, JIT: %d" % (
-        platform.python_implementation(),
-        ", ".join(sys.version.splitlines()),
-        has_jit_enabled())
+    return "VM: %(vm)s, Version: %(version)s, JIT: %(jit)d" % \
+        get_exec_metadata()
+
+
+# If set, report() appends JSON records to the file named by it.
+# run_matrix.py sets it together with the other BENCH_* variables.
+RESULTS_ENV = "BENCH_RESULTS"
+
+# If set, report() also adds the records to the resultdb database at this
+# path, see resultdb.py
+DB_ENV = "BENCH_DB"
+
+
+def write_record(path, record):
+    """Appends a record as a single JSON line to `path`"""
+
+    line = json.dumps(record, sort_keys=True) + "\n"
+    with open(path, "a") as h:
+        h.write(line)
+
+
+def report(name, values, backend=None, **extra):
+    """Records the timings of one measurement as a structured result.
+
+    Does nothing unless the benchmark runs under run_matrix.py (or
+    $BENCH_RESULTS or $BENCH_DB is set manually), so the printed output of
+    standalone runs stays the same.
+
+    Args:
+        name (str): what was measured, e.g. the benchmarked function
+        values (Stats or list): the timings in seconds
+        backend (str): the FFI backend, defaults to $BENCH_BACKEND
+        extra: additional JSON serializable fields
+    """
+
+    path = os.environ.get(RESULTS_ENV)
+    db_path = os.environ.get(DB_ENV)
+    if not path and not db_path:
+        return
+
+    if not isinstance(values, Stats):
+        values = Stats.from_values(values)
+
+    record = {
+        "type": "result",
+        "benchmark": os.environ.get(
+            "BENCH_NAME", os.path.basename(os.getcwd())),
+        "vm": os.environ.get("BENCH_VM"),
+        "backend": backend or os.environ.get("BENCH_BACKEND"),
+        "name": name,
+        "exec": get_exec_metadata(),
+        "time": time.time(),
+    }
+    record.update(values.summary())
+    record.update(extra)
+
+    if db_path:
+        # only import sqlite3 when needed
+        import resultdb
+        record["revision"] = resultdb.get_revision()
+        record["machine"] = resultdb.get_machine()
+        store = resultdb.ResultStore(db_path)
+        try:
+            store.add(record)
+        finally:
+            store.close()
+
+    if path:
+        write_record(path, record)
+
+
+def _parse_cpu_list(text):
+    """Parses the kernel CPU list format, e.g. "0-3,8" """
+
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read_sys_cpu_file(path):
+    try:
+        with open(os.path.join("/sys/devices/system/cpu", path)) as h:
+            return _parse_cpu_list(h.read())
+    except (IOError, OSError):
+        return []
+
+
+def _get_allowed_cpus():
+    """Returns the CPUs the process is allowed to run on"""
+
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    # Python 2 and PyPy
+    try:
+        with open("/proc/self/status") as h:
+            for line in h:
+                if line.startswith("Cpus_allowed_list:"):
+                    return _parse_cpu_list(line.split(":", 1)[1])
+    except (IOError, OSError):
+        pass
+    return _read_sys_cpu_file("online") or [0]
+
+
+def get_benchmark_cores():
+    """Returns the CPU cores to run benchmark processes on.
+
+    If the kernel has isolated cores (isolcpus=) the ones the process is
+    allowed to run on are used. Otherwise one logical CPU per physical core
+    the process is allowed to run on, leaving out CPU 0 (if there are
+    others) for the system and the scheduling process. Hyperthreading
+    siblings share execution units, so using them would make the results
+    depend on each other.
+    """
+
+    allowed = _get_allowed_cpus()
+
+    # only the ones we are allowed to use, run_matrix.py pins the
+    # benchmark processes which start processes themselves to one core
+    isolated = [c for c in _read_sys_cpu_file("isolated") if c in allowed]
+    if isolated:
+        return isolated
+
+    cores = []
+    seen = set()
+    for cpu in allowed:
+        siblings = _read_sys_cpu_file(
+            "cpu%d/topology/thread_siblings_list" % cpu) or [cpu]
+        key = min(siblings)
+        if key not in seen:
+            seen.add(key)
+            cores.append(cpu)
+
+    if len(cores) > 1 and cores[0] == 0:
+        del cores[0]
+    return cores
+
+
+def pin_command(core, argv):
+    """Returns `argv` changed to run on one CPU core, using taskset(1).
+
+    This doesn't use a preexec_fn calling os.sched_setaffinity(): the
+    commands get started from PinnedPool worker threads and preexec_fn
+    isn't safe to use in the presence of threads.
+    """
+
+    return ["taskset", "-c", str(core)] + list(argv)
+
+
+class PinnedPool(object):
+    """Runs independent work items in parallel, each one pinned to its own
+    CPU core.
+
+    There is one worker thread per core; the thread passes its core to the
+    work function which is expected to start a process pinned to it (see
+    pin_command()). The number of parallel jobs defaults to $BENCH_JOBS or
+    the number of cores.
+
+    Args:
+        jobs (int): maximum number of parallel jobs
+        cores (list): CPU cores to use, defaults to get_benchmark_cores()
+    """
+
+    def __init__(self, jobs=None, cores=None):
+        if cores is None:
+            cores = get_benchmark_cores()
+        if jobs is None:
+            jobs = int(os.environ.get("BENCH_JOBS", 0)) or len(cores)
+        self.cores = cores[:max(1, jobs)]
+
+    def map(self, func, items):
+        """Returns [func(core, item) for item in items], computed in parallel.
+
+        The first exception raised by `func` gets re-raised.
+        """
+
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+        lock = threading.Lock()
+        pending = iter(range(len(items)))
+
+        def worker(core):
+            while True:
+                with lock:
+                    if errors:
+                        return
+                    index = next(pending, None)
+                if index is None:
+                    return
+                try:
+                    results[index] = func(core, items[index])
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(core,))
+                   for core in self.cores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def check_output(self, commands, **kwargs):
+        """Like subprocess.check_output() for a list of commands.
+
+        Returns a list of (core, output) tuples in the order of `commands`.
+        """
+
+        def run(core, argv):
+            return core, subprocess.check_output(
+                pin_command(core, argv), **kwargs)
+
+        return self.map(run, commands)
@@ -25,6 +25,10 @@ python --version
 pip install --upgrade pycparser=="$PYCPARSER_VERSION"
 pip install --upgrade cffi=="$CFFI_VERSION"
 python main.py >> "$RESULT"
+python main.py threads
+python main.py callbacks
+python main.py strings
+python main.py strcache
 
 remove_cpython_env;
 
@@ -37,6 +41,10 @@ pip install --upgrade pycparser=="$PYCPARSER_VERSION"
 pip install --upgrade cffi=="$CFFI_VERSION"
 pypy main.py >> "$RESULT"
 pypy --jit off main.py nojit >> "$RESULT"
+pypy main.py threads
+pypy main.py callbacks
+pypy main.py strings
+pypy main.py strcache
 
 remove_pypy_env;
 
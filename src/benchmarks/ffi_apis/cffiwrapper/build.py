@@ -0,0 +1,32 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Builds the out-of-line (API mode) cffi module _noop_cffi, which is needed
+for callbacks declared with extern "Python" and @ffi.def_extern().
+"""
+
+import cffi
+
+
+ffi = cffi.FFI()
+ffi.cdef("""
+typedef void (*NoopCallback)(void*);
+void noop_invoke(NoopCallback, void*, size_t);
+extern "Python" void noop_extern_callback(void*);
+""")
+
+ffi.set_source(
+    "_noop_cffi", "#include <noop.h>",
+    include_dirs=["../libnoop"],
+    library_dirs=["../libnoop"],
+    libraries=["noop"])
+
+
+if __name__ == "__main__":
+    ffi.compile(tmpdir=".")
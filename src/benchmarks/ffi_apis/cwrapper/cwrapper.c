@@ -19,6 +19,25 @@ static PyObject* cwrapper_noop_str(PyObject* self, PyObject* args)
     return PyInt_FromSize_t(out);
 }
 
+/* unlike "s", "es" doesn't reuse an encoded copy cached in the unicode
+ * object, so text gets encoded on each call like in the other backends */
+static PyObject* cwrapper_noop_str_utf8(PyObject* self, PyObject* args)
+{
+    char* raw_string = NULL;
+    size_t out;
+
+    if (!PyArg_ParseTuple(args, "es", "utf-8", &raw_string))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS;
+    out = noop_str(raw_string);
+    Py_END_ALLOW_THREADS;
+
+    PyMem_Free(raw_string);
+
+    return PyInt_FromSize_t(out);
+}
+
 static PyObject* cwrapper_noop_double(PyObject* self, PyObject* args)
 {
     double value;
@@ -34,6 +53,104 @@ static PyObject* cwrapper_noop_double(PyObject* self, PyObject* args)
     return PyFloat_FromDouble(out_value);
 }
 
+static PyObject* cwrapper_noop_double_batch(PyObject* self, PyObject* args)
+{
+    PyObject *in_obj, *out_obj;
+    const void *in;
+    void *out;
+    Py_ssize_t in_len, out_len, n;
+
+    if (!PyArg_ParseTuple(args, "OOn", &in_obj, &out_obj, &n))
+        return NULL;
+
+    if (PyObject_AsReadBuffer(in_obj, &in, &in_len) == -1)
+        return NULL;
+    if (PyObject_AsWriteBuffer(out_obj, &out, &out_len) == -1)
+        return NULL;
+
+    if (n < 0 || in_len / sizeof(double) < (size_t)n ||
+            out_len / sizeof(double) < (size_t)n) {
+        PyErr_SetString(PyExc_ValueError, "buffer too small");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS;
+    noop_double_batch(in, out, n);
+    Py_END_ALLOW_THREADS;
+
+    Py_RETURN_NONE;
+}
+
+static PyObject* cwrapper_noop_block(PyObject* self, PyObject* args)
+{
+    unsigned int usec;
+
+    if (!PyArg_ParseTuple(args, "I", &usec))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS;
+    noop_block(usec);
+    Py_END_ALLOW_THREADS;
+
+    Py_RETURN_NONE;
+}
+
+typedef struct {
+    PyObject* callable;
+    PyObject* user_data;
+    int failed;
+} Trampoline;
+
+static void cwrapper_trampoline(void* data)
+{
+    Trampoline* trampoline = data;
+    PyGILState_STATE state;
+    PyObject* result;
+
+    state = PyGILState_Ensure();
+    /* skip the remaining calls once one has raised */
+    if (!trampoline->failed) {
+        result = PyObject_CallFunctionObjArgs(
+            trampoline->callable, trampoline->user_data, NULL);
+        if (result == NULL)
+            trampoline->failed = 1;
+        else
+            Py_DECREF(result);
+    }
+    PyGILState_Release(state);
+}
+
+static PyObject* cwrapper_noop_invoke(PyObject* self, PyObject* args)
+{
+    Trampoline trampoline;
+    Py_ssize_t n;
+
+    if (!PyArg_ParseTuple(args, "OOn", &trampoline.callable,
+                          &trampoline.user_data, &n))
+        return NULL;
+
+    if (!PyCallable_Check(trampoline.callable)) {
+        PyErr_SetString(PyExc_TypeError, "callback has to be callable");
+        return NULL;
+    }
+
+    if (n < 0) {
+        PyErr_SetString(PyExc_ValueError, "n has to be positive");
+        return NULL;
+    }
+
+    trampoline.failed = 0;
+
+    Py_BEGIN_ALLOW_THREADS;
+    noop_invoke(cwrapper_trampoline, &trampoline, (size_t)n);
+    Py_END_ALLOW_THREADS;
+
+    if (trampoline.failed)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 static PyObject* cwrapper_noop_void(PyObject* self) {
     Py_BEGIN_ALLOW_THREADS;
     noop_void();
@@ -45,8 +162,16 @@ static PyObject* cwrapper_noop_void(PyObject* self) {
 static PyMethodDef ctest_funcs[] = {
     {"noop_str", (PyCFunction)cwrapper_noop_str, 
      METH_VARARGS, ""},
+    {"noop_str_utf8", (PyCFunction)cwrapper_noop_str_utf8,
+     METH_VARARGS, ""},
     {"noop_double", (PyCFunction)cwrapper_noop_double, 
      METH_VARARGS, ""},
+    {"noop_double_batch", (PyCFunction)cwrapper_noop_double_batch,
+     METH_VARARGS, ""},
+    {"noop_block", (PyCFunction)cwrapper_noop_block,
+     METH_VARARGS, ""},
+    {"noop_invoke", (PyCFunction)cwrapper_noop_invoke,
+     METH_VARARGS, ""},
     {"noop_void", (PyCFunction)cwrapper_noop_void, 
      METH_NOARGS, ""},
     {NULL}
@@ -7,6 +7,8 @@
  * version 2.1 of the License, or (at your option) any later version.
  */
 
+#include <time.h>
+
 #include "noop.h"
 
 void noop_void(void) {
@@ -19,3 +21,26 @@ double noop_double(double foo) {
 size_t noop_str(char* foo) {
     return 42;
 }
+
+void noop_double_batch(const double* in, double* out, size_t n) {
+    size_t i;
+
+    for (i = 0; i < n; i++)
+        out[i] = noop_double(in[i]);
+}
+
+void noop_block(unsigned int usec) {
+    struct timespec ts;
+
+    /* like waiting for IO, without using the CPU */
+    ts.tv_sec = usec / 1000000;
+    ts.tv_nsec = (usec % 1000000) * 1000;
+    nanosleep(&ts, NULL);
+}
+
+void noop_invoke(NoopCallback callback, void* user_data, size_t n) {
+    size_t i;
+
+    for (i = 0; i < n; i++)
+        callback(user_data);
+}
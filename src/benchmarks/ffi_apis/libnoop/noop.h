@@ -6,5 +6,10 @@
 void noop_void(void);
 double noop_double(double);
 size_t noop_str(char*);
+void noop_double_batch(const double*, double*, size_t);
+void noop_block(unsigned int);
+
+typedef void (*NoopCallback)(void*);
+void noop_invoke(NoopCallback, void*, size_t);
  
 #endif
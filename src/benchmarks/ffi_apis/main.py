@@ -8,6 +8,7 @@
 
 import sys
 import math
+import array
 import timeit
 import platform
 sys.path.insert(0, "..")
@@ -16,29 +17,44 @@ from benchutils import *
 
 ROUNDS = 3000
 LOOP = 1000
-WARMUP_ROUNDS = 3000
+# fixed number of warmup rounds, None to wait for stable timings
+WARMUP_ROUNDS = None
 IMPLE_SUBFIX = "-nojit" if "nojit" in sys.argv else ""
-
-
-def time_function(func, args, desc, rounds=ROUNDS, warmup=WARMUP_ROUNDS):
-    global timer
-
+BACKENDS = ["capi", "ctypes", "cffi"]
+# threads mode: calls per thread and round, and how long noop_block blocks
+THREAD_ROUNDS = 20
+THREAD_CALLS = {"void": LOOP, "block": 100}
+BLOCK_USEC = 20
+MAX_THREADS = 8
+# callbacks mode: each round allocates up to LOOP trampolines
+CALLBACK_ROUNDS = 300
+# strings mode: sizes in bytes, the number of calls per round is picked
+# so a round takes at least STRING_MIN_TIME
+STRING_SIZES = [1, 16, 256, 4096, 65536, 1024 * 1024]
+STRING_ROUNDS = 200
+STRING_MIN_TIME = 0.001
+
+
+def time_function(func, args, desc, backend, rounds=ROUNDS,
+                  warmup=WARMUP_ROUNDS, variant=None):
     name = func.__name__
     impl = platform.python_implementation() + IMPLE_SUBFIX
-    timer = timer
-
-    # test ROUNDS rounds and return the best
-    results = []
-    for i in xrange(rounds + warmup):
-        t = timer()
-        func(*args)
-        results.append(timer() - t)
 
-    results = results[warmup:]
-    assert len(results) == rounds
+    # func loops LOOP times itself, so one call per round. Discard rounds
+    # until the timings are stable, then test ROUNDS rounds
+    stats = measure(func, args, rounds=rounds, loops=1, warmup=warmup)
+    assert len(stats) == rounds
 
-    print "%-10s %-10s %-15s %.15f %.15f" % (
-        impl, desc, name, average(results), stdev(results))
+    print >> sys.stderr, "%s: %d warmup rounds%s" % (
+        name, stats.warmup_rounds,
+        " (not converged)" if stats.converged is False else "")
+    print "%-10s %-10s %-15s %.15f %.15f %.15f %.15f %.15f" % (
+        impl, desc, name, stats.mean, stats.stdev, stats.percentile(50),
+        stats.percentile(95), stats.percentile(99))
+    if variant is not None:
+        # different ways to call the same function through one backend
+        name += "-" + variant
+    report(name, stats, backend=backend, loop=LOOP)
 
 
 def bench_void(func, loop=LOOP):
@@ -56,7 +72,77 @@ def bench_double(func, loop=LOOP):
         func(42.42)
 
 
+BATCH_VALUES = array.array("d", [42.42]) * LOOP
+
+
+def bench_double_batch(func, values=BATCH_VALUES):
+    # one call for all LOOP values
+    func(values)
+
+
+def bench_block(func, loop=THREAD_CALLS["block"]):
+    for i in xrange(loop):
+        func(BLOCK_USEC)
+
+
+def bench_void_timed(func, times, loop=LOOP):
+    for i in xrange(loop):
+        t = timer()
+        func()
+        times.append(timer() - t)
+
+
+def bench_block_timed(func, times, loop=THREAD_CALLS["block"]):
+    for i in xrange(loop):
+        t = timer()
+        func(BLOCK_USEC)
+        times.append(timer() - t)
+
+
+def callback(user_data):
+    pass
+
+
+def bench_invoke(invoke, trampoline, user_data):
+    # one call, C calls back LOOP times
+    invoke(trampoline, user_data, LOOP)
+
+
+def bench_invoke_new(invoke, make_callback, loop=LOOP):
+    # LOOP calls with one callback each, converting the callable each time
+    for i in xrange(loop):
+        trampoline, user_data = make_callback(callback)
+        invoke(trampoline, user_data, 1)
+
+
+def batch_double(call):
+    """Returns a function taking an array("d") of inputs and returning an
+    array("d") of results, calling call(inputs, outputs, n) once.
+    """
+
+    def batch(values):
+        out = array.array("d", [0.0]) * len(values)
+        call(values, out, len(values))
+        return out
+    return batch
+
+
 def main(argv):
+    # only run the passed backends, or all if none are passed
+    backends = [b for b in BACKENDS if b in argv[1:]] or BACKENDS
+
+    if "threads" in argv[1:]:
+        return bench_threads(backends)
+
+    if "callbacks" in argv[1:]:
+        return bench_callbacks(backends)
+
+    if "strings" in argv[1:]:
+        return bench_strings(backends)
+
+    if "strcache" in argv[1:]:
+        return bench_string_cache()
+
     #####################################################
 
     import threading
@@ -67,11 +153,25 @@ def main(argv):
 
     ### C-API ###########################################
 
-    from cwrapper import cwrapper
-    time_function(bench_void, [cwrapper.noop_void], "C-API")
-    time_function(bench_str, [cwrapper.noop_str], "C-API")
-    time_function(bench_double, [cwrapper.noop_double], "C-API")
+    if "capi" in backends:
+        from cwrapper import cwrapper
+        time_function(bench_void, [cwrapper.noop_void], "C-API", "capi")
+        time_function(bench_str, [cwrapper.noop_str], "C-API", "capi")
+        time_function(
+            bench_double, [cwrapper.noop_double], "C-API", "capi")
+        time_function(
+            bench_double_batch,
+            [batch_double(cwrapper.noop_double_batch)],
+            "C-API", "capi")
+
+    if "ctypes" in backends:
+        bench_ctypes()
 
+    if "cffi" in backends:
+        bench_cffi()
+
+
+def bench_ctypes():
     ### CTYPES ###########################################
 
     import ctypes
@@ -89,10 +189,22 @@ def main(argv):
     noop_void.argtypes = []
     noop_void.restype = None
 
-    time_function(bench_void, [noop_void], "ctypes")
-    time_function(bench_str, [noop_str], "ctypes")
-    time_function(bench_double, [noop_double], "ctypes")
+    noop_double_batch = libnoop.noop_double_batch
+    noop_double_batch.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+    noop_double_batch.restype = None
+
+    def call_batch(in_, out, n):
+        noop_double_batch(in_.buffer_info()[0], out.buffer_info()[0], n)
 
+    time_function(bench_void, [noop_void], "ctypes", "ctypes")
+    time_function(bench_str, [noop_str], "ctypes", "ctypes")
+    time_function(bench_double, [noop_double], "ctypes", "ctypes")
+    time_function(
+        bench_double_batch, [batch_double(call_batch)], "ctypes", "ctypes")
+
+
+def bench_cffi():
     ### CFFI ###########################################
 
     import cffi
@@ -102,16 +214,368 @@ def main(argv):
     void noop_void(void);
     double noop_double(double);
     size_t noop_str(char*);
+    void noop_double_batch(const double*, double*, size_t);
     """)
 
     c = ffi.dlopen("./libnoop/libnoop.so")
     noop_void = c.noop_void
     noop_double = c.noop_double
     noop_str = c.noop_str
+    noop_double_batch = c.noop_double_batch
+
+    def call_batch(in_, out, n):
+        noop_double_batch(
+            ffi.cast("double*", ffi.from_buffer(in_)),
+            ffi.cast("double*", ffi.from_buffer(out)), n)
+
+    time_function(bench_void, [noop_void], "cffi", "cffi")
+    time_function(bench_str, [noop_str], "cffi", "cffi")
+    time_function(bench_double, [noop_double], "cffi", "cffi")
+    time_function(
+        bench_double_batch, [batch_double(call_batch)], "cffi", "cffi")
+
 
-    time_function(bench_void, [noop_void], "cffi")
-    time_function(bench_str, [noop_str], "cffi")
-    time_function(bench_double, [noop_double], "cffi")
+def get_thread_functions(backend):
+    """Returns a non-blocking and a blocking function of libnoop, as
+    {"void": func, "block": func}
+    """
+
+    if backend == "capi":
+        from cwrapper import cwrapper
+        return {"void": cwrapper.noop_void, "block": cwrapper.noop_block}
+    elif backend == "ctypes":
+        import ctypes
+        libnoop = ctypes.CDLL("./libnoop/libnoop.so")
+
+        noop_void = libnoop.noop_void
+        noop_void.argtypes = []
+        noop_void.restype = None
+
+        noop_block = libnoop.noop_block
+        noop_block.argtypes = [ctypes.c_uint]
+        noop_block.restype = None
+
+        return {"void": noop_void, "block": noop_block}
+    else:
+        import cffi
+
+        ffi = cffi.FFI()
+        ffi.cdef("""
+        void noop_void(void);
+        void noop_block(unsigned int);
+        """)
+
+        c = ffi.dlopen("./libnoop/libnoop.so")
+        return {"void": c.noop_void, "block": c.noop_block}
+
+
+def run_threads(func, args, count):
+    """Calls func(*args) on `count` threads at the same time.
+
+    Returns:
+        tuple: the time until all threads are done and the time each thread
+            took
+    """
+
+    import threading
+
+    ready = threading.Semaphore(0)
+    start = threading.Event()
+    times = [None] * count
+    ends = [None] * count
+
+    def worker(index):
+        ready.release()
+        start.wait()
+        t = timer()
+        func(*args)
+        end = timer()
+        times[index] = end - t
+        ends[index] = end
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in xrange(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        ready.acquire()
+
+    t = timer()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return max(ends) - t, times
+
+
+def bench_threads(backends):
+    """Calls a non-blocking and a blocking function from 1 to MAX_THREADS
+    threads at once and prints the aggregate throughput and the latency of
+    each call. If a backend releases the GIL during the call, the
+    throughput of the blocking function scales with the number of threads.
+
+    The latency gets measured in separate rounds, as timing each call slows
+    down the non-blocking one considerably. The timer of Python 2 has a
+    resolution of about 1us, so its percentiles are only coarse.
+    """
+
+    impl = platform.python_implementation() + IMPLE_SUBFIX
+    benches = {"void": bench_void, "block": bench_block}
+    timed_benches = {"void": bench_void_timed, "block": bench_block_timed}
+
+    print >> sys.stderr, \
+        "%d rounds, noop_block blocks for %dus" % (THREAD_ROUNDS, BLOCK_USEC)
+    print "%-10s %-10s %-6s %7s %14s %14s %14s" % (
+        "impl", "backend", "func", "threads", "calls/s", "latency [us]",
+        "p95 [us]")
+
+    for backend in backends:
+        functions = get_thread_functions(backend)
+        for kind in ["void", "block"]:
+            bench = benches[kind]
+            calls = THREAD_CALLS[kind]
+            # warm up, mainly for the JIT
+            bench(functions[kind], calls)
+
+            for count in xrange(1, MAX_THREADS + 1):
+                throughput = Stats()
+                for i in xrange(THREAD_ROUNDS):
+                    wall, times = run_threads(
+                        bench, [functions[kind], calls], count)
+                    throughput.add(count * calls / wall)
+
+                latency = Stats()
+                for i in xrange(THREAD_ROUNDS):
+                    # list.append() is atomic, so the threads can share it
+                    call_times = []
+                    run_threads(timed_benches[kind],
+                                [functions[kind], call_times, calls], count)
+                    for t in call_times:
+                        latency.add(t)
+
+                print "%-10s %-10s %-6s %7d %14.0f %14.3f %14.3f" % (
+                    impl, backend, kind, count, throughput.mean,
+                    latency.mean * 1e6, latency.percentile(95) * 1e6)
+                report("threads-%s-%d" % (kind, count), latency,
+                       backend=backend, threads=count, calls=calls,
+                       throughput=throughput.mean)
+
+
+def get_callback_functions(backend):
+    """Returns (desc, invoke, make_callback) tuples for calling noop_invoke
+    through the backend. invoke(trampoline, user_data, n) calls noop_invoke
+    and make_callback(callable) returns the trampoline and user data for a
+    Python callable.
+    """
+
+    if backend == "capi":
+        from cwrapper import cwrapper
+
+        # the C trampoline calls the callable with the user data
+        return [("C-API", cwrapper.noop_invoke, lambda f: (f, None))]
+    elif backend == "ctypes":
+        import ctypes
+        libnoop = ctypes.CDLL("./libnoop/libnoop.so")
+
+        NoopCallback = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+        noop_invoke = libnoop.noop_invoke
+        noop_invoke.argtypes = [
+            NoopCallback, ctypes.c_void_p, ctypes.c_size_t]
+        noop_invoke.restype = None
+
+        return [("ctypes", noop_invoke, lambda f: (NoopCallback(f), None))]
+    else:
+        import cffi
+        import wrapgen
+
+        ffi = cffi.FFI()
+        ffi.cdef("""
+        typedef void (*NoopCallback)(void*);
+        void noop_invoke(NoopCallback, void*, size_t);
+        """)
+        c = ffi.dlopen("./libnoop/libnoop.so")
+
+        def make_callback(f):
+            return ffi.callback("NoopCallback", f), ffi.NULL
+
+        cache = wrapgen.CallbackCache(
+            wrapgen.CFFIBackend(ffi, c), "NoopCallback")
+
+        def make_cached_callback(f):
+            return cache.get(f), ffi.NULL
+
+        functions = [
+            ("cffi", c.noop_invoke, make_callback),
+            ("cffi-cache", c.noop_invoke, make_cached_callback),
+        ]
+
+        # def_extern needs the API mode module from cffiwrapper, so one
+        # static trampoline which gets the callable through the user data
+        try:
+            from cffiwrapper._noop_cffi import ffi as ext_ffi, lib
+        except ImportError:
+            print >> sys.stderr, "cffiwrapper not built, skipping def_extern"
+        else:
+            @ext_ffi.def_extern()
+            def noop_extern_callback(user_data):
+                ext_ffi.from_handle(user_data)(user_data)
+
+            def make_extern_callback(f):
+                return lib.noop_extern_callback, ext_ffi.new_handle(f)
+
+            functions.append(
+                ("cffi-extern", lib.noop_invoke, make_extern_callback))
+
+        return functions
+
+
+def bench_callbacks(backends):
+    """Calls back into Python from C through each backend.
+
+    bench_invoke measures the callback itself, bench_invoke_new also the
+    conversion of the callable to a native trampoline on each call, which
+    is what happens when connecting a signal handler for example.
+    """
+
+    print >> sys.stderr, \
+        "%d callbacks, avg of %d runs" % (LOOP, CALLBACK_ROUNDS)
+
+    for backend in backends:
+        for desc, invoke, make_callback in get_callback_functions(backend):
+            trampoline, user_data = make_callback(callback)
+            time_function(bench_invoke, [invoke, trampoline, user_data],
+                          desc, backend, rounds=CALLBACK_ROUNDS,
+                          variant=desc)
+            time_function(bench_invoke_new, [invoke, make_callback],
+                          desc, backend, rounds=CALLBACK_ROUNDS,
+                          variant=desc)
+
+
+def get_string_functions(backend):
+    """Returns functions passing a bytes and a text string to noop_str.
+    Except for the C-API, which encodes text itself, text gets encoded
+    like the wrappers generated by pgi do.
+    """
+
+    if backend == "capi":
+        from cwrapper import cwrapper
+        return cwrapper.noop_str, cwrapper.noop_str_utf8
+    elif backend == "ctypes":
+        import ctypes
+        libnoop = ctypes.CDLL("./libnoop/libnoop.so")
+
+        noop_str = libnoop.noop_str
+        noop_str.argtypes = [ctypes.c_char_p]
+        noop_str.restype = ctypes.c_size_t
+    else:
+        import cffi
+
+        ffi = cffi.FFI()
+        ffi.cdef("size_t noop_str(char*);")
+        noop_str = ffi.dlopen("./libnoop/libnoop.so").noop_str
+
+    def noop_str_text(text):
+        return noop_str(text.encode("utf-8"))
+
+    return noop_str, noop_str_text
+
+
+def print_string_stats(impl, desc, name, stats):
+    print "%-10s %-10s %-22s %12.3f %12.3f %12.3f %8d" % (
+        impl, desc, name, stats.mean * 1e6, stats.percentile(50) * 1e6,
+        stats.percentile(95) * 1e6, stats.loops)
+
+
+def bench_strings(backends):
+    """Passes ASCII strings of STRING_SIZES as bytes and as text and
+    prints the time per call.
+    """
+
+    impl = platform.python_implementation() + IMPLE_SUBFIX
+
+    print "%-10s %-10s %-22s %12s %12s %12s %8s" % (
+        "impl", "backend", "input", "mean [us]", "p50 [us]", "p95 [us]",
+        "loops")
+
+    for backend in backends:
+        noop_str, noop_str_text = get_string_functions(backend)
+        for size in STRING_SIZES:
+            for kind, func, value in [
+                    ("bytes", noop_str, b"a" * size),
+                    ("text", noop_str_text, u"a" * size)]:
+                stats = measure(func, [value], rounds=STRING_ROUNDS,
+                                min_time=STRING_MIN_TIME)
+                name = "%s-%d" % (kind, size)
+                print_string_stats(impl, backend, name, stats)
+                report("str-" + name, stats, backend=backend, size=size)
+
+
+def check_reserved_names(backend):
+    """Makes sure wrapgen handles arguments named like Python keywords and
+    builtins, which are common in GI.
+    """
+
+    import wrapgen
+
+    functions = [
+        (wrapgen.Function(
+            "noop_double", [wrapgen.Arg("float", "double")], "double"),
+         1.5, 1.5, "x"),
+        (wrapgen.Function(
+            "noop_str", [wrapgen.Arg("type", "utf8")], "size_t"),
+         u"foo", 42, 1),
+        (wrapgen.Function(
+            "noop_str", [wrapgen.Arg("from", "utf8")], "size_t"),
+         b"foo", 42, None),
+    ]
+
+    for mode in wrapgen.MODES:
+        for func, value, result, bad in functions:
+            wrapper = wrapgen.create_function(func, backend, mode)
+            assert wrapper(value) == result
+            try:
+                wrapper(bad)
+            except TypeError as e:
+                assert repr(func.args[0].name) in str(e), e
+            else:
+                raise AssertionError("%r accepted" % bad)
+
+
+def bench_string_cache():
+    """Calls noop_str through wrapgen generated wrappers with a constant
+    text, like get_property() calls with a property name, with and without
+    a StringCache.
+    """
+
+    import cffi
+    import wrapgen
+
+    impl = platform.python_implementation() + IMPLE_SUBFIX
+
+    ffi = cffi.FFI()
+    ffi.cdef("""
+    double noop_double(double);
+    size_t noop_str(char*);
+    """)
+    backend = wrapgen.CFFIBackend(ffi, ffi.dlopen("./libnoop/libnoop.so"))
+    check_reserved_names(backend)
+
+    func = wrapgen.Function(
+        "noop_str", [wrapgen.Arg("text", "utf8")], "size_t")
+
+    print "%-10s %-10s %-22s %12s %12s %12s %8s" % (
+        "impl", "backend", "wrapper", "mean [us]", "p50 [us]", "p95 [us]",
+        "loops")
+
+    for mode in wrapgen.MODES:
+        for cached in [False, True]:
+            strings = wrapgen.StringCache() if cached else None
+            wrapper = wrapgen.create_function(
+                func, backend, mode, strings=strings)
+            stats = measure(wrapper, [u"name"], rounds=STRING_ROUNDS,
+                            min_time=STRING_MIN_TIME)
+            name = mode + ("-cache" if cached else "")
+            print_string_stats(impl, "cffi", name, stats)
+            report("strcache-" + name, stats, backend="cffi")
 
 
 if __name__ == "__main__":
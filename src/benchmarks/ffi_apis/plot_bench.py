@@ -14,23 +14,29 @@ import fileinput
 
 
 def generate_png(data, output_name, max_y=None, bbox_to_anchor=None):
+    # Tango, used in turn if there are more categories
     colors = [
         '#729fcf', '#3465a4', '#204a87',
         '#8ae234', '#73d216', '#4e9a06',
         '#ad7fa8', '#75507b', '#5c3566',
+        '#fcaf3e', '#f57900', '#ce5c00',
+        '#e9b96e', '#c17d11', '#8f5902',
+        '#ef2929', '#cc0000', '#a40000',
     ]
 
     cats = {}
 
     for line in filter(None, data.splitlines()):
-        impl, api, name, dur, err = line.split()
+        # the remaining columns are p50, p95 and p99
+        impl, api, name, dur, err = line.split()[:5]
         cat_key = impl + " " + name.split("_")[-1]
         cats.setdefault(cat_key, []).append((api, float(dur), float(err)))
     cats = sorted(cats.items())
 
     N = len(cats[0][1])
     ind = np.arange(N)
-    width = 0.09
+    # all categories of one API share 0.9 of the space
+    width = 0.9 / len(cats)
     offset = width
 
     fig = plt.figure()
@@ -40,14 +46,15 @@ def generate_png(data, output_name, max_y=None, bbox_to_anchor=None):
 
     for i, (cat, values) in enumerate(cats):
         durs = [a[1] * 1000 for a in values]
-        ax.bar(ind + i * width + offset, durs, width, color=colors[i])
+        ax.bar(ind + i * width + offset, durs, width, align="center",
+               color=colors[i % len(colors)])
 
-    title = 'Called 1000 times, avg of 3000 (3000 warmup)'
+    title = 'Called 1000 times, avg of 3000 (adaptive warmup)'
 
     plt.ylim(ymax=max_y)
     ax.set_ylabel('Duration [ms]')
     ax.set_title(title)
-    ax.set_xticks(ind + (width * N * 2) + offset)
+    ax.set_xticks(ind + width * (len(cats) - 1) / 2.0 + offset)
     ax.set_xticklabels([a[0] for a in cats[0][1]])
 
     l = ax.legend([a[0] for a in cats], bbox_to_anchor=bbox_to_anchor)
@@ -16,15 +16,22 @@ source ../venv_tools.sh;
 setup_pypy;
 
 setup_cpython_env;
+python build_ool.py
 python main.py python bench-cffilib.py
+python main.py python bench-cffi-ool.py
 python main.py python bench-clib.py
+rm -f _ool_*.py*
 remove_cpython_env;
 
 setup_pypy_env;
+python build_ool.py
 python main.py python bench-cffilib.py
+python main.py python bench-cffi-ool.py
 python main.py python bench-clib.py
 python main.py python --jit off bench-cffilib.py
+python main.py python --jit off bench-cffi-ool.py
 python main.py python --jit off bench-clib.py
+rm -f _ool_*.py*
 remove_pypy_env;
 
 remove_pypy;
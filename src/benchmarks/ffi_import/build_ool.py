@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Builds out-of-line ABI mode cffi modules for the C definitions of
+pgi.cffilib (glib, gobject and girepository), so they can be loaded without
+parsing any C code at import time. See ool.py for how they get used.
+
+Needs to be run with each interpreter, as the generated modules contain
+data specific to the cffi version.
+"""
+
+import os
+import sys
+import hashlib
+
+from distutils.sysconfig import get_python_lib
+pgi_path = os.path.join(get_python_lib(), "pgi")
+sys.path.insert(0, pgi_path)
+
+import cffi
+
+from cffilib.glib._cdef import GLIB_CDEF
+from cffilib.gobject._cdef import GOBJECT_CDEF
+from cffilib.gir._cdef import GIR_CDEF
+
+
+INDEX_MODULE = "_ool_index"
+
+
+def cdef_hash(source):
+    if not isinstance(source, bytes):
+        source = source.encode("utf-8")
+    return hashlib.sha1(source).hexdigest()
+
+
+def main(argv):
+    target = os.path.dirname(os.path.abspath(__file__))
+
+    glib = cffi.FFI()
+    glib.cdef(GLIB_CDEF)
+    glib.set_source("_ool_glib", None)
+
+    gobject = cffi.FFI()
+    gobject.include(glib)
+    gobject.cdef(GOBJECT_CDEF)
+    gobject.set_source("_ool_gobject", None)
+
+    gir = cffi.FFI()
+    gir.include(gobject)
+    gir.cdef(GIR_CDEF)
+    gir.set_source("_ool_gir", None)
+
+    index = {}
+    for name, builder, source in [("_ool_glib", glib, GLIB_CDEF),
+                                  ("_ool_gobject", gobject, GOBJECT_CDEF),
+                                  ("_ool_gir", gir, GIR_CDEF)]:
+        builder.compile(tmpdir=target)
+        index[cdef_hash(source)] = name
+
+    with open(os.path.join(target, INDEX_MODULE + ".py"), "w") as h:
+        h.write("# generated by build_ool.py, maps cdef hashes to modules\n")
+        h.write("MODULES = %r\n" % index)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
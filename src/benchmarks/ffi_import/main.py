@@ -6,6 +6,13 @@
 # License as published by the Free Software Foundation; either
 # version 2.1 of the License, or (at your option) any later version.
 
+"""
+Runs the passed command 1000 times and prints statistics of the printed
+import times. The processes are independent, so they are spread over the
+available cores, each pinned to one (set BENCH_JOBS=1 to run them
+serially).
+"""
+
 import subprocess
 import sys
 sys.path.insert(0, "..")
@@ -14,11 +21,21 @@ from benchutils import *
 
 def main(argv):
     print argv[-1], subprocess.check_output(argv[1:-1] + ["info.py"])
-    values = []
-    for i in xrange(1000):
-        data = subprocess.check_output(argv[1:]).strip()
-        values.append(float(data))
-    print average(values), stdev(values)
+
+    pool = PinnedPool()
+    print >> sys.stderr, "running on cores %r" % pool.cores
+    results = pool.check_output([argv[1:]] * 1000)
+
+    stats = Stats()
+    samples = []
+    for core, data in results:
+        value = float(data.strip())
+        stats.add(value)
+        samples.append((core, value))
+
+    print stats.mean, stats.stdev, stats.percentile(50), \
+        stats.percentile(95), stats.percentile(99)
+    report(argv[-1], stats, cores=pool.cores, samples=samples)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Makes pgi.cffilib use the out-of-line modules built by build_ool.py.
+
+pgi.cffilib creates its FFI objects through cffi.FFI() followed by
+ffi.include() and ffi.cdef(). While precompiled() is active cffi.FFI gets
+replaced by PrecompiledFFI, which looks up the module built for the passed
+C definitions instead of parsing them.
+"""
+
+import hashlib
+from contextlib import contextmanager
+
+import cffi
+
+from _ool_index import MODULES
+
+
+class PrecompiledFFI(object):
+    """Stand-in for cffi.FFI which forwards to a precompiled FFI object"""
+
+    def __init__(self, *args, **kwargs):
+        self._ffi = None
+
+    def include(self, ffi_to_include):
+        # the precompiled module already includes its dependencies
+        pass
+
+    def cdef(self, csource, **kwargs):
+        if not isinstance(csource, bytes):
+            csource = csource.encode("utf-8")
+        name = MODULES.get(hashlib.sha1(csource).hexdigest())
+        if name is None:
+            raise ValueError(
+                "No precompiled module for cdef, rerun build_ool.py")
+        self._ffi = __import__(name).ffi
+
+    def __getattr__(self, name):
+        if self._ffi is None:
+            raise AttributeError(name)
+        return getattr(self._ffi, name)
+
+
+@contextmanager
+def precompiled():
+    old = cffi.FFI
+    cffi.FFI = PrecompiledFFI
+    try:
+        yield
+    finally:
+        cffi.FFI = old
@@ -8,24 +8,17 @@
 
 """
 Passes an array of 1000 int to a C function, using cffi or the CPython C API
+
+Besides lists ("norm" and "taint") it passes buffers of C int without
+copying: array.array("i"), bytes, memoryview and NumPy int32 arrays, if
+available.
 """
 
 import sys
 import time
-import math
-
-
-def average(r):
-    return float(sum(r)) / len(r)
-
-
-def variance(r):
-    avg = average(r)
-    return float(sum(map(lambda x: (x - avg) ** 2, r))) / (len(r) - 1)
-
-
-def stdev(r):
-    return math.sqrt(variance(r))
+import array
+sys.path.insert(0, "..")
+from benchutils import Stats, report
 
 
 def check_error_handling(func):
@@ -52,14 +45,102 @@ def check_error_handling(func):
         raise AssertionError("missing type error")
 
 
-def run(func, rounds=1000, taint=False):
+def check_buffer_error_handling(func):
+    """Like check_error_handling() but for the buffer path"""
+
+    func(array.array("i"))
+
+    for obj in [array.array("d", [1.0]), b"abc", [1, 2]]:
+        try:
+            func(obj)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("missing type error for %r" % obj)
+
+
+INT_SIZE = array.array("i").itemsize
+_NATIVE = "<" if sys.byteorder == "little" else ">"
+
+
+def _is_c_contiguous(view):
+    stride = view.itemsize
+    for dim, dim_stride in reversed(list(zip(view.shape, view.strides))):
+        if dim > 1 and dim_stride != stride:
+            return False
+        stride *= dim
+    return True
+
+
+def check_int_buffer(obj):
+    """Makes sure `obj` is a C contiguous buffer of C int, or of raw bytes
+    with a size which is a multiple of sizeof(int). Doesn't copy.
+
+    Raises TypeError otherwise.
+    """
+
+    # array.array only supports the old buffer interface in Python 2
+    if isinstance(obj, array.array):
+        if obj.typecode != "i":
+            raise TypeError("expected a buffer of C int")
+        return obj
+    elif isinstance(obj, bytes):
+        if len(obj) % INT_SIZE:
+            raise TypeError("expected a buffer of C int")
+        return obj
+
+    view = memoryview(obj)
+    format_ = view.format
+    if format_[:1] in ("@", "=", _NATIVE):
+        format_ = format_[1:]
+    if format_ in ("B", "b", "c") and view.itemsize == 1:
+        size = 1
+        for dim in view.shape:
+            size *= dim
+        if size % INT_SIZE:
+            raise TypeError("expected a buffer of C int")
+    elif format_ != "i" or view.itemsize != INT_SIZE:
+        raise TypeError("expected a buffer of C int")
+    if not _is_c_contiguous(view):
+        raise TypeError("expected a C contiguous buffer")
+    return obj
+
+
+def get_buffers():
+    """Returns a list of (name, buffer) for all available buffer types,
+    each containing 1000 int.
+    """
+
+    a = array.array("i", range(1000))
+    data = a.tobytes() if hasattr(a, "tobytes") else a.tostring()
+    try:
+        view = memoryview(a)
+    except TypeError:
+        # Python 2
+        view = memoryview(bytearray(data))
+
+    buffers = [("array", a), ("memoryview", view), ("bytes", data)]
+
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        buffers.append(("numpy", numpy.arange(1000, dtype=numpy.int32)))
+
+    return buffers
+
+
+def run(func, rounds=1000, taint=False, data=None):
     """taint will add a object to the list and remove it again; this will
     switch the storage strategy the passed list for PyPy from int to object.
+
+    If data is given it gets passed instead of the list.
     """
 
-    l = list(range(1000))
+    l = list(range(1000)) if data is None else data
 
-    if taint:
+    if data is None and taint:
         l.append(object())
         l.pop(-1)
 
@@ -68,23 +149,33 @@ def run(func, rounds=1000, taint=False):
     except ImportError:
         pass
     else:
-        print __pypy__.strategy(l)
+        if data is None:
+            print __pypy__.strategy(l)
 
-    results = []
+    stats = Stats()
     for i in xrange(rounds):
         t = time.time()
         for i in xrange(1000):
             func(l)
-        results.append(time.time() - t)
-    return results
+        stats.add(time.time() - t)
+    return stats
+
+
+def format_stats(stats):
+    """mean, stdev, p50, p95 and p99 in ms"""
+
+    return " ".join(str(v * 1000) for v in [
+        stats.mean, stats.stdev, stats.percentile(50), stats.percentile(95),
+        stats.percentile(99)])
 
 
 def main(mode):
 
-    if mode == "cpython-capi":
-        from cwrapper.cwrapper import int_list_args
+    if mode in ("cpython-capi", "capi"):
+        from cwrapper.cwrapper import int_list_args, int_buffer_args
 
         func = int_list_args
+        buffer_func = int_buffer_args
 
     else:
         import cffi
@@ -96,17 +187,30 @@ def main(mode):
         def func(l):
             int_list_args(ffi.new("int[]", l))
 
+        def buffer_func(obj):
+            int_list_args(
+                ffi.cast("int*", ffi.from_buffer(check_int_buffer(obj))))
+
     check_error_handling(func)
     run(func, 1000)
     res = run(func, 1000)
     print "----", mode
-    print "norm ", average(res) * 1000, stdev(res) * 1000
+    print "norm ", format_stats(res)
+    report("norm", res)
     res = run(func, 1000, taint=True)
-    print "taint", average(res) * 1000, stdev(res) * 1000
+    print "taint", format_stats(res)
+    report("taint", res)
+
+    check_buffer_error_handling(buffer_func)
+    for name, data in get_buffers():
+        run(buffer_func, 1000, data=data)
+        res = run(buffer_func, 1000, data=data)
+        print "%-5s" % name, format_stats(res)
+        report(name, res)
 
 
 if __name__ == "__main__":
-    modes = ["pypy-cffi", "cpython-cffi", "cpython-capi"]
+    modes = ["pypy-cffi", "cpython-cffi", "cpython-capi", "cffi", "capi"]
     mode = sys.argv[1]
     assert mode in modes
     main(mode)
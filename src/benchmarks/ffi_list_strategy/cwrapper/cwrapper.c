@@ -18,6 +18,7 @@
 #include <Python.h>
 #include <noop.h>
 #include <limits.h>
+#include <string.h>
 
 
 static PyObject* cwrapper_int_list_args(PyObject* self, PyObject* args)
@@ -61,9 +62,97 @@ error:
     return NULL;
 }
 
+/* Returns 1 if format describes a native C int, 0 if it describes raw
+ * bytes and -1 otherwise. */
+static int int_format_kind(const char *format, Py_ssize_t itemsize)
+{
+    if (format == NULL)
+        return 0;
+
+    if (format[0] == '@' || format[0] == '=')
+        format++;
+#ifdef WORDS_BIGENDIAN
+    else if (format[0] == '>' || format[0] == '!')
+#else
+    else if (format[0] == '<')
+#endif
+        format++;
+
+    if (itemsize == 1 && (strcmp(format, "B") == 0 ||
+            strcmp(format, "b") == 0 || strcmp(format, "c") == 0))
+        return 0;
+    if (itemsize == sizeof(int) && (strcmp(format, "i") == 0 ||
+            (sizeof(long) == sizeof(int) && strcmp(format, "l") == 0)))
+        return 1;
+    return -1;
+}
+
+static PyObject* cwrapper_int_buffer_args(PyObject* self, PyObject* args)
+{
+    PyObject *obj, *typecode;
+    Py_buffer view;
+    const void *buf;
+    Py_ssize_t len;
+    int kind;
+
+    if (!PyArg_ParseTuple(args, "O", &obj))
+        return NULL;
+
+    if (PyObject_CheckBuffer(obj)) {
+        if (PyObject_GetBuffer(
+                obj, &view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) == -1)
+            return NULL;
+
+        kind = int_format_kind(view.format, view.itemsize);
+        if (kind == -1 || (kind == 0 && view.len % sizeof(int))) {
+            PyBuffer_Release(&view);
+            PyErr_SetString(PyExc_TypeError, "expected a buffer of C int");
+            return NULL;
+        }
+
+        Py_BEGIN_ALLOW_THREADS;
+        int_list_args((int *)view.buf);
+        Py_END_ALLOW_THREADS;
+
+        PyBuffer_Release(&view);
+        Py_RETURN_NONE;
+    }
+
+    /* array.array only supports the old buffer interface, which doesn't
+     * know about the item type */
+    typecode = PyObject_GetAttrString(obj, "typecode");
+    if (typecode != NULL) {
+        kind = PyString_Check(typecode) &&
+            strcmp(PyString_AS_STRING(typecode), "i") == 0;
+        Py_DECREF(typecode);
+        if (!kind) {
+            PyErr_SetString(PyExc_TypeError, "expected a buffer of C int");
+            return NULL;
+        }
+    } else {
+        PyErr_Clear();
+    }
+
+    if (PyObject_AsReadBuffer(obj, &buf, &len) == -1)
+        return NULL;
+
+    if (len % sizeof(int)) {
+        PyErr_SetString(PyExc_TypeError, "expected a buffer of C int");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS;
+    int_list_args((int *)buf);
+    Py_END_ALLOW_THREADS;
+
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef ctest_funcs[] = {
     {"int_list_args", (PyCFunction)cwrapper_int_list_args, 
      METH_VARARGS, ""},
+    {"int_buffer_args", (PyCFunction)cwrapper_int_buffer_args,
+     METH_VARARGS, ""},
     {NULL}
 };
 
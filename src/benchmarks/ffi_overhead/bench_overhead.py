@@ -4,7 +4,15 @@ import math
 import sys
 
 sys.path.insert(0, "..")
-from benchutils import average, stdev, timer
+from benchutils import measure, report
+import wrapgen
+
+
+OVERHEAD = wrapgen.Function("overhead", [
+    wrapgen.Arg("list_", "int32[]", length="num"),
+    wrapgen.Arg("num", "size_t"),
+    wrapgen.Arg("text", "utf8", nullable=True),
+], return_type="int32", throws=True)
 
 
 def create_function():
@@ -56,14 +64,30 @@ int overhead(int32_t* list, size_t num, char* utf8, int* error);
     return func
 
 
-def benchmark_function(func, *args):
-    r = []
-    for i in xrange(3000):
-        t = timer()
-        for i in xrange(5000):
-            func(*args)
-        r.append(timer() - t)
-    return "%.5f" % (average(r) * 1000), "%.5f" % (stdev(r) * 1000)
+def create_generated_function(mode):
+    """Creates a wrapper using wrapgen, mode is one of wrapgen.MODES"""
+
+    ffi = cffi.FFI()
+    ffi.cdef(OVERHEAD.get_cdef())
+    c = ffi.dlopen("./liboverhead/liboverhead.so")
+    return wrapgen.create_function(
+        OVERHEAD, wrapgen.CFFIBackend(ffi, c), mode)
+
+
+def benchmark_function(func, *args, **kwargs):
+    name = kwargs.pop("name", None)
+
+    # 5000 calls per round, warmup until the timings are stable
+    stats = measure(func, args, rounds=3000, loops=5000)
+    if name is not None:
+        report(name, stats)
+    scale = 5000 * 1000
+    warmup = "warmup=%d" % stats.warmup_rounds
+    if stats.converged is False:
+        warmup += " (not converged)"
+    return "%.5f" % (stats.mean * scale), "%.5f" % (stats.stdev * scale), \
+        "%.5f" % (stats.percentile(99) * scale), \
+        warmup
 
 
 def test_function(func):
@@ -106,9 +130,8 @@ def main():
         wrapped = cwrapper.overhead
         test_function(wrapped)
 
-        # warmup
-        benchmark_function(wrapped, [1, 2, 3, 4], u"foobar")
-        print "wrapped", benchmark_function(wrapped, [1, 2, 3, 4], u"foobar")
+        print "wrapped", benchmark_function(
+            wrapped, [1, 2, 3, 4], u"foobar", name="wrapped")
         return
 
     func = create_function()
@@ -117,13 +140,18 @@ def main():
     # verify that the wrapper fulfills all requirements
     test_function(wrapped)
 
-    # warmup
-    benchmark_function(wrapped, [1, 2, 3, 4], u"foobar")
-    print "wrapped", benchmark_function(wrapped, [1, 2, 3, 4], u"foobar")
+    print "wrapped", benchmark_function(
+        wrapped, [1, 2, 3, 4], u"foobar", name="wrapped")
+
+    for mode in wrapgen.MODES:
+        generated = create_generated_function(mode)
+        test_function(generated)
+        print mode, benchmark_function(
+            generated, [1, 2, 3, 4], u"foobar", name=mode)
 
     ffi = cffi.FFI()
-    benchmark_function(func, [1, 2, 3, 4], 4, b"foobar", ffi.NULL)
-    print "bare", benchmark_function(func, [1, 2, 3, 4], 4, b"foobar", ffi.NULL)
+    print "bare", benchmark_function(
+        func, [1, 2, 3, 4], 4, b"foobar", ffi.NULL, name="bare")
 
 
 if __name__ == "__main__":
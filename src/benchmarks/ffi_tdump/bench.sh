@@ -17,6 +17,10 @@ echo "pypy cffi"
 python tdump_bench.py cffi
 echo "pypy ctypes"
 python tdump_bench.py ctypes
+echo "pypy cffi index"
+python tdump_bench.py cffi index
+echo "pypy ctypes stream"
+python tdump_bench.py ctypes stream
 
 deactivate
 
@@ -31,6 +35,10 @@ echo "cpython cffi"
 python tdump_bench.py cffi
 echo "cpython ctypes"
 python tdump_bench.py ctypes
+echo "cpython cffi index"
+python tdump_bench.py cffi index
+echo "cpython ctypes stream"
+python tdump_bench.py ctypes stream
 
 # cleanup
 
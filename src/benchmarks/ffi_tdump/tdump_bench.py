@@ -5,9 +5,18 @@
 # License as published by the Free Software Foundation; either
 # version 2.1 of the License, or (at your option) any later version.
 
+import os
 import sys
-import math
+import json
 import time
+import subprocess
+import multiprocessing
+sys.path.insert(0, "..")
+sys.path.insert(0, os.path.join("..", "gc_resource"))
+from benchutils import Stats, report, get_benchmark_cores
+from sampler import Sampler
+
+import typelib_index
 
 if "cffi" in sys.argv[1:]:
     from pgi.cffilib.gir import *
@@ -21,19 +30,41 @@ def sort_infos(infos):
     return sorted(infos, key=lambda i: i.name)
 
 
-def handle_list(infos, skip_abi=False):
+def plain(value):
+    """Converts a shown value to None, bool, int or str"""
+
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    elif isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, (int, long)):
+        # enums and flags are int subclasses
+        return int(value)
+    elif isinstance(value, list):
+        return [plain(v) for v in value]
+    return str(value)
+
+
+def handle_list(infos, skip_abi=False, record=False):
     l = []
     for info in sort_infos(infos):
         obj = dict()
-        handle(info, obj, skip_abi=skip_abi)
+        handle(info, obj, skip_abi=skip_abi, record=record)
         l.append(obj)
     return l
 
 
-def handle(info, obj, skip_abi=False, minimal=False):
+def handle(info, obj, skip_abi=False, minimal=False, record=False):
+    """Fills `obj` with the info type and its child infos. If `record` is
+    True all shown values get stored as well.
+
+    describe() walks the infos the same way for the event stream,
+    check_events() makes sure the two agree.
+    """
 
     def show(name, value):
-        pass
+        if record:
+            obj[name] = plain(value)
 
     def showt(type_):
         obj["type"] = type_.__name__
@@ -41,7 +72,7 @@ def handle(info, obj, skip_abi=False, minimal=False):
     def sub(name, info, minimal=False):
         new = dict()
         obj[name] = new
-        handle(info, new, skip_abi=skip_abi, minimal=minimal)
+        handle(info, new, skip_abi=skip_abi, minimal=minimal, record=record)
 
     def abi(value):
         if skip_abi:
@@ -54,7 +85,8 @@ def handle(info, obj, skip_abi=False, minimal=False):
         func = getattr(info, "get_%s" % name)
         for child in sort_infos(func()):
             new = dict()
-            handle(child, new, skip_abi=skip_abi, minimal=minimal)
+            handle(child, new, skip_abi=skip_abi, minimal=minimal,
+                   record=record)
             l.append(new)
 
     if not info:
@@ -66,12 +98,12 @@ def handle(info, obj, skip_abi=False, minimal=False):
         showt(GIBaseInfo)
         show("namespace", info.namespace)
         show("name", info.name)
-        show("type", info.type)
+        show("info_type", info.type)
         if minimal:
             return
         show("is_deprecated", info.is_deprecated)
-        for name, value in sorted(info.iterate_attributes()):
-            show("attribute", "%s=%s" % (name, value))
+        show("attributes", ["%s=%s" % (name, value) for name, value in
+                            sorted(info.iterate_attributes())])
 
     if isinstance(info, GICallableInfo):
         showt(GICallableInfo)
@@ -80,8 +112,8 @@ def handle(info, obj, skip_abi=False, minimal=False):
         show("may_return_null", info.may_return_null)
         show("skip_return", info.skip_return)
         show("caller_owns", info.caller_owns)
-        for name, value in sorted(info.iterate_return_attributes()):
-            show("return_attribute", "%s=%s" % (name, value))
+        show("return_attributes", ["%s=%s" % (name, value) for name, value
+                                   in sorted(info.iterate_return_attributes())])
         sublist("args", info)
         sub("return_type", info.get_return_type())
 
@@ -169,7 +201,7 @@ def handle(info, obj, skip_abi=False, minimal=False):
         show("direction", info.direction)
         show("ownership_transfer", info.ownership_transfer)
         show("scope", info.scope)
-        sub("type", info.get_type())
+        sub("type_info", info.get_type())
         show("may_be_null", info.may_be_null)
         show("is_caller_allocates", info.is_caller_allocates)
         show("is_optional", info.is_optional)
@@ -177,18 +209,18 @@ def handle(info, obj, skip_abi=False, minimal=False):
         show("is_skip", info.is_skip)
     elif isinstance(info, GIConstantInfo):
         showt(GIConstantInfo)
-        sub("type", info.get_type())
+        sub("type_info", info.get_type())
     elif isinstance(info, GIFieldInfo):
         showt(GIFieldInfo)
         show("flags", info.flags)
         show("offset", abi(info.offset))
         show("size", abi(info.size))
-        sub("type", info.get_type())
+        sub("type_info", info.get_type())
     elif isinstance(info, GIPropertyInfo):
         showt(GIPropertyInfo)
         show("flags", info.flags)
         show("ownership_transfer", info.ownership_transfer)
-        sub("type", info.get_type())
+        sub("type_info", info.get_type())
     elif isinstance(info, GITypeInfo):
         showt(GITypeInfo)
         show("is_pointer", info.is_pointer)
@@ -206,7 +238,264 @@ def handle(info, obj, skip_abi=False, minimal=False):
         assert 0, info.type
 
 
-def get_dump(typelib_path, skip_abi):
+_TYPE, _SHOW, _SUB, _SUBLIST = range(4)
+
+
+def iter_list_events(infos, skip_abi=False):
+    """Like handle_list() but yields flat (path, key, value) tuples instead
+    of building a tree. Only the child list currently traversed on each
+    level is kept in memory.
+    """
+
+    for i, info in enumerate(sort_infos(infos)):
+        for event in iter_events(info, (i,), skip_abi=skip_abi):
+            yield event
+
+
+def iter_events(info, path, skip_abi=False, minimal=False):
+    """Yields (path, key, value) for `info` and all its child infos.
+
+    `path` is a tuple of the keys and list positions leading to the info.
+    """
+
+    for op, name, value, sub_minimal in describe(info, skip_abi, minimal):
+        if op == _SHOW:
+            yield path, name, plain(value)
+        elif op == _TYPE:
+            yield path, name, value
+        elif op == _SUB:
+            for event in iter_events(value, path + (name,), skip_abi,
+                                     sub_minimal):
+                yield event
+        else:
+            children = sort_infos(getattr(value, "get_%s" % name)())
+            for i, child in enumerate(children):
+                for event in iter_events(child, path + (name, i), skip_abi,
+                                         sub_minimal):
+                    yield event
+
+
+def write_events(events, h):
+    """Writes events as "path<TAB>key<TAB>JSON value" lines to `h`"""
+
+    for path, key, value in events:
+        h.write("%s\t%s\t%s\n" % (
+            "/".join(map(str, path)), key, json.dumps(value)))
+
+
+def events_to_tree(events):
+    """Builds the tree handle_list() returns from the events of
+    iter_list_events(). Infos without values, like missing ones, have no
+    events and are left out.
+    """
+
+    tree = []
+    for path, key, value in events:
+        obj = tree
+        for i, part in enumerate(path):
+            if isinstance(obj, list):
+                while len(obj) <= part:
+                    obj.append({})
+                obj = obj[part]
+            elif i + 1 < len(path) and isinstance(path[i + 1], int):
+                obj = obj.setdefault(part, [])
+            else:
+                obj = obj.setdefault(part, {})
+        obj[key] = value
+    return tree
+
+
+def prune(obj):
+    """Returns `obj` without empty dicts and lists"""
+
+    if isinstance(obj, dict):
+        obj = dict((k, prune(v)) for k, v in obj.items())
+        return dict((k, v) for k, v in obj.items() if v not in ({}, []))
+    elif isinstance(obj, list):
+        obj = [prune(v) for v in obj]
+        return [v for v in obj if v not in ({}, [])]
+    return obj
+
+
+def check_events(typelib_path):
+    """Raises if the event stream of the typelib doesn't describe the same
+    tree as handle_list(), as both walk the infos on their own.
+    """
+
+    tree = prune(get_dump(typelib_path, False, record=True))
+    rebuilt = prune(events_to_tree(get_events(typelib_path, False)))
+    if tree != rebuilt:
+        raise AssertionError(
+            "events of %s differ from the tree dump" % typelib_path)
+
+
+def describe(info, skip_abi=False, minimal=False):
+    """Yields (op, name, value, minimal) tuples describing `info`.
+
+    _TYPE and _SHOW carry a value of the info, _SUB a child info and
+    _SUBLIST the info whose get_<name>() returns the child infos.
+
+    This walks the infos like handle() does, which is kept separate so the
+    timing benchmark doesn't include the generator overhead.
+    """
+
+    def abi(value):
+        if skip_abi:
+            return "(SKIP_ABI)"
+        return value
+
+    if not info:
+        return
+
+    assert isinstance(info, GIBaseInfo)
+
+    if int(info.type) != GIInfoType.TYPE:
+        yield _TYPE, "type", GIBaseInfo.__name__, False
+        yield _SHOW, "namespace", info.namespace, False
+        yield _SHOW, "name", info.name, False
+        yield _SHOW, "info_type", info.type, False
+        if minimal:
+            return
+        yield _SHOW, "is_deprecated", info.is_deprecated, False
+        yield _SHOW, "attributes", [
+            "%s=%s" % (name, value) for name, value in
+            sorted(info.iterate_attributes())], False
+
+    if isinstance(info, GICallableInfo):
+        yield _TYPE, "type", GICallableInfo.__name__, False
+
+        yield _SHOW, "can_throw_gerror", info.can_throw_gerror, False
+        yield _SHOW, "may_return_null", info.may_return_null, False
+        yield _SHOW, "skip_return", info.skip_return, False
+        yield _SHOW, "caller_owns", info.caller_owns, False
+        yield _SHOW, "return_attributes", [
+            "%s=%s" % (name, value) for name, value in
+            sorted(info.iterate_return_attributes())], False
+        yield _SUBLIST, "args", info, False
+        yield _SUB, "return_type", info.get_return_type(), False
+
+        if isinstance(info, GIFunctionInfo):
+            yield _TYPE, "type", GIFunctionInfo.__name__, False
+            yield _SHOW, "flags", info.flags, False
+            yield _SHOW, "symbol", info.symbol, False
+            # if isinstance(info.get_container(), GIInterfaceInfo):
+            #     yield _SUB, "property", info.get_property(), False
+        elif isinstance(info, GICallbackInfo):
+            yield _TYPE, "type", GICallbackInfo.__name__, False
+        elif isinstance(info, GISignalInfo):
+            yield _TYPE, "type", GISignalInfo.__name__, False
+            yield _SHOW, "flags", info.flags, False
+            yield _SHOW, "true_stops_emit", info.true_stops_emit, False
+            yield _SUB, "class_closure", info.get_class_closure(), False
+        elif isinstance(info, GIVFuncInfo):
+            yield _TYPE, "type", GIVFuncInfo.__name__, False
+            yield _SHOW, "flags", info.flags, False
+            yield _SHOW, "offset", abi(info.offset), False
+            yield _SUB, "signal", info.get_signal(), False
+            yield _SUB, "invoker", info.get_invoker(), True
+        else:
+            assert 0
+    elif isinstance(info, GIRegisteredTypeInfo):
+        yield _TYPE, "type", GIRegisteredTypeInfo.__name__, False
+        yield _SHOW, "type_name", info.type_name, False
+        yield _SHOW, "type_init ", info.type_init, False
+
+        if isinstance(info, GIEnumInfo):
+            yield _TYPE, "type", GIEnumInfo.__name__, False
+            yield _SHOW, "storage_type ", info.storage_type, False
+            yield _SUBLIST, "values", info, False
+            yield _SHOW, "error_domain", info.error_domain, False
+        elif isinstance(info, GIInterfaceInfo):
+            yield _TYPE, "type", GIInterfaceInfo.__name__, False
+            yield _SUB, "iface_struct", info.get_iface_struct(), False
+            yield _SUBLIST, "prerequisites", info, True
+            yield _SUBLIST, "properties", info, False
+            yield _SUBLIST, "methods", info, False
+            yield _SUBLIST, "signals", info, False
+            yield _SUBLIST, "vfuncs", info, False
+            yield _SUBLIST, "constants", info, False
+        elif isinstance(info, GIObjectInfo):
+            yield _TYPE, "type", GIObjectInfo.__name__, False
+            yield _SHOW, "abstract", info.abstract, False
+            yield _SHOW, "fundamental", info.fundamental, False
+            yield _SHOW, "type_name", info.type_name, False
+            yield _SHOW, "type_init", info.type_init, False
+            yield _SUBLIST, "constants", info, False
+            yield _SUBLIST, "fields", info, False
+            yield _SUBLIST, "interfaces", info, False
+            yield _SUBLIST, "methods", info, False
+            yield _SUBLIST, "properties", info, False
+            yield _SUBLIST, "signals", info, False
+            yield _SUBLIST, "vfuncs", info, False
+            yield _SUB, "class_struct", info.get_class_struct(), False
+            yield _SHOW, "ref_function", info.ref_function, False
+            yield _SHOW, "unref_function", info.unref_function, False
+            yield _SHOW, "set_value_function", info.set_value_function, False
+            yield _SHOW, "get_value_function ", info.get_value_function, False
+        elif isinstance(info, GIStructInfo):
+            yield _TYPE, "type", GIStructInfo.__name__, False
+            yield _SHOW, "size", abi(info.size), False
+            yield _SHOW, "alignment", abi(info.alignment), False
+            yield _SHOW, "is_gtype_struct", info.is_gtype_struct, False
+            yield _SHOW, "is_foreign", info.is_foreign, False
+            yield _SUBLIST, "fields", info, False
+            yield _SUBLIST, "methods", info, False
+        elif isinstance(info, GIUnionInfo):
+            yield _TYPE, "type", GIUnionInfo.__name__, False
+            yield _SHOW, "size", abi(info.size), False
+            yield _SHOW, "alignment", abi(info.alignment), False
+            yield _SHOW, "is_discriminated", info.is_discriminated, False
+            yield _SHOW, "discriminator_offset", info.discriminator_offset, False
+            yield _SUB, "discriminator_type", info.get_discriminator_type(), False
+            yield _SUBLIST, "fields", info, False
+            yield _SUBLIST, "methods", info, False
+        else:
+            assert 0
+    elif isinstance(info, GIArgInfo):
+        yield _TYPE, "type", GIArgInfo.__name__, False
+        yield _SHOW, "closure", info.closure, False
+        yield _SHOW, "destroy", info.destroy, False
+        yield _SHOW, "direction", info.direction, False
+        yield _SHOW, "ownership_transfer", info.ownership_transfer, False
+        yield _SHOW, "scope", info.scope, False
+        yield _SUB, "type_info", info.get_type(), False
+        yield _SHOW, "may_be_null", info.may_be_null, False
+        yield _SHOW, "is_caller_allocates", info.is_caller_allocates, False
+        yield _SHOW, "is_optional", info.is_optional, False
+        yield _SHOW, "is_return_value", info.is_return_value, False
+        yield _SHOW, "is_skip", info.is_skip, False
+    elif isinstance(info, GIConstantInfo):
+        yield _TYPE, "type", GIConstantInfo.__name__, False
+        yield _SUB, "type_info", info.get_type(), False
+    elif isinstance(info, GIFieldInfo):
+        yield _TYPE, "type", GIFieldInfo.__name__, False
+        yield _SHOW, "flags", info.flags, False
+        yield _SHOW, "offset", abi(info.offset), False
+        yield _SHOW, "size", abi(info.size), False
+        yield _SUB, "type_info", info.get_type(), False
+    elif isinstance(info, GIPropertyInfo):
+        yield _TYPE, "type", GIPropertyInfo.__name__, False
+        yield _SHOW, "flags", info.flags, False
+        yield _SHOW, "ownership_transfer", info.ownership_transfer, False
+        yield _SUB, "type_info", info.get_type(), False
+    elif isinstance(info, GITypeInfo):
+        yield _TYPE, "type", GITypeInfo.__name__, False
+        yield _SHOW, "is_pointer", info.is_pointer, False
+        yield _SHOW, "tag", info.tag, False
+        yield _SUB, "interface", info.get_interface(), True
+        yield _SHOW, "array_length", info.array_length, False
+        yield _SHOW, "array_fixed_size", info.array_fixed_size, False
+        yield _SHOW, "is_zero_terminated", info.is_zero_terminated, False
+        if int(info.tag) == GITypeTag.ARRAY:
+            yield _SHOW, "array_type", info.array_type, False
+    elif isinstance(info, GIValueInfo):
+        yield _TYPE, "type", GIValueInfo.__name__, False
+        yield _SHOW, "value", info.value_, False
+    else:
+        assert 0, info.type
+
+
+def get_dump(typelib_path, skip_abi, record=False):
     with open(typelib_path, "rb") as h:
         data = h.read()
 
@@ -214,38 +503,268 @@ def get_dump(typelib_path, skip_abi):
     repo = GIRepository.get_default()
     namespace = repo.load_typelib(typelib, 0)
     infos = repo.get_infos(namespace)
-    handle_list(infos, skip_abi=skip_abi)
+    return handle_list(infos, skip_abi=skip_abi, record=record)
+
+
+def get_events(typelib_path, skip_abi):
+    """Like get_dump() but returns an iterator of events, see iter_events()
+    """
+
+    with open(typelib_path, "rb") as h:
+        data = h.read()
+
+    typelib = GITypelib.new_from_memory(data)
+    repo = GIRepository.get_default()
+    namespace = repo.load_typelib(typelib, 0)
+    infos = repo.get_infos(namespace)
+    return iter_list_events(infos, skip_abi=skip_abi)
+
+
+def query_index(nodes):
+    """Reads all values of all infos from the index, the equivalent of
+    what handle_list() does through libgirepository.
+    """
+
+    for node in nodes:
+        list(node.iter_values())
+        query_index(node.children())
+
+
+def get_dump_indexed(typelib_path, skip_abi, cache_dir=None):
+    """Like get_dump() but answers from the persistent index if there is
+    one for the typelib and creates it otherwise.
 
+    Returns True if the index was used.
+    """
 
-def benchmark():
+    with open(typelib_path, "rb") as h:
+        data = h.read()
+
+    index = typelib_index.open_index(data, cache_dir)
+    if index is not None:
+        try:
+            query_index(index.get_infos())
+        finally:
+            index.close()
+        return True
+
+    tree = get_dump(typelib_path, skip_abi, record=True)
+    typelib_index.write_index(
+        typelib_index.get_index_path(data, cache_dir), tree,
+        typelib_index.typelib_hash(data))
+    return False
+
+
+def benchmark(func=get_dump):
     t = time.time()
-    get_dump("Gtk-3.0.typelib", False)
+    func("Gtk-3.0.typelib", False)
     return time.time() - t
 
 
-def average(r):
-    return float(sum(r)) / len(r)
+def main_index():
+    """Compares creating the index (cold) with querying it (warm)"""
 
+    with open("Gtk-3.0.typelib", "rb") as h:
+        path = typelib_index.get_index_path(h.read())
+
+    cold = Stats()
+    warm = Stats()
+    for i in xrange(10):
+        if os.path.exists(path):
+            os.unlink(path)
+        cold.add(benchmark(get_dump_indexed))
+        warm.add(benchmark(get_dump_indexed))
 
-def variance(r):
-    avg = average(r)
-    return float(sum(map(lambda x: (x - avg) ** 2, r))) / (len(r) - 1)
+    for name, stats in [("cold", cold), ("warm", warm)]:
+        print name, stats.mean, stats.stdev, stats.percentile(50), \
+            stats.percentile(95)
+        report("Gtk-3.0-index-" + name, stats)
 
 
-def stdev(r):
-    return math.sqrt(variance(r))
+def dump_namespace(typelib_path):
+    """Pool worker: returns (namespace, JSON dump, seconds, pid)"""
+
+    t = time.time()
+    with open(typelib_path, "rb") as h:
+        data = h.read()
+    typelib = GITypelib.new_from_memory(data)
+    repo = GIRepository.get_default()
+    namespace = repo.load_typelib(typelib, 0)
+    tree = handle_list(repo.get_infos(namespace), record=True)
+    dump = json.dumps(tree, sort_keys=True)
+    return namespace, dump, time.time() - t, os.getpid()
+
+
+def find_typelibs(paths):
+    """Expands directories in `paths` to the typelibs they contain"""
+
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, e) for e in sorted(os.listdir(path))
+                         if e.endswith(".typelib"))
+        else:
+            found.append(path)
+    return found
+
+
+def main_multi(args):
+    """Dumps multiple typelibs in parallel, one namespace per worker process.
+
+    tdump_bench.py cffi|ctypes multi [-o dump.json] [TYPELIB|DIR ...]
+
+    Without paths all typelibs in $GI_TYPELIB_PATH are dumped.
+    """
+
+    output = None
+    if "-o" in args:
+        pos = args.index("-o")
+        output = args[pos + 1]
+        del args[pos:pos + 2]
+
+    paths = args or [
+        p for p in os.environ.get("GI_TYPELIB_PATH", "").split(os.pathsep)
+        if p]
+    typelibs = find_typelibs(paths)
+    assert typelibs, "no typelibs found"
+
+    jobs = int(os.environ.get("BENCH_JOBS", 0)) or len(get_benchmark_cores())
+    # a fresh process per namespace, as each can only be loaded once
+    pool = multiprocessing.Pool(processes=jobs, maxtasksperchild=1)
+    t = time.time()
+    results = pool.map(dump_namespace, typelibs, chunksize=1)
+    total = time.time() - t
+    pool.close()
+    pool.join()
+
+    results.sort()
+    for namespace, dump, seconds, pid in results:
+        print "%-20s pid=%-7d %.4f" % (namespace, pid, seconds)
+    worker_time = sum(r[2] for r in results)
+    print "-> total %.4f, sum of workers %.4f, %d jobs" % (
+        total, worker_time, jobs)
+    report("multi", [total], namespaces=len(results), jobs=jobs,
+           workers=dict((r[0], r[2]) for r in results))
+
+    if output is not None:
+        with open(output, "wb") as h:
+            h.write(b"{")
+            for i, (namespace, dump, seconds, pid) in enumerate(results):
+                if i:
+                    h.write(b", ")
+                h.write(json.dumps(namespace).encode("utf-8"))
+                h.write(b": ")
+                h.write(dump.encode("utf-8"))
+            h.write(b"}\n")
+
+
+def dump_memory(kind, h):
+    """Dumps Gtk as a JSON tree or as an event stream to `h`"""
+
+    if kind == "tree":
+        tree = get_dump("Gtk-3.0.typelib", False, record=True)
+        json.dump(tree, h)
+    else:
+        write_events(get_events("Gtk-3.0.typelib", False), h)
+
+
+def main_memory(kind):
+    """Child process of main_stream(): prints the time needed for one dump
+    and the RSS before it as JSON.
+    """
+
+    import resource
+
+    sampler = Sampler(os.getpid())
+    base_rss = sampler.read_rss()
+    sampler.close()
+
+    with open(os.devnull, "w") as h:
+        t = time.time()
+        dump_memory(kind, h)
+        seconds = time.time() - t
+        # ru_maxrss is in KiB on Linux
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    print json.dumps({
+        "seconds": seconds, "max_rss": max_rss, "base_rss": base_rss})
+
+
+def run_memory(backend, kind, rate=1000.0):
+    """Runs main_memory() in a child process while sampling its RSS.
+
+    Returns the result of the child, extended with the sampled peak RSS.
+    """
+
+    p = subprocess.Popen(
+        [sys.executable, sys.argv[0], backend, "memory", kind],
+        stdout=subprocess.PIPE)
+    sampler = Sampler(p.pid, rate)
+    interval = 1.0 / rate
+    peak_rss = 0
+    while p.poll() is None:
+        try:
+            peak_rss = max(peak_rss, sampler.read_rss())
+        except (IOError, OSError, ValueError):
+            # process exited
+            break
+        time.sleep(interval)
+    sampler.close()
+    output = p.communicate()[0]
+    assert p.returncode == 0, p.returncode
+
+    result = json.loads(output.decode("utf-8").splitlines()[-1])
+    result["peak_rss"] = peak_rss
+    return result
+
+
+def main_stream():
+    """Compares building the full tree with streaming events, each in a
+    fresh process so the peak memory usage isn't shared.
+
+    The RSS of the child gets sampled, the growth from before the dump to
+    the sampled peak is what the dump needed.
+    """
+
+    check_events("Gtk-3.0.typelib")
+
+    backend = "cffi" if "cffi" in sys.argv[1:] else "ctypes"
+    results = {}
+    for kind in ["tree", "stream"]:
+        results[kind] = [run_memory(backend, kind) for i in xrange(5)]
+
+    for kind in ["tree", "stream"]:
+        samples = results[kind]
+        seconds = Stats.from_values([s["seconds"] for s in samples])
+        max_rss = max(s["max_rss"] for s in samples)
+        growth = max(s["peak_rss"] - s["base_rss"] for s in samples)
+        print "%-6s %.4f %.4f max_rss=%.1fMiB growth=%.1fMiB" % (
+            kind, seconds.mean, seconds.stdev, max_rss / 1024.0 ** 2,
+            growth / 1024.0 ** 2)
+        report("Gtk-3.0-" + kind, seconds, max_rss=max_rss,
+               rss_growth=growth)
 
 
 def main():
+    if "index" in sys.argv[1:]:
+        return main_index()
+    elif "memory" in sys.argv[1:]:
+        return main_memory(sys.argv[sys.argv.index("memory") + 1])
+    elif "stream" in sys.argv[1:]:
+        return main_stream()
+    elif "multi" in sys.argv[1:]:
+        return main_multi(sys.argv[sys.argv.index("multi") + 1:])
+
     # warmup
     for i in xrange(20):
         print benchmark()
 
-    r = []
+    stats = Stats()
     for i in xrange(10):
-        r.append(benchmark())
+        stats.add(benchmark())
 
-    print average(r), stdev(r)
+    print stats.mean, stats.stdev, stats.percentile(50), stats.percentile(95)
+    report("Gtk-3.0", stats)
 
 
 if __name__ == "__main__":
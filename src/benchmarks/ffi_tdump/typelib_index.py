@@ -0,0 +1,331 @@
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+A compact binary index of the tree produced by tdump_bench.handle_list(),
+which can be queried through mmap without loading it as a whole.
+
+The file consists of a header followed by three tables:
+
+* strings: uint32 offsets followed by the UTF-8 data of all (deduplicated)
+  strings, terminated by a final offset
+* nodes: one fixed size record per info, in breadth first order, so the
+  children of each node are stored next to each other
+* values: one fixed size record per shown value, grouped by node
+
+Files are keyed by the SHA-1 of the typelib they were created from and
+rebuilt whenever FORMAT_VERSION changes.
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from collections import deque
+
+try:
+    long
+except NameError:
+    long = int
+
+
+MAGIC = b"TDIX"
+FORMAT_VERSION = 2
+
+# magic, version, string count, node count, value count, root count,
+# typelib sha1
+_HEADER = struct.Struct("<4sIIIII20s")
+# kind, key, first child, child count, first value, value count
+_NODE = struct.Struct("<IIIIII")
+# key, tag, payload
+_VALUE = struct.Struct("<IIq")
+_OFFSET = struct.Struct("<I")
+
+# _UINT is for values not fitting the signed payload (uint64 > 2**63 - 1),
+# stored as two's complement
+_NONE, _BOOL, _INT, _STR, _UINT = range(5)
+_INT64_MAX = 2 ** 63 - 1
+
+
+def typelib_hash(data):
+    return hashlib.sha1(data).digest()
+
+
+def get_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "tdump-index")
+
+
+def get_index_path(data, cache_dir=None):
+    """Returns the index path for the typelib content `data`"""
+
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    return os.path.join(
+        cache_dir, "%s.tdix" % hashlib.sha1(data).hexdigest())
+
+
+class _StringTable(object):
+
+    def __init__(self):
+        self._index = {}
+        self.strings = []
+
+    def add(self, string):
+        if isinstance(string, bytes):
+            string = string.decode("utf-8")
+        try:
+            return self._index[string]
+        except KeyError:
+            self._index[string] = len(self.strings)
+            self.strings.append(string)
+            return self._index[string]
+
+    def pack(self):
+        data = [s.encode("utf-8") for s in self.strings]
+        offsets = []
+        offset = 0
+        for entry in data:
+            offsets.append(offset)
+            offset += len(entry)
+        offsets.append(offset)
+        packed_offsets = struct.pack("<%dI" % len(offsets), *offsets)
+        return packed_offsets + b"".join(data)
+
+
+def _split(obj):
+    """Splits a tree dict into (kind, values, children)"""
+
+    kind = obj.get("type", "")
+    values = []
+    children = []
+    for key in sorted(obj):
+        if key == "type":
+            continue
+        value = obj[key]
+        if isinstance(value, dict):
+            children.append((key, value))
+        elif isinstance(value, list) and value and \
+                isinstance(value[0], dict):
+            children.extend((key, v) for v in value)
+        elif isinstance(value, list):
+            values.extend((key, v) for v in value)
+        else:
+            values.append((key, value))
+    return kind, values, children
+
+
+def write_index(path, tree, data_hash):
+    """Writes the output of handle_list() to `path`.
+
+    The file gets written to a temporary file first and renamed, so
+    concurrent readers never see a partial index.
+    """
+
+    strings = _StringTable()
+    nodes = []
+    values = []
+
+    # breadth first, so the children of each node are contiguous
+    queue = deque(("", obj) for obj in tree)
+    next_index = len(queue)
+    while queue:
+        key, obj = queue.popleft()
+        kind, node_values, children = _split(obj)
+
+        first_value = len(values)
+        for value_key, value in node_values:
+            if value is None:
+                tag, payload = _NONE, 0
+            elif isinstance(value, bool):
+                tag, payload = _BOOL, int(value)
+            elif isinstance(value, (int, long)) and value > _INT64_MAX:
+                tag, payload = _UINT, value - 2 ** 64
+            elif isinstance(value, (int, long)):
+                tag, payload = _INT, value
+            else:
+                tag, payload = _STR, strings.add(value)
+            values.append(_VALUE.pack(strings.add(value_key), tag, payload))
+
+        nodes.append(_NODE.pack(
+            strings.add(kind), strings.add(key), next_index, len(children),
+            first_value, len(node_values)))
+        next_index += len(children)
+        queue.extend(children)
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(strings.strings), len(nodes),
+        len(values), len(tree), data_hash)
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+    fd, temp_path = tempfile.mkstemp(dir=dirname or None, suffix=".tmp")
+    try:
+        os.chmod(temp_path, 0o644)
+        with os.fdopen(fd, "wb") as h:
+            h.write(header)
+            h.write(b"".join(nodes))
+            h.write(b"".join(values))
+            h.write(strings.pack())
+        os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+class Node(object):
+    """A view of one info in the index"""
+
+    __slots__ = ("_index", "_pos", "kind", "key", "_first_child",
+                 "_child_count", "_first_value", "_value_count")
+
+    def __init__(self, index, pos):
+        self._index = index
+        self._pos = pos
+        (kind, key, self._first_child, self._child_count,
+         self._first_value, self._value_count) = _NODE.unpack_from(
+            index._map, index._nodes_offset + pos * _NODE.size)
+        self.kind = index.get_string(kind)
+        self.key = index.get_string(key)
+
+    def __repr__(self):
+        return "<Node kind=%s name=%r>" % (self.kind, self.name)
+
+    @property
+    def name(self):
+        return self.get("name")
+
+    def iter_values(self):
+        """Yields (key, value) for all shown values of the info"""
+
+        index = self._index
+        offset = index._values_offset + self._first_value * _VALUE.size
+        for i in range(self._value_count):
+            key, tag, payload = _VALUE.unpack_from(index._map, offset)
+            offset += _VALUE.size
+            if tag == _NONE:
+                value = None
+            elif tag == _BOOL:
+                value = bool(payload)
+            elif tag == _INT:
+                value = payload
+            elif tag == _UINT:
+                value = payload + 2 ** 64
+            else:
+                value = index.get_string(payload)
+            yield index.get_string(key), value
+
+    def get(self, key, default=None):
+        """Returns the first value for `key`, e.g. "name", "tag" or "flags"
+        """
+
+        for value_key, value in self.iter_values():
+            if value_key == key:
+                return value
+        return default
+
+    def get_all(self, key):
+        return [v for k, v in self.iter_values() if k == key]
+
+    def children(self, key=None):
+        """Returns the child infos, optionally only the ones under `key`
+        (e.g. "args", "methods", "type_info")
+        """
+
+        return [c for c in self._index._iter_nodes(
+                self._first_child, self._child_count)
+                if key is None or c.key == key]
+
+
+class TypelibIndex(object):
+    """A read only memory mapped index as written by write_index()"""
+
+    def __init__(self, path):
+        with open(path, "rb") as h:
+            self._map = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+
+        size = len(self._map)
+        if size < _HEADER.size:
+            self.close()
+            raise IndexFormatError("truncated index")
+
+        (magic, version, self._string_count, node_count, value_count,
+         self._root_count, self.typelib_hash) = _HEADER.unpack_from(
+            self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise IndexFormatError("unsupported index format")
+
+        self._nodes_offset = _HEADER.size
+        self._values_offset = self._nodes_offset + node_count * _NODE.size
+        self._strings_offset = self._values_offset + \
+            value_count * _VALUE.size
+        self._string_data_offset = self._strings_offset + \
+            (self._string_count + 1) * _OFFSET.size
+        self._string_cache = {}
+
+        # the last string offset is the size of the string data
+        if self._string_data_offset > size or \
+                self._root_count > node_count:
+            self.close()
+            raise IndexFormatError("truncated index")
+        data_size = _OFFSET.unpack_from(
+            self._map, self._string_data_offset - _OFFSET.size)[0]
+        if self._string_data_offset + data_size != size:
+            self.close()
+            raise IndexFormatError("truncated index")
+
+    def close(self):
+        self._map.close()
+
+    def get_string(self, index):
+        try:
+            return self._string_cache[index]
+        except KeyError:
+            start, end = struct.unpack_from(
+                "<II", self._map, self._strings_offset + index * _OFFSET.size)
+            base = self._string_data_offset
+            value = self._map[base + start:base + end].decode("utf-8")
+            self._string_cache[index] = value
+            return value
+
+    def _iter_nodes(self, first, count):
+        for pos in range(first, first + count):
+            yield Node(self, pos)
+
+    def get_infos(self):
+        """Returns the top level infos, sorted by name"""
+
+        return list(self._iter_nodes(0, self._root_count))
+
+
+def open_index(data, cache_dir=None):
+    """Returns a TypelibIndex for the typelib content `data` or None if
+    there is no usable one.
+    """
+
+    path = get_index_path(data, cache_dir)
+    try:
+        index = TypelibIndex(path)
+    except (IOError, OSError, ValueError, IndexFormatError):
+        return None
+    if index.typelib_hash != typelib_hash(data):
+        index.close()
+        return None
+    return index
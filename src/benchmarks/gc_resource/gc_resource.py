@@ -24,6 +24,14 @@ import ctypes
 import threading
 import platform
 
+from rss_monitor import RSSMonitor
+from sampler import Sampler
+
+
+# RSS growth which triggers a collection in "monitor" mode
+MONITOR_THRESHOLD = 2 ** 26
+MONITOR_INTERVAL = 0.01
+
 
 lib = ctypes.CDLL('libc.so.6')
 malloc = lib.malloc
@@ -102,30 +110,76 @@ class Resource(object):
 
 
 def main(argv):
-    assert len(argv) == 2
+    """
+    gc_resource.py NAME [RATE [OUTPUT]]
+
+    Without RATE the memory usage gets sampled 200 times from smaps. With
+    RATE the low overhead sampler is used at RATE samples per second and
+    the samples are appended in binary form to OUTPUT if given.
+
+    If NAME contains "pressure" memory pressure gets added, if it contains
+    "monitor" an RSSMonitor collects on a thread ("monitor-tick": in the
+    allocation loop instead, "monitor-young": only generation 1).
+    """
+
+    assert 2 <= len(argv) <= 4
 
     t = time.time()
     name = argv[1]
+    rate = float(argv[2]) if len(argv) > 2 else None
+    output = argv[3] if len(argv) > 3 else None
 
     res = os.fork()
     if res == 0:
         # child
+        monitor = None
+        if "monitor" in name:
+            monitor = RSSMonitor(
+                MONITOR_THRESHOLD, MONITOR_INTERVAL,
+                generation=1 if "young" in name else None)
+            if "tick" not in name:
+                monitor.start()
+
         # create the resource, wait a bit, remove references, wait a bit more
         time.sleep(0.5)
         resources = []
         for i in range(25):
-            r = Resource(2 ** 25, "pressure" in argv[1])
+            r = Resource(2 ** 25, "pressure" in name)
             time.sleep(0.05)
             del r
+            if monitor is not None and "tick" in name:
+                monitor.tick()
         gc.collect()
+
+        if monitor is not None:
+            monitor.stop()
+            print("%s: %s" % (name, monitor.summary()), file=sys.stderr)
         time.sleep(4)
     else:
         total = 3
-        N = 200
-        for i in range(N):
-            print(name, "%07.4f" % (time.time() - t), get_memory_usage(res))
-            time.sleep(total / float(N))
+        peak = 0
+        if rate is None:
+            N = 200
+            for i in range(N):
+                rss = get_memory_usage(res)
+                peak = max(peak, rss)
+                print(name, "%07.4f" % (time.time() - t), rss)
+                time.sleep(total / float(N))
+        else:
+            sampler = Sampler(res, rate, capacity=int(total * rate) + 1)
+            sampler.run(total, t)
+            sampler.close()
+            if output is not None:
+                with open(output, "ab") as h:
+                    sampler.write(h, name)
+            for time_, rss in sampler:
+                peak = max(peak, rss)
+                if output is None:
+                    print(name, "%07.4f" % time_, rss)
+            print("%s: %d samples" % (name, len(sampler)), file=sys.stderr)
         os.waitpid(res, 0)
+        print("%s: peak RSS %.1f MiB" % (name, peak / 1024.0 ** 2),
+              file=sys.stderr)
 
 
 if __name__ == "__main__":
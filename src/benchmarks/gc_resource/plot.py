@@ -6,19 +6,37 @@
 # License as published by the Free Software Foundation; either
 # version 2.1 of the License, or (at your option) any later version.
 
-import fileinput
+import sys
 
 import matplotlib
 matplotlib.use('cairo')
 import matplotlib.pyplot as plt
 import matplotlib.ticker as tkr
 
+from sampler import is_binary, read_samples
+
 impls = {}
 
-for line in list(fileinput.input()):
-    line = line.strip()
-    name, time_, rss = line.split()
-    impls.setdefault(name, []).append((float(time_), int(rss)))
+# text output of gc_resource.py or binary sampler output, from files or stdin
+if len(sys.argv) > 1:
+    inputs = []
+    for path in sys.argv[1:]:
+        with open(path, "rb") as h:
+            inputs.append(h.read())
+else:
+    inputs = [getattr(sys.stdin, "buffer", sys.stdin).read()]
+
+for data in inputs:
+    if is_binary(data):
+        for name, samples in read_samples(data):
+            impls.setdefault(name, []).extend(samples)
+        continue
+    for line in data.decode("utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        name, time_, rss = line.split()
+        impls.setdefault(name, []).append((float(time_), int(rss)))
 
 sub = plt.subplot()
 
@@ -0,0 +1,120 @@
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Forces a garbage collection once the RSS of the process has grown past a
+threshold since the last one, similar to what gjs does.
+
+This helps in case Python objects own external resources the GC doesn't
+know about and which only get freed when the objects get finalized:
+
+    monitor = RSSMonitor(64 * 1024 ** 2)
+    monitor.start()  # or call monitor.tick() from the main loop
+    ...
+    monitor.stop()
+"""
+
+import gc
+import os
+import time
+import threading
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def get_rss():
+    """Returns the RSS of the current process
+
+    Returns:
+        int
+    """
+
+    with open("/proc/self/statm", "rb") as h:
+        return int(h.read().split()[1]) * _PAGE_SIZE
+
+
+class RSSMonitor(object):
+    """Collects once the RSS has grown by `threshold` bytes since the last
+    collection (or since creation).
+
+    Args:
+        threshold (int): RSS growth in bytes which triggers a collection
+        interval (float): seconds between checks when run on a thread
+        generation (int): passed to gc.collect(), None for a full collection
+    """
+
+    def __init__(self, threshold, interval=0.01, generation=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.generation = generation
+        # (time, pause in seconds, RSS before, RSS after)
+        self.collections = []
+        self._baseline = get_rss()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def collect(self):
+        """Collects and records the pause"""
+
+        before = get_rss()
+        t = time.time()
+        if self.generation is None:
+            gc.collect()
+        else:
+            gc.collect(self.generation)
+        pause = time.time() - t
+        self._baseline = get_rss()
+        self.collections.append((t, pause, before, self._baseline))
+
+    def tick(self):
+        """Checks the RSS and collects if needed. Meant to be called from a
+        main loop in case no thread should be used.
+
+        Returns:
+            bool: if a collection happened
+        """
+
+        rss = get_rss()
+        if rss - self._baseline > self.threshold:
+            self.collect()
+            return True
+        # in case memory got freed without us, follow it down
+        self._baseline = min(self._baseline, rss)
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def start(self):
+        """Starts checking on a daemon thread"""
+
+        assert self._thread is None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def pauses(self):
+        return [c[1] for c in self.collections]
+
+    def summary(self):
+        """Returns a one line description of the collections so far"""
+
+        pauses = self.pauses
+        if not pauses:
+            return "0 collections"
+        return "%d collections, pause total %.4fs, mean %.4fs, max %.4fs" % (
+            len(pauses), sum(pauses), sum(pauses) / len(pauses), max(pauses))
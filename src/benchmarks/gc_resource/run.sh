@@ -6,10 +6,12 @@
 # License as published by the Free Software Foundation; either
 # version 2.1 of the License, or (at your option) any later version.
 
-rm -f data.txt
+rm -f data.txt samples.bin
 pypy gc_resource.py "PyPy" >> data.txt
 pypy gc_resource.py "PyPy-pressure" >> data.txt
+pypy gc_resource.py "PyPy-monitor" >> data.txt
 python2 gc_resource.py "CPython-2" >> data.txt
 python3 gc_resource.py "CPython-3" >> data.txt
-cat data.txt | python plot.py
-rm data.txt
+pypy gc_resource.py "PyPy-pressure-2kHz" 2000 samples.bin
+python plot.py data.txt samples.bin
+rm data.txt samples.bin
@@ -0,0 +1,165 @@
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Samples the RSS of a process at a fixed rate (up to a few kHz) without
+allocating per sample: /proc/<pid>/smaps_rollup (or statm as fallback) is
+read into a preallocated buffer and the results are stored in a fixed size
+ring buffer.
+
+The binary format written by Sampler.write() and read by read_samples()
+consists of records, which can be concatenated:
+
+    header (MAGIC, version, rate, sample count, name length), name,
+    sample count x (time, rss)
+"""
+
+import os
+import time
+import array
+import struct
+
+
+MAGIC = b"GCRS"
+VERSION = 1
+
+# magic, version, rate, count, name length
+_HEADER = struct.Struct("<4sIdII")
+_SAMPLE = struct.Struct("<dq")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class Sampler(object):
+    """Samples the RSS of `pid`.
+
+    Args:
+        pid (int): process ID
+        rate (float): samples per second
+        capacity (int): number of samples kept, older ones get overwritten
+    """
+
+    def __init__(self, pid, rate=1000.0, capacity=2 ** 16):
+        self.pid = pid
+        self.rate = rate
+        self.capacity = capacity
+
+        self._times = array.array("d", [0.0]) * capacity
+        # array("q") is missing in Python 2
+        self._rss = array.array("d", [0.0]) * capacity
+        self._count = 0
+        self._buf = bytearray(4096)
+
+        path = "/proc/%d/smaps_rollup" % pid
+        if os.path.exists(path):
+            self._rollup = True
+        else:
+            self._rollup = False
+            path = "/proc/%d/statm" % pid
+        self._file = open(path, "rb", 0)
+
+    def close(self):
+        self._file.close()
+
+    def read_rss(self):
+        """Returns the current RSS of the process
+
+        Returns:
+            int
+        """
+
+        h = self._file
+        buf = self._buf
+        h.seek(0)
+        size = h.readinto(buf)
+        if self._rollup:
+            # "Rss:" is the second line, kB with leading spaces
+            start = buf.find(b"\nRss:", 0, size) + 5
+            end = buf.find(b"kB", start, size)
+            return int(buf[start:end]) * 1024
+        else:
+            start = buf.find(b" ", 0, size) + 1
+            end = buf.find(b" ", start, size)
+            return int(buf[start:end]) * _PAGE_SIZE
+
+    def sample(self, now):
+        """Stores one sample for time `now`"""
+
+        pos = self._count % self.capacity
+        self._times[pos] = now
+        self._rss[pos] = self.read_rss()
+        self._count += 1
+
+    def run(self, duration, start=None):
+        """Samples for `duration` seconds or until the process is gone.
+
+        Args:
+            duration (float): seconds to sample
+            start (float): reference time the sample times are relative to,
+                defaults to now
+        """
+
+        t = time.time()
+        if start is None:
+            start = t
+        interval = 1.0 / self.rate
+        deadline = t
+        end = t + duration
+        while deadline < end:
+            try:
+                self.sample(deadline - start)
+            except (IOError, OSError, ValueError):
+                # process exited
+                break
+            deadline += interval
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def __iter__(self):
+        """Yields (time, rss) for all stored samples, oldest first"""
+
+        count = len(self)
+        first = self._count - count
+        for i in range(first, first + count):
+            pos = i % self.capacity
+            yield self._times[pos], int(self._rss[pos])
+
+    def write(self, h, name):
+        """Appends the samples as a binary record to the file `h`"""
+
+        name = name.encode("utf-8")
+        h.write(_HEADER.pack(MAGIC, VERSION, self.rate, len(self), len(name)))
+        h.write(name)
+        h.write(b"".join(_SAMPLE.pack(t, r) for t, r in self))
+
+
+def is_binary(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def read_samples(data):
+    """Returns a list of (name, [(time, rss)]) for all records in `data`"""
+
+    records = []
+    offset = 0
+    while offset < len(data):
+        magic, version, rate, count, name_length = _HEADER.unpack_from(
+            data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unsupported sample format")
+        offset += _HEADER.size
+        name = data[offset:offset + name_length].decode("utf-8")
+        offset += name_length
+        samples = [_SAMPLE.unpack_from(data, offset + i * _SAMPLE.size)
+                   for i in range(count)]
+        offset += count * _SAMPLE.size
+        records.append((name, samples))
+    return records
@@ -8,4 +8,6 @@ export PYTHONPATH=/home/lazka/Desktop/pgi
 
 python main.py
 python main.py pgi
+python main.py cffi
 pypy main.py pgi
+pypy main.py cffi
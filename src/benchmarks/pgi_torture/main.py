@@ -11,19 +11,149 @@ import sys
 import platform
 sys.path.insert(0, "..")
 from benchutils import *
+import wrapgen
 
 
-def benchmark_function(func, *args):
-    r = []
-    for i in xrange(3000):
-        t = timer()
-        for i in xrange(1000):
-            func(*args)
-        r.append(timer() - t)
-    return "%.5f" % (average(r) * 1000), "%.5f" % (stdev(r) * 1000)
+TORTURE_SIGNATURE_0 = wrapgen.Function(
+    "regress_test_obj_torture_signature_0", [
+        wrapgen.Arg("obj", "pointer"),
+        wrapgen.Arg("x", "int32"),
+        wrapgen.Arg("y", "double", direction="out"),
+        wrapgen.Arg("z", "int32", direction="out"),
+        wrapgen.Arg("foo", "utf8"),
+        wrapgen.Arg("q", "int32", direction="out"),
+        wrapgen.Arg("m", "uint32"),
+    ])
+
+
+def benchmark_function(func, *args, **kwargs):
+    name = kwargs.pop("name", None)
+    backend = kwargs.pop("backend", None)
+
+    # the number of calls per round and the warmup are chosen automatically,
+    # the results are scaled to 1000 calls in ms
+    stats = measure(func, args, rounds=3000)
+    if name is not None:
+        report(name, stats, backend=backend)
+    scale = 1000 * 1000
+    warmup = "warmup=%d" % stats.warmup_rounds
+    if stats.converged is False:
+        warmup += " (not converged)"
+    return "%.5f" % (stats.mean * scale), "%.5f" % (stats.stdev * scale), \
+        "%.5f" % (stats.percentile(99) * scale), \
+        warmup, "loops=%d" % stats.loops
+
+
+def bench_codegen(backend, rounds=200):
+    """Time to get the wrapper without a cache, with an empty cache (generate
+    and store) and with a filled one (load), each in ms.
+    """
+
+    import shutil
+    import tempfile
+
+    with open("Regress-1.0.typelib", "rb") as h:
+        typelib_data = h.read()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for mode in wrapgen.MODES:
+            for optimize in [False, True]:
+                desc = mode + ("-opt" if optimize else "")
+                results = []
+                for variant in ["nocache", "cold", "warm"]:
+                    stats = Stats()
+                    for i in xrange(rounds):
+                        cache = None
+                        if variant != "nocache":
+                            cache = wrapgen.CodeCache(
+                                "Regress", "1.0", typelib_data, cache_dir)
+                            if variant == "cold":
+                                shutil.rmtree(cache.path, True)
+                        t = timer()
+                        wrapgen.create_function(
+                            TORTURE_SIGNATURE_0, backend, mode,
+                            optimize=optimize, cache=cache)
+                        stats.add(timer() - t)
+                    results.append("%s=%.4f" % (variant, stats.mean * 1000))
+                    report("codegen-%s-%s" % (desc, variant), stats,
+                           backend="cffi")
+                print platform.python_implementation(), "codegen-" + desc,
+                print " ".join(results)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def show_breakdown(backend, obj, calls=10000, as_json=False):
+    """Prints how the time of a call splits into argument conversion, the
+    C call and result conversion, for each mode, in microseconds per call.
+    """
+
+    stats = wrapgen.CallStats()
+    for mode in wrapgen.MODES:
+        for optimize in [False, True]:
+            stats.reset()
+            # through a WrapperCache, like an application would
+            cache = wrapgen.WrapperCache(backend, mode, optimize)
+            cache.set_stats(stats)
+            func = cache.get(TORTURE_SIGNATURE_0)
+            for i in xrange(calls):
+                func(obj, 5000, "Torture Test 1", 12345)
+            cache_stats = cache.stats()
+            assert cache_stats["misses"] == 1, cache_stats
+
+            desc = "cffi-" + mode + ("-opt" if optimize else "")
+            if as_json:
+                print desc, stats.to_json()
+            else:
+                print platform.python_implementation(), desc
+                print stats.format_table()
+            row = stats.get_rows()[0]
+            report("breakdown-" + desc[5:], [row["total"] / calls],
+                   backend="cffi", **dict(
+                       (k, row[k] / calls) for k in
+                       ["marshal", "call", "result"]))
+
+
+def main_cffi(argv):
+    """Calls the function through wrappers generated by wrapgen, passing
+    the TestObj pointer directly.
+    """
+
+    import cffi
+
+    ffi = cffi.FFI()
+    ffi.cdef("""
+size_t regress_test_obj_get_type(void);
+void* g_object_new(size_t object_type, const char* first_property_name, ...);
+""")
+    ffi.cdef(TORTURE_SIGNATURE_0.get_cdef())
+    # libregress links against gobject, so g_object_new is found as well
+    lib = ffi.dlopen("libregress.so")
+    obj = lib.g_object_new(
+        lib.regress_test_obj_get_type(), ffi.cast("char*", ffi.NULL))
+    backend = wrapgen.CFFIBackend(ffi, lib)
+
+    bench_codegen(backend)
+    show_breakdown(backend, obj, as_json="json" in argv[1:])
+
+    # each mode without and with the optimization pass
+    for mode in wrapgen.MODES:
+        for optimize in [False, True]:
+            func = wrapgen.create_function(
+                TORTURE_SIGNATURE_0, backend, mode, optimize=optimize)
+            assert func(obj, 5000, "foobar", 12345) == (5000.0, 10000, 12351)
+            desc = "cffi-" + mode + ("-opt" if optimize else "")
+            print platform.python_implementation(), desc,
+            print benchmark_function(
+                func, obj, 5000, "Torture Test 1", 12345,
+                name="torture_signature_0-" + desc[5:], backend="cffi")
 
 
 def main(argv):
+    if "cffi" in argv[1:]:
+        return main_cffi(argv)
+
     use_pgi = "pgi" in argv[1:]
     if use_pgi:
         import pgi
@@ -36,9 +166,9 @@ def main(argv):
     object_ = Regress.TestObj()
 
     print platform.python_implementation(), "pgi" if use_pgi else "gi",
-    benchmark_function(object_.torture_signature_0, 5000, "Torture Test 1", 12345)
-    benchmark_function(object_.torture_signature_0, 5000, "Torture Test 1", 12345)
-    print benchmark_function(object_.torture_signature_0, 5000, "Torture Test 1", 12345)
+    print benchmark_function(
+        object_.torture_signature_0, 5000, "Torture Test 1", 12345,
+        name="torture_signature_0", backend="ctypes" if use_pgi else "capi")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,407 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+A SQLite database of benchmark results, keyed by benchmark, VM, backend,
+measurement name, git revision and machine.
+
+benchutils.report() adds each result to it if $BENCH_DB is set (see
+run_matrix.py --db), existing JSON lines files written by run_matrix.py can
+be imported. "compare" flags measurements which got significantly slower
+(or faster) between two revisions using Welch's t-test on the per result
+mean, standard deviation and sample count:
+
+    ./resultdb.py [--db results.sqlite] import results.jsonl
+    ./resultdb.py [--db results.sqlite] list
+    ./resultdb.py [--db results.sqlite] compare [--alpha 0.01]
+                  [--min-change 0.02] [--machine NAME] OLD NEW
+
+compare exits with 1 in case there are regressions.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import platform
+import subprocess
+
+from benchutils import DB_ENV
+
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    benchmark TEXT NOT NULL,
+    vm TEXT,
+    backend TEXT,
+    name TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    machine TEXT NOT NULL,
+    time REAL NOT NULL,
+    n INTEGER,
+    mean REAL,
+    stdev REAL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_revision ON results (revision, machine);
+"""
+
+_KEY = ["benchmark", "vm", "backend", "name"]
+
+_cached_revision = []
+
+
+def _git(args):
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(os.devnull, "wb") as null:
+        return subprocess.check_output(
+            ["git"] + args, cwd=root, stderr=null).decode("utf-8").strip()
+
+
+def get_revision():
+    """Returns $BENCH_REVISION or the git commit of the benchmark code, with
+    "-dirty" appended in case tracked files are modified.
+    """
+
+    revision = os.environ.get("BENCH_REVISION")
+    if revision:
+        return revision
+
+    if not _cached_revision:
+        try:
+            revision = _git(["rev-parse", "HEAD"])
+            if _git(["status", "--porcelain", "--untracked-files=no"]):
+                revision += "-dirty"
+        except (OSError, subprocess.CalledProcessError):
+            revision = "unknown"
+        _cached_revision.append(revision)
+    return _cached_revision[0]
+
+
+def get_machine():
+    """Returns $BENCH_MACHINE or the host name"""
+
+    return os.environ.get("BENCH_MACHINE") or platform.node()
+
+
+def get_vm_label(metadata):
+    """Returns the run_matrix.py VM label for get_exec_metadata(), for
+    results of runs outside of it
+    """
+
+    if not metadata:
+        return None
+    if metadata["vm"] == "PyPy":
+        return "pypy" if metadata["jit"] else "pypy-nojit"
+    return "%s%s" % (metadata["vm"].lower(), metadata["version"][:1])
+
+
+def _betacf(a, b, x):
+    """Continued fraction for the incomplete beta function (Lentz)"""
+
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1.0)
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0 / d
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((a + m2 - 1.0) * (a + m2))
+        d = 1.0 + aa * d
+        d = tiny if abs(d) < tiny else d
+        c = 1.0 + aa / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1.0))
+        d = 1.0 + aa * d
+        d = tiny if abs(d) < tiny else d
+        c = 1.0 + aa / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    """The regularized incomplete beta function I_x(a, b)"""
+
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+        a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def welch_test(mean1, stdev1, n1, mean2, stdev2, n2):
+    """Welch's t-test for two samples given by their mean, standard
+    deviation and size.
+
+    Returns:
+        tuple: (t, degrees of freedom, two-sided p-value)
+    """
+
+    v1 = stdev1 ** 2 / n1
+    v2 = stdev2 ** 2 / n2
+    if v1 + v2 == 0:
+        if mean1 == mean2:
+            return 0.0, float("inf"), 1.0
+        return math.copysign(float("inf"), mean2 - mean1), float("inf"), 0.0
+
+    t = (mean2 - mean1) / math.sqrt(v1 + v2)
+    df = (v1 + v2) ** 2 / (v1 ** 2 / (n1 - 1) + v2 ** 2 / (n2 - 1))
+    p = betainc(df / 2.0, 0.5, df / (df + t ** 2))
+    return t, df, p
+
+
+def combine(rows):
+    """Combines the (n, mean, stdev) of several results of the same
+    measurement into one.
+    """
+
+    n = sum(r[0] for r in rows)
+    mean = sum(r[0] * r[1] for r in rows) / n
+    # within plus between group sum of squares
+    ss = sum((r[0] - 1) * r[2] ** 2 + r[0] * (r[1] - mean) ** 2
+             for r in rows)
+    stdev = math.sqrt(ss / (n - 1)) if n > 1 else 0.0
+    return n, mean, stdev
+
+
+class ResultStore(object):
+    """A database of results as written by benchutils.report()
+
+    Args:
+        path (str): the SQLite database file, gets created if needed
+    """
+
+    def __init__(self, path):
+        # benchmarks running in parallel might write at the same time
+        self._conn = sqlite3.connect(path, timeout=60)
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            self._conn.close()
+            raise ValueError("unsupported database version %d" % version)
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def close(self):
+        self._conn.close()
+
+    def add(self, record, revision=None, machine=None):
+        """Adds a "result" record
+
+        Args:
+            record (dict): the record as written by report()
+            revision (str): defaults to get_revision()
+            machine (str): defaults to get_machine()
+        """
+
+        revision = revision or record.get("revision") or get_revision()
+        machine = machine or record.get("machine") or get_machine()
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO results (benchmark, vm, backend, name, "
+                "revision, machine, time, n, mean, stdev, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                    record["benchmark"],
+                    record.get("vm") or get_vm_label(record.get("exec")),
+                    record.get("backend"), record["name"], revision,
+                    machine, record.get("time", time.time()),
+                    record.get("n"), record.get("mean"),
+                    record.get("stdev"), json.dumps(record, sort_keys=True)))
+
+    def import_jsonl(self, path, revision=None, machine=None):
+        """Adds all results of a JSON lines file written by run_matrix.py.
+
+        Returns:
+            int: the number of added results
+        """
+
+        count = 0
+        with open(path) as h:
+            for line in h:
+                record = json.loads(line)
+                if record.get("type") == "result":
+                    self.add(record, revision, machine)
+                    count += 1
+        return count
+
+    def get_revisions(self):
+        """Returns a list of (revision, machine, result count, last time),
+        most recent first
+        """
+
+        return self._conn.execute(
+            "SELECT revision, machine, COUNT(*), MAX(time) FROM results "
+            "GROUP BY revision, machine ORDER BY MAX(time) DESC").fetchall()
+
+    def resolve_revision(self, name):
+        """Returns the stored revision matching `name`, which can be a
+        stored revision, a git ref or a unique prefix.
+        """
+
+        revisions = set(r[0] for r in self.get_revisions())
+        if name in revisions:
+            return name
+        try:
+            commit = _git(["rev-parse", "--verify", name + "^{commit}"])
+        except (OSError, subprocess.CalledProcessError):
+            pass
+        else:
+            if commit in revisions:
+                return commit
+        matches = [r for r in revisions if r.startswith(name)]
+        if len(matches) != 1:
+            raise LookupError("revision %r not found or ambiguous" % name)
+        return matches[0]
+
+    def get_results(self, revision, machine=None):
+        """Returns a dict mapping (benchmark, vm, backend, name, machine)
+        to a list of (n, mean, stdev) for all results of `revision`.
+        """
+
+        query = "SELECT %s, machine, n, mean, stdev FROM results " \
+            "WHERE revision = ? AND mean IS NOT NULL" % ", ".join(_KEY)
+        params = [revision]
+        if machine is not None:
+            query += " AND machine = ?"
+            params.append(machine)
+
+        results = {}
+        for row in self._conn.execute(query, params):
+            results.setdefault(tuple(row[:5]), []).append(tuple(row[5:]))
+        return results
+
+    def compare(self, old, new, machine=None, alpha=0.01, min_change=0.02):
+        """Compares all measurements done for both revisions on the same
+        machine.
+
+        A measurement counts as a regression (or improvement) if the mean
+        changed by more than `min_change` (relative) and the difference is
+        significant at level `alpha`.
+
+        Returns:
+            list: (key, old mean, new mean, relative change, p-value,
+                verdict) with verdict being "slower", "faster", "same" or
+                "n/a" if there aren't enough samples
+        """
+
+        old_results = self.get_results(old, machine)
+        new_results = self.get_results(new, machine)
+
+        rows = []
+        for key in sorted(set(old_results) & set(new_results)):
+            n1, mean1, stdev1 = combine(old_results[key])
+            n2, mean2, stdev2 = combine(new_results[key])
+            change = (mean2 - mean1) / mean1 if mean1 else 0.0
+            if n1 < 2 or n2 < 2:
+                p, verdict = None, "n/a"
+            else:
+                p = welch_test(mean1, stdev1, n1, mean2, stdev2, n2)[2]
+                if p >= alpha or abs(change) <= min_change:
+                    verdict = "same"
+                elif change > 0:
+                    verdict = "slower"
+                else:
+                    verdict = "faster"
+            rows.append((key, mean1, mean2, change, p, verdict))
+        return rows
+
+
+def get_default_path():
+    return os.environ.get(DB_ENV) or "results.sqlite"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Store benchmark results and compare revisions")
+    parser.add_argument("--db", default=get_default_path(),
+                        help="database file (default: $%s or "
+                             "results.sqlite)" % DB_ENV)
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    import_ = commands.add_parser("import", help="import JSON lines files")
+    import_.add_argument("files", nargs="+")
+    import_.add_argument("--revision", help="default: the current one")
+    import_.add_argument("--machine", help="default: this one")
+
+    commands.add_parser("list", help="list the stored revisions")
+
+    compare = commands.add_parser(
+        "compare", help="flag significant changes between two revisions")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--machine", help="only compare results of NAME")
+    compare.add_argument("--alpha", type=float, default=0.01,
+                         help="significance level (default: 0.01)")
+    compare.add_argument("--min-change", type=float, default=0.02,
+                         help="ignore relative changes below this "
+                              "(default: 0.02)")
+    compare.add_argument("--all", action="store_true",
+                         help="also show unchanged measurements")
+
+    args = parser.parse_args(argv[1:])
+    store = ResultStore(args.db)
+
+    if args.command == "import":
+        for path in args.files:
+            count = store.import_jsonl(path, args.revision, args.machine)
+            print("%s: %d results" % (path, count))
+    elif args.command == "list":
+        for revision, machine, count, last in store.get_revisions():
+            print("%-48s %-20s %6d  %s" % (
+                revision, machine, count,
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(last))))
+    else:
+        try:
+            old = store.resolve_revision(args.old)
+            new = store.resolve_revision(args.new)
+        except LookupError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+        rows = store.compare(
+            old, new, args.machine, args.alpha, args.min_change)
+        regressions = 0
+        for key, mean1, mean2, change, p, verdict in rows:
+            if verdict == "slower":
+                regressions += 1
+            if verdict in ("same", "n/a") and not args.all:
+                continue
+            print("%-7s %-60s %12.6g %12.6g %+7.1f%% p=%s" % (
+                verdict, "/".join(str(k) for k in key), mean1, mean2,
+                change * 100, "-" if p is None else "%.2g" % p))
+        print("%d measurements compared, %d slower, %d faster" % (
+            len(rows), regressions,
+            len([r for r in rows if r[-1] == "faster"])))
+        return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,320 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Runs all benchmarks for every combination of Python VM and FFI backend and
+writes the results as JSON lines.
+
+Unlike the bench.sh scripts this uses the interpreters as found in PATH (or
+passed via --vm) and doesn't create any virtualenvs, so pycparser, cffi and
+pgi have to be installed for each of them beforehand (see venv_tools.sh for
+the versions used).
+
+Each line in the output file is one JSON object; "type" is either "run"
+(one per executed benchmark process, including its printed output) or
+"result" (one per measurement, written by benchutils.report()).
+
+    ./run_matrix.py [--build] [--jobs 4] [--only ffi_apis,ffi_tdump]
+                    [--vms pypy,pypy-nojit] [--backends cffi]
+                    [--vm cpython2=/usr/bin/python2.7]
+                    [--db results.sqlite] results.jsonl
+
+With --db the results are also added to a resultdb.py database, tagged
+with the git revision and machine, to compare them with other revisions.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import threading
+import subprocess
+
+from benchutils import RESULTS_ENV, DB_ENV, write_record, timer, \
+    PinnedPool, pin_command
+
+
+# the benchmarks are Python 2 only
+VMS = [
+    ("cpython2", ["python2"]),
+    ("pypy", ["pypy"]),
+    ("pypy-nojit", ["pypy", "--jit", "off"]),
+]
+
+BACKENDS = ["capi", "ctypes", "cffi"]
+
+
+class Benchmark(object):
+    """How to run the benchmark in one directory.
+
+    Args:
+        script (str): the script to execute, relative to the directory
+        backends (dict): maps each supported backend to the arguments
+            passed to the script. "{vm}" gets replaced by the VM command,
+            "{label}" by the VM label.
+        vms (list): the supported VM labels, or None for all of them
+        vm_args (dict): maps VM labels to arguments appended for that VM
+        env (dict): additional environment variables, paths are relative
+            to the benchmark directory
+    """
+
+    def __init__(self, script, backends, vms=None, vm_args=None, env=None):
+        self.script = script
+        self.backends = backends
+        self.vms = vms
+        self.vm_args = vm_args or {}
+        self.env = env or {}
+
+    def get_args(self, backend, vm_label, vm_command):
+        args = []
+        for arg in self.backends[backend]:
+            if arg == "{vm}":
+                args.extend(vm_command)
+            else:
+                args.append(arg.replace("{label}", vm_label))
+        args.extend(self.vm_args.get(vm_label, []))
+        return args
+
+
+BENCHMARKS = {
+    "ffi_apis": Benchmark(
+        "main.py", {
+            "capi": ["capi"],
+            "ctypes": ["ctypes"],
+            "cffi": ["cffi"],
+        }, vm_args={"pypy-nojit": ["nojit"]},
+        env={"LD_LIBRARY_PATH": "libnoop"}),
+    "ffi_import": Benchmark(
+        "main.py", {
+            "ctypes": ["{vm}", "bench-clib.py"],
+            "cffi": ["{vm}", "bench-cffilib.py"],
+        }),
+    "ffi_list_strategy": Benchmark(
+        "bench.py", {
+            "capi": ["capi"],
+            "cffi": ["cffi"],
+        }, env={"LD_LIBRARY_PATH": "libnoop"}),
+    "ffi_overhead": Benchmark(
+        "bench_overhead.py", {
+            "capi": ["capi"],
+            "cffi": [],
+        }, env={"LD_LIBRARY_PATH": "liboverhead"}),
+    "ffi_tdump": Benchmark(
+        "tdump_bench.py", {
+            "ctypes": ["ctypes"],
+            "cffi": ["cffi"],
+        }),
+    "gc_resource": Benchmark(
+        "gc_resource.py", {
+            "ctypes": ["{label}"],
+        }),
+    "jit_warmup": Benchmark(
+        "bench_warmup.py", {
+            "ctypes": [],
+        }, vms=["pypy"]),
+    "pgi_torture": Benchmark(
+        "main.py", {
+            "capi": [],
+            "ctypes": ["pgi"],
+            "cffi": ["cffi"],
+        }, env={"LD_LIBRARY_PATH": ".", "GI_TYPELIB_PATH": "."}),
+    "startup_replay": Benchmark(
+        "main.py", {
+            "ctypes": ["{vm}", "replay.py", "ctypes"],
+            "cffi": ["{vm}", "replay.py", "cffi"],
+        }),
+    "struct_fields": Benchmark(
+        "main.py", {
+            "ctypes": ["ctypes", "pgi", "wrapgen"],
+            "cffi": ["cffi"],
+        }, env={"LD_LIBRARY_PATH": "../pgi_torture",
+                "GI_TYPELIB_PATH": "../pgi_torture"}),
+    "wrapper_cache": Benchmark(
+        "main.py", {
+            "cffi": ["Gtk", "3.0"],
+        }),
+}
+
+
+def find_benchmarks(root):
+    """Returns a sorted list of benchmark directory names below `root`.
+
+    A benchmark directory is one containing a shell script to run it.
+    """
+
+    found = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        if any(e.endswith(".sh") for e in os.listdir(path)):
+            found.append(name)
+    return found
+
+
+def get_vm_metadata(vm_command, root):
+    """Returns benchutils.get_exec_metadata() as seen by the VM or None"""
+
+    code = ("import json, benchutils; "
+            "print(json.dumps(benchutils.get_exec_metadata()))")
+    try:
+        data = subprocess.check_output(vm_command + ["-c", code], cwd=root)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def build(path):
+    if os.path.exists(os.path.join(path, "Makefile")):
+        subprocess.check_call(["make", "clean"], cwd=path)
+        subprocess.check_call(["make"], cwd=path)
+
+
+def run_one(root, name, bench, backend, vm_label, vm_command, result_path,
+            core=None, env=None):
+    """Runs one benchmark configuration and returns the run record.
+
+    If `core` is given the process gets pinned to that CPU core.
+    """
+
+    path = os.path.join(root, name)
+    argv = vm_command + [bench.script] + \
+        bench.get_args(backend, vm_label, vm_command)
+    if core is not None:
+        argv = pin_command(core, argv)
+
+    env = dict(env or os.environ)
+    for key, value in bench.env.items():
+        env[key] = os.path.join(path, value)
+    env[RESULTS_ENV] = result_path
+    env["BENCH_NAME"] = name
+    env["BENCH_VM"] = vm_label
+    env["BENCH_BACKEND"] = backend
+
+    t = timer()
+    try:
+        p = subprocess.Popen(argv, cwd=path, env=env, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    except OSError as e:
+        returncode, out, err = None, b"", str(e).encode("utf-8")
+    else:
+        out, err = p.communicate()
+        returncode = p.returncode
+
+    return {
+        "type": "run",
+        "benchmark": name,
+        "vm": vm_label,
+        "backend": backend,
+        "core": core,
+        "command": argv,
+        "returncode": returncode,
+        "duration": timer() - t,
+        "output": out.decode("utf-8", "replace").splitlines(),
+        "error": err.decode("utf-8", "replace").splitlines()[-20:],
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Run the VM x backend benchmark matrix")
+    parser.add_argument("output", help="JSON lines file to append to")
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--vms", help="comma separated VM labels")
+    parser.add_argument("--backends", help="comma separated backends")
+    parser.add_argument("--vm", action="append", default=[],
+                        metavar="LABEL=COMMAND",
+                        help="override the command used for a VM label")
+    parser.add_argument("--build", action="store_true",
+                        help="run make in each benchmark directory first")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="run configurations in parallel, each one "
+                             "pinned to its own core")
+    parser.add_argument("--db", help="also add the results to this "
+                                     "resultdb.py database")
+    args = parser.parse_args(argv[1:])
+
+    if args.db:
+        os.environ[DB_ENV] = os.path.abspath(args.db)
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    result_path = os.path.abspath(args.output)
+
+    vms = list(VMS)
+    for override in args.vm:
+        label, command = override.split("=", 1)
+        vms = [(l, command.split() if l == label else c) for l, c in vms]
+    if args.vms:
+        wanted = args.vms.split(",")
+        vms = [(l, c) for l, c in vms if l in wanted]
+    backends = args.backends.split(",") if args.backends else BACKENDS
+
+    names = []
+    for name in find_benchmarks(root):
+        if args.only and name not in args.only.split(","):
+            continue
+        if name not in BENCHMARKS:
+            print("skipping %s: no entry in BENCHMARKS" % name,
+                  file=sys.stderr)
+            continue
+        names.append(name)
+
+    metadata = {}
+    for label, command in vms:
+        metadata[label] = get_vm_metadata(command, root)
+        if metadata[label] is None:
+            print("skipping %s: %r not usable" % (label, command),
+                  file=sys.stderr)
+    vms = [(l, c) for l, c in vms if metadata[l] is not None]
+
+    configs = []
+    for name in names:
+        bench = BENCHMARKS[name]
+        if args.build:
+            build(os.path.join(root, name))
+        for label, command in vms:
+            if bench.vms is not None and label not in bench.vms:
+                continue
+            for backend in backends:
+                if backend in bench.backends:
+                    configs.append((name, label, command, backend))
+
+    env = dict(os.environ)
+    if args.jobs > 1:
+        # don't let benchmarks which run processes themselves compete
+        # with the other configurations for cores
+        env["BENCH_JOBS"] = "1"
+
+    lock = threading.Lock()
+
+    def run(core, config):
+        name, label, command, backend = config
+        record = run_one(root, name, BENCHMARKS[name], backend, label,
+                         command, result_path, core=core, env=env)
+        record["exec"] = metadata[label]
+        with lock:
+            write_record(result_path, record)
+            print("%-18s %-11s %-7s %.2fs %s" % (
+                name, label, backend, record["duration"],
+                "ok" if record["returncode"] == 0 else "FAILED"))
+            sys.stdout.flush()
+        return record["returncode"] == 0
+
+    if args.jobs > 1:
+        results = PinnedPool(jobs=args.jobs).map(run, configs)
+    else:
+        results = [run(None, config) for config in configs]
+    failed = results.count(False)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,48 @@
+#!/bin/bash
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+set -e
+
+DIR="$( cd "$( dirname "$0" )" && pwd )"
+cd "$DIR"
+
+source ../venv_tools.sh;
+
+setup_pypy;
+
+setup_cpython_env;
+python main.py python replay.py ctypes
+python main.py python replay.py cffi
+python replay.py ctypes record=profile-ctypes.txt > /dev/null
+python main.py python replay.py ctypes delay=1
+python main.py python replay.py ctypes delay=1 profile=profile-ctypes.txt
+python main.py python replay.py ctypes delay=1 profile=profile-ctypes.txt idle
+python replay.py cffi record=profile-cffi.txt > /dev/null
+python main.py python replay.py cffi delay=1
+python main.py python replay.py cffi delay=1 profile=profile-cffi.txt
+python main.py python replay.py cffi delay=1 profile=profile-cffi.txt idle
+rm -f profile-*.txt
+remove_cpython_env;
+
+setup_pypy_env;
+python main.py python replay.py ctypes
+python main.py python replay.py cffi
+python main.py python --jit off replay.py ctypes
+python main.py python --jit off replay.py cffi
+python replay.py ctypes record=profile-ctypes.txt > /dev/null
+python main.py python replay.py ctypes delay=1
+python main.py python replay.py ctypes delay=1 profile=profile-ctypes.txt
+python main.py python replay.py ctypes delay=1 profile=profile-ctypes.txt idle
+python replay.py cffi record=profile-cffi.txt > /dev/null
+python main.py python replay.py cffi delay=1
+python main.py python replay.py cffi delay=1 profile=profile-cffi.txt
+python main.py python replay.py cffi delay=1 profile=profile-cffi.txt idle
+rm -f profile-*.txt
+remove_pypy_env;
+
+remove_pypy;
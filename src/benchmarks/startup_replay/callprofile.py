@@ -0,0 +1,199 @@
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Records which attributes a program resolves through pgi and writes them in
+the format of called_on_start.txt, so that later runs can create them
+ahead of time, before the main thread needs them:
+
+    recorder = Recorder()
+    recorder.install()
+    ...
+    save_profile("profile.txt", recorder.names)
+
+    pregen = Pregenerator(load_profile("profile.txt"), resolve)
+    pregen.start()  # or call pregen.step() from an idle callback
+
+pgi caches everything it creates on the module or class, so once the
+pregenerator has resolved an attribute the main thread only does a
+dictionary lookup.
+"""
+
+import os
+import time
+import tempfile
+import threading
+
+
+_lock = threading.RLock()
+
+
+def load_profile(path):
+    """Returns the list of names in the profile at `path`"""
+
+    with open(path) as h:
+        return [l.strip() for l in h if l.strip()]
+
+
+def save_profile(path, names):
+    """Writes the profile atomically, one name per line"""
+
+    dirname = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=dirname or None, suffix=".tmp")
+    try:
+        os.chmod(temp_path, 0o644)
+        with os.fdopen(fd, "w") as h:
+            for name in names:
+                h.write(name + "\n")
+        os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def _module_classes():
+    """Returns the template class for pgi modules and the classes of all
+    modules created so far (each module gets a copy of the template).
+    """
+
+    from pgi import module
+
+    return [module._Module] + [
+        type(m) for m in module._introspection_modules.values()]
+
+
+class Recorder(object):
+    """Records the names of all module attributes and methods resolved by
+    pgi, in the order of first use.
+    """
+
+    def __init__(self):
+        self.names = []
+        self._seen = set()
+
+    def add(self, name):
+        if name not in self._seen:
+            self._seen.add(name)
+            self.names.append(name)
+
+    def install(self):
+        from pgi import obj
+
+        recorder = self
+
+        def wrap_getattr(func):
+            def __getattr__(self, name):
+                attr = func(self, name)
+                recorder.add("%s.%s" % (self.__name__, name))
+                return attr
+            return __getattr__
+
+        for cls in _module_classes():
+            cls.__getattr__ = wrap_getattr(cls.__dict__["__getattr__"])
+
+        get = obj.MethodAttribute.__dict__["__get__"]
+
+        def __get__(self, instance, owner):
+            result = get(self, instance, owner)
+            real_owner = self._real_owner
+            recorder.add("%s.%s.%s" % (
+                real_owner.__module__, real_owner.__name__, self._name))
+            return result
+
+        obj.MethodAttribute.__get__ = __get__
+
+
+def install_lock():
+    """Serializes the creation of module attributes and methods.
+
+    In case the main thread needs an attribute which is currently being
+    created by the pregenerator it waits for it instead of creating it a
+    second time.
+    """
+
+    from pgi import obj
+
+    def wrap_getattr(func):
+        def __getattr__(self, name):
+            with _lock:
+                try:
+                    return self.__dict__[name]
+                except KeyError:
+                    return func(self, name)
+        return __getattr__
+
+    for cls in _module_classes():
+        cls.__getattr__ = wrap_getattr(cls.__dict__["__getattr__"])
+
+    get = obj.MethodAttribute.__dict__["__get__"]
+
+    def __get__(self, instance, owner):
+        with _lock:
+            if self._real_owner.__dict__.get(self._name) is not self:
+                # replaced while we were waiting
+                return getattr(instance or owner, self._name)
+            return get(self, instance, owner)
+
+    obj.MethodAttribute.__get__ = __get__
+
+
+class Pregenerator(object):
+    """Resolves the names of a profile ahead of time.
+
+    Args:
+        names (list): names as in called_on_start.txt
+        resolve (callable): resolves one name, e.g. "Gtk.Widget.show"
+    """
+
+    def __init__(self, names, resolve):
+        self.names = list(names)
+        self.done = 0
+        self.failed = 0
+        self.duration = 0.0
+        self._resolve = resolve
+        self._pending = iter(self.names)
+        self._thread = None
+
+    def step(self):
+        """Resolves the next name. Meant to be called from an idle callback
+        in case no thread should be used.
+
+        Returns:
+            bool: if there are names left
+        """
+
+        name = next(self._pending, None)
+        if name is None:
+            return False
+
+        t = time.time()
+        try:
+            self._resolve(name)
+        except Exception:
+            self.failed += 1
+        else:
+            self.done += 1
+        self.duration += time.time() - t
+        return True
+
+    def _run(self):
+        while self.step():
+            pass
+
+    def start(self):
+        """Starts resolving on a daemon thread"""
+
+        assert self._thread is None
+        install_lock()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Runs the passed replay command (see replay.py) in independent processes
+and prints statistics of the total and per phase startup times, the time
+until each entry could be used for the first time, followed by the entries
+which took the longest.
+
+    main.py python replay.py ctypes|cffi [nocall] [profile=PATH [idle]]
+            [delay=MS]
+"""
+
+import sys
+import json
+import subprocess
+sys.path.insert(0, "..")
+from benchutils import *
+
+from replay import PHASES
+
+
+RUNS = 50
+SLOWEST = 20
+
+
+def main(argv):
+    command = argv[1:]
+    backend = "cffi" if "cffi" in command else "ctypes"
+    prefix = "startup"
+    if any(arg.startswith("profile=") for arg in command):
+        prefix += "-profile"
+        if "idle" in command:
+            prefix += "-idle"
+    vm = command[:command.index("replay.py")]
+    print " ".join(command), subprocess.check_output(
+        vm + ["../ffi_import/info.py"]),
+
+    pool = PinnedPool()
+    print >> sys.stderr, "running on cores %r" % pool.cores
+    results = [json.loads(data) for core, data in
+               pool.check_output([command] * RUNS)]
+
+    total = Stats.from_values([r["total"] for r in results])
+    setup = Stats.from_values([r["setup"] for r in results])
+    phases = {}
+    for phase in PHASES:
+        phases[phase] = Stats.from_values(
+            [r["phases"][phase] for r in results])
+    first_use = Stats.from_values(
+        [e["total"] for r in results for e in r["entries"]])
+
+    print "%-10s %10s %10s %10s" % ("phase", "mean [ms]", "stdev", "p95")
+    for name, stats in [("setup", setup)] + \
+            [(p, phases[p]) for p in PHASES] + [("total", total),
+                                                ("first-use", first_use)]:
+        print "%-10s %10.3f %10.3f %10.3f" % (
+            name, stats.mean * 1000, stats.stdev * 1000,
+            stats.percentile(95) * 1000)
+        report("%s-%s" % (prefix, name), stats, backend=backend)
+
+    if "pregenerated" in results[0]:
+        pregenerated = [r["pregenerated"] for r in results]
+        print "pregenerated: done=%d failed=%d, %.3f ms" % (
+            pregenerated[0]["done"], pregenerated[0]["failed"],
+            average([p["duration"] for p in pregenerated]) * 1000)
+
+    # the entries are the same for each run, so use the median over runs
+    entries = []
+    for i, entry in enumerate(results[0]["entries"]):
+        runs = [r["entries"][i] for r in results]
+        entry_phases = [Stats.from_values([e["phases"][p] for e in runs])
+                        for p in PHASES]
+        entries.append((
+            Stats.from_values([e["total"] for e in runs]).percentile(50),
+            entry["name"], entry["status"],
+            [s.percentile(50) for s in entry_phases]))
+    entries.sort(reverse=True)
+
+    statuses = {}
+    for entry in entries:
+        status = entry[2].split(":")[0]
+        statuses[status] = statuses.get(status, 0) + 1
+    print "entries:", ", ".join(
+        "%s=%d" % item for item in sorted(statuses.items()))
+
+    print
+    print "slowest entries (median ms):"
+    print "%-45s %8s " % ("name", "total") + \
+        " ".join("%8s" % p for p in PHASES)
+    for median, name, status, entry_phases in entries[:SLOWEST]:
+        print "%-45s %8.3f " % (name, median * 1000) + \
+            " ".join("%8.3f" % (t * 1000) for t in entry_phases)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,277 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Resolves all entries of called_on_start.txt through pgi in a fresh process,
+like an application would during its startup, and prints the time spent in
+each phase as JSON:
+
+* typelib: importing the namespace (loading the typelib and the library)
+* lookup: finding the infos in the repository
+* codegen: everything else needed to create the attribute, mainly the
+  generation of the wrapper code and the class setup
+* compile: compiling the generated code
+* call: the first call, only done for getters which take no arguments.
+  Other getters get the status "not callable".
+
+Phases are exclusive, e.g. a lookup happening while generating the code of
+another entry only counts as lookup. Only the main thread is measured.
+
+    replay.py ctypes|cffi [nocall] [record=PATH] [profile=PATH [idle]]
+              [delay=MS]
+
+record=PATH writes the names of all resolved attributes as a profile (see
+callprofile.py), profile=PATH resolves the ones of a recorded profile on a
+worker thread, or with "idle" between the entries, while the entries get
+replayed. delay=MS waits between the entries, like an application doing
+something else, which gives the pregeneration time to get ahead.
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import inspect
+import threading
+sys.path.insert(0, "..")
+from benchutils import *
+
+import callprofile
+
+
+ENTRIES_PATH = os.path.join("..", "called_on_start.txt")
+
+PHASES = ["typelib", "lookup", "codegen", "compile", "call"]
+
+VERSIONS = {
+    "Gdk": "3.0",
+    "GdkPixbuf": "2.0",
+    "GdkX11": "3.0",
+    "Gst": "1.0",
+    "Gtk": "3.0",
+    "Pango": "1.0",
+    "Soup": "2.4",
+}
+
+
+class PhaseTimer(object):
+    """Sums up the time spent in each phase, excluding the time of nested
+    phases.
+    """
+
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self._stack = []
+        self._last = 0.0
+        self._thread = threading.current_thread()
+
+    def push(self, phase):
+        now = timer()
+        if self._stack:
+            self.totals[self._stack[-1]] += now - self._last
+        self._stack.append(phase)
+        self._last = now
+
+    def pop(self):
+        now = timer()
+        self.totals[self._stack.pop()] += now - self._last
+        self._last = now
+
+    def wrap(self, phase, func):
+        def wrapper(*args, **kwargs):
+            # only count what happens while replaying an entry on the main
+            # thread and not the pregeneration
+            if not self._stack or \
+                    threading.current_thread() is not self._thread:
+                return func(*args, **kwargs)
+            self.push(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.pop()
+        return wrapper
+
+    def patch(self, cls, name, phase):
+        """Makes all calls of the method `name` of `cls` count as `phase`"""
+
+        setattr(cls, name, self.wrap(phase, getattr(cls, name)))
+
+
+def instrument(phases):
+    from pgi import util
+    from pgi.codegen import utils
+
+    phases.patch(util.InfoIterWrapper, "lookup_name", "lookup")
+    phases.patch(utils.CodeBlock, "compile", "compile")
+
+
+def read_entries(path=ENTRIES_PATH):
+    with open(path) as h:
+        return [l.strip() for l in h if l.strip()]
+
+
+def import_namespace(namespace):
+    import gi
+
+    version = VERSIONS.get(namespace)
+    if version is not None:
+        gi.require_version(namespace, version)
+    return getattr(__import__("gi.repository." + namespace).repository,
+                   namespace)
+
+
+def resolve(name):
+    parts = name.split(".")
+    obj = import_namespace(parts[0])
+    for part in parts[1:]:
+        obj = getattr(obj, part)
+    return obj
+
+
+def get_option(argv, key, default=None):
+    for arg in argv:
+        if arg.startswith(key + "="):
+            return arg.split("=", 1)[1]
+    return default
+
+
+def is_getter(name):
+    return name.split(".")[-1].startswith("get_")
+
+
+def takes_no_arguments(obj):
+    """Returns True if `obj` is a function or static method which can be
+    called without arguments. Unbound methods need an instance.
+    """
+
+    if not isinstance(obj, types.FunctionType):
+        return False
+    args, varargs, keywords, defaults = inspect.getargspec(obj)
+    return len(args) == len(defaults or ())
+
+
+def replay_entry(phases, modules, entry, call):
+    """Resolves one entry and returns its status"""
+
+    parts = entry.split(".")
+    namespace = parts[0]
+
+    if namespace not in modules:
+        phases.push("typelib")
+        try:
+            modules[namespace] = import_namespace(namespace)
+        except (ImportError, ValueError):
+            modules[namespace] = None
+        finally:
+            phases.pop()
+
+    obj = modules[namespace]
+    if obj is None:
+        return "unavailable"
+
+    phases.push("codegen")
+    try:
+        for part in parts[1:]:
+            obj = getattr(obj, part)
+    except (AttributeError, NotImplementedError) as e:
+        return "error: %s" % type(e).__name__
+    finally:
+        phases.pop()
+
+    if not call or not is_getter(entry):
+        return "resolved"
+    if not takes_no_arguments(obj):
+        return "not callable"
+
+    phases.push("call")
+    try:
+        obj()
+    except TypeError:
+        return "not callable"
+    except Exception as e:
+        return "error: %s" % type(e).__name__
+    finally:
+        phases.pop()
+    return "called"
+
+
+def main(argv):
+    t = timer()
+    import pgi
+    pgi.install_as_gi()
+    backend = "cffi" if "cffi" in argv[1:] else "ctypes"
+    pgi.set_backend(backend)
+    setup = timer() - t
+
+    phases = PhaseTimer()
+    instrument(phases)
+    call = "nocall" not in argv[1:]
+    delay = float(get_option(argv, "delay", 0)) / 1000
+
+    record_path = get_option(argv, "record")
+    if record_path is not None:
+        recorder = callprofile.Recorder()
+        recorder.install()
+
+    pregen = None
+    profile_path = get_option(argv, "profile")
+    if profile_path is not None:
+        pregen = callprofile.Pregenerator(
+            callprofile.load_profile(profile_path), resolve)
+        idle = "idle" in argv[1:]
+        if not idle:
+            pregen.start()
+
+    modules = {}
+    entries = []
+    total = 0.0
+    for entry in read_entries():
+        if delay:
+            deadline = time.time() + delay
+            if pregen is not None and idle:
+                while time.time() < deadline and pregen.step():
+                    pass
+            time.sleep(max(0, deadline - time.time()))
+
+        before = dict(phases.totals)
+        start = timer()
+        status = replay_entry(phases, modules, entry, call)
+        duration = timer() - start
+        total += duration
+        entries.append({
+            "name": entry,
+            "total": duration,
+            "status": status,
+            "phases": dict(
+                (p, phases.totals[p] - before[p]) for p in PHASES),
+        })
+
+    result = {
+        "backend": backend,
+        "setup": setup,
+        "total": total,
+        "phases": phases.totals,
+        "entries": entries,
+    }
+
+    if pregen is not None:
+        result["pregenerated"] = {
+            "done": pregen.done,
+            "failed": pregen.failed,
+            "duration": pregen.duration,
+        }
+
+    if record_path is not None:
+        callprofile.save_profile(record_path, recorder.names)
+
+    print json.dumps(result)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
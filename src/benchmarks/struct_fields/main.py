@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Reads and writes the fields of arrays of RegressTestStructA and
+RegressTestStructB records and prints the time per record for:
+
+* wrapgen: classes created by wrapgen.create_struct() using the field
+  offsets from the typelib
+* ctypes: ctypes.Structure
+* cffi: cffi struct arrays
+* pgi: pgi boxed structs, one allocation per record
+
+    main.py [wrapgen] [ctypes] [cffi] [pgi]
+
+Needs the Regress library and typelib from ../pgi_torture.
+"""
+
+import sys
+import platform
+sys.path.insert(0, "..")
+from benchutils import *
+import wrapgen
+
+
+ROUNDS = 1000
+RECORDS = 1000
+IMPLEMENTATIONS = ["wrapgen", "ctypes", "cffi", "pgi"]
+# which FFI the implementation uses
+BACKENDS = {
+    "wrapgen": "ctypes",
+    "ctypes": "ctypes",
+    "cffi": "cffi",
+    "pgi": "ctypes",
+}
+
+CDEF = """
+typedef int RegressTestEnum;
+
+typedef struct {
+    int some_int;
+    signed char some_int8;
+    double some_double;
+    RegressTestEnum some_enum;
+} RegressTestStructA;
+
+typedef struct {
+    signed char some_int8;
+    RegressTestStructA nested_a;
+} RegressTestStructB;
+"""
+
+
+def get_field_type(type_info):
+    """Returns the wrapgen field type for a GITypeInfo or None"""
+
+    from pgi.clib.gir import GITypeTag, GIInfoType
+
+    tag = int(type_info.tag)
+    if type_info.is_pointer:
+        return "pointer"
+    elif tag == GITypeTag.INTERFACE:
+        iface = type_info.get_interface()
+        iface_type = int(iface.type)
+        if iface_type == GIInfoType.ENUM:
+            return "int32"
+        elif iface_type == GIInfoType.FLAGS:
+            return "uint32"
+        elif iface_type == GIInfoType.STRUCT:
+            return get_struct(iface)
+        return None
+
+    return {
+        GITypeTag.BOOLEAN: "int32",
+        GITypeTag.INT8: "int8",
+        GITypeTag.UINT8: "uint8",
+        GITypeTag.INT16: "int16",
+        GITypeTag.UINT16: "uint16",
+        GITypeTag.INT32: "int32",
+        GITypeTag.UINT32: "uint32",
+        GITypeTag.INT64: "int64",
+        GITypeTag.UINT64: "uint64",
+        GITypeTag.UNICHAR: "uint32",
+        GITypeTag.GTYPE: "size_t",
+        GITypeTag.FLOAT: "float",
+        GITypeTag.DOUBLE: "double",
+    }.get(tag)
+
+
+def get_struct(info):
+    """Returns a wrapgen.Struct for a GIStructInfo, skipping fields of
+    types it doesn't support.
+    """
+
+    from pgi.clib.gir import GIFieldInfoFlags
+
+    fields = []
+    for field_info in info.get_fields():
+        type_ = get_field_type(field_info.get_type())
+        if type_ is None:
+            continue
+        writable = bool(
+            field_info.flags.value & GIFieldInfoFlags.IS_WRITABLE)
+        fields.append(wrapgen.Field(
+            field_info.name, type_, field_info.offset, writable))
+    return wrapgen.Struct(
+        info.namespace + info.name, info.size, fields)
+
+
+def get_wrapgen_structs():
+    from pgi.clib.gir import GIRepository
+
+    repo = GIRepository.get_default()
+    repo.require("Regress", "1.0", 0)
+    return [wrapgen.create_struct(get_struct(repo.find_by_name(
+        "Regress", name))) for name in ["TestStructA", "TestStructB"]]
+
+
+def get_records(impl, count):
+    """Returns two lists of `count` TestStructA and TestStructB records"""
+
+    if impl == "wrapgen":
+        records = []
+        for cls in get_wrapgen_structs():
+            # all records share one buffer, like a C array
+            buffer_ = bytearray(cls.size * count)
+            records.append(
+                [cls.from_buffer(buffer_, i * cls.size)
+                 for i in xrange(count)])
+        return records
+    elif impl == "ctypes":
+        import ctypes
+
+        class RegressTestStructA(ctypes.Structure):
+            _fields_ = [
+                ("some_int", ctypes.c_int),
+                ("some_int8", ctypes.c_int8),
+                ("some_double", ctypes.c_double),
+                ("some_enum", ctypes.c_int),
+            ]
+
+        class RegressTestStructB(ctypes.Structure):
+            _fields_ = [
+                ("some_int8", ctypes.c_int8),
+                ("nested_a", RegressTestStructA),
+            ]
+
+        return [list((RegressTestStructA * count)()),
+                list((RegressTestStructB * count)())]
+    elif impl == "cffi":
+        import cffi
+
+        ffi = cffi.FFI()
+        ffi.cdef(CDEF)
+        arrays = [ffi.new("RegressTestStructA[]", count),
+                  ffi.new("RegressTestStructB[]", count)]
+        return [[array[i] for i in xrange(count)] for array in arrays]
+    else:
+        import pgi
+        pgi.install_as_gi()
+        import gi
+        gi.require_version("Regress", "1.0")
+        from gi.repository import Regress
+
+        return [[Regress.TestStructA() for i in xrange(count)],
+                [Regress.TestStructB() for i in xrange(count)]]
+
+
+def read_a(records):
+    total = 0
+    for r in records:
+        total += r.some_int + r.some_int8 + r.some_double + r.some_enum
+    return total
+
+
+def write_a(records):
+    for r in records:
+        r.some_int = 42
+        r.some_int8 = 4
+        r.some_double = 4.5
+        r.some_enum = 1
+
+
+def read_b(records):
+    total = 0
+    for r in records:
+        total += r.some_int8 + r.nested_a.some_int
+    return total
+
+
+def write_b(records):
+    for r in records:
+        r.some_int8 = 4
+        r.nested_a.some_int = 42
+
+
+def main(argv):
+    impls = [i for i in IMPLEMENTATIONS if i in argv[1:]] or IMPLEMENTATIONS
+    python = platform.python_implementation()
+
+    print >> sys.stderr, "%d records, avg of %d runs" % (RECORDS, ROUNDS)
+    print "%-10s %-10s %-22s %12s %12s %12s" % (
+        "python", "impl", "loop", "mean [us]", "p50 [us]", "p95 [us]")
+
+    for impl in impls:
+        records_a, records_b = get_records(impl, RECORDS)
+        for struct_name, records, write, read, expected in [
+                ("TestStructA", records_a, write_a, read_a, 42 + 4 + 4.5 + 1),
+                ("TestStructB", records_b, write_b, read_b, 4 + 42)]:
+            for func in [write, read]:
+                stats = measure(func, [records], rounds=ROUNDS, loops=1)
+                desc = "%s-%s" % (struct_name, func.__name__.split("_")[0])
+                print "%-10s %-10s %-22s %12.3f %12.3f %12.3f" % (
+                    python, impl, desc, stats.mean * 1e6 / RECORDS,
+                    stats.percentile(50) * 1e6 / RECORDS,
+                    stats.percentile(95) * 1e6 / RECORDS)
+                report("fields-%s-%s" % (impl, desc), stats,
+                       backend=BACKENDS[impl], records=RECORDS)
+            # everything got written and reads the same through the
+            # implementation
+            assert read(records) == expected * RECORDS
+
+
+if __name__ == "__main__":
+    main(sys.argv)
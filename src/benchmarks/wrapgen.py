@@ -0,0 +1,1823 @@
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+A small wrapper code generator, modeled after the one in pgi.
+
+Takes the signature of a C function and generates Python code which
+converts the arguments, calls the function through cffi and converts the
+result:
+
+    func = Function("overhead", [
+        Arg("list_", "int32[]", length="num"),
+        Arg("num", "size_t"),
+        Arg("text", "utf8", nullable=True),
+    ], return_type="int32", throws=True)
+
+    wrapper = create_function(func, CFFIBackend(ffi, lib), mode="deferred")
+
+Arguments can be "out" or "inout", in which case a pointer to the value
+gets passed and the resulting values are returned after the return value,
+as a tuple if there is more than one. For "out" arrays the length argument
+has to be "out" as well, and the array is assumed to be owned by the
+callee.
+
+Modes:
+
+* "eager": like pgi, every argument gets type and range checked before
+  the call.
+* "deferred": only does the conversions the FFI can't do itself (encoding
+  text for example) and leaves type and range checks to the FFI. Only in
+  case the FFI raises, the eager wrapper is called, which either raises
+  with the name and position of the offending argument or converts the
+  value (objects implementing __int__ for example) and calls again.
+
+With optimize=True the generated code is passed through optimize_block()
+before compiling, which folds constant expressions, removes branches with
+constant conditions and turns all global lookups (dependencies, their
+attributes and builtins) into closure variables.
+
+CodeCache stores the generated code on disk, so other processes can skip
+generating (and, if optimized, compiling) it:
+
+    cache = CodeCache("Regress", "1.0", typelib_data)
+    wrapper = create_function(func, backend, cache=cache)
+
+WrapperCache keeps the created wrappers in memory, optionally only the
+most recently used ones:
+
+    wrappers = WrapperCache(backend, maxsize=500)
+    wrappers.get(func)(*args)
+
+Passing a CallStats generates wrappers which count their calls and time
+the argument conversion, the C call and the result conversion separately.
+Without one the generated code is the same as before, so there is no
+overhead when not in use:
+
+    stats = CallStats()
+    wrappers.set_stats(stats)  # all wrappers get generated again
+    ...
+    print(stats.format_table())
+
+CallbackCache does the same for callbacks passed to C, so connecting the
+same Python callable again reuses its native trampoline instead of
+allocating a new one:
+
+    callbacks = CallbackCache(backend, "void(*)(void*)")
+    lib.noop_invoke(callbacks.get(func), ffi.NULL, 1)
+
+Passing a StringCache makes the wrappers reuse the UTF-8 encoded copy of
+text arguments passed again, like property or signal names which are
+usually the same constant objects in each call:
+
+    wrapper = create_function(func, backend, strings=StringCache())
+
+create_struct() generates a ctypes.Structure for a C struct with each
+field at its fixed offset, so reading a field is done by the ctypes field
+descriptor in C. Writes get type and range checked first. Instances can
+be views into a buffer, so arrays of records can share one:
+
+    TestStructA = create_struct(Struct("TestStructA", 24, [
+        Field("some_int", "int32", 0),
+        Field("some_double", "double", 8),
+    ]))
+    records = bytearray(TestStructA.size * 100)
+    TestStructA.from_buffer(records, TestStructA.size * 42).some_double = 4.2
+"""
+
+import os
+import sys
+import ast
+import json
+import timeit
+import keyword
+import marshal
+import hashlib
+import types
+import operator
+import platform
+import binascii
+import tempfile
+from collections import OrderedDict
+
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    import __builtin__ as builtins
+    integer_types = (int, long)
+    text_type = unicode
+else:
+    import builtins
+    integer_types = (int,)
+    text_type = str
+
+MODES = ["eager", "deferred"]
+
+DIRECTIONS = ["in", "out", "inout"]
+
+
+class CallError(Exception):
+    """Raised by wrappers of throwing functions in case the error out
+    argument got set.
+    """
+
+    def __init__(self, symbol, code):
+        super(CallError, self).__init__("%s() failed: %d" % (symbol, code))
+        self.symbol = symbol
+        self.code = code
+
+
+# keywords of all supported Python versions, and the builtins the
+# generated code uses by name
+_RESERVED_NAMES = set(keyword.kwlist) | set(dir(builtins)) | set([
+    "print", "exec", "nonlocal", "async", "await", "True", "False", "None"])
+
+
+def escape_name(name):
+    """Returns `name` usable as a parameter name in the generated code.
+    Keywords and builtins get a "_" appended, like pgi does.
+    """
+
+    while name in _RESERVED_NAMES:
+        name += "_"
+    return name
+
+
+class Arg(object):
+    """A C function argument.
+
+    `name` is used in error messages, `py_name` in the generated code.
+
+    Args:
+        name (str): the argument name
+        type_ (str): one of TYPES
+        length (str): for arrays, the name of the argument which takes the
+            array length. That argument isn't exposed in Python.
+        nullable (bool): if None gets passed as NULL
+        direction (str): one of DIRECTIONS
+    """
+
+    def __init__(self, name, type_, length=None, nullable=False,
+                 direction="in"):
+        if type_ not in TYPES:
+            raise ValueError("unknown type %r" % type_)
+        if direction not in DIRECTIONS:
+            raise ValueError("unknown direction %r" % direction)
+        self.name = name
+        self.py_name = escape_name(name)
+        self.type = type_
+        self.length = length
+        self.nullable = nullable
+        self.direction = direction
+
+    def get_ctype(self):
+        ctype = TYPES[self.type].ctype
+        if self.direction != "in":
+            ctype += "*"
+        return ctype
+
+    def __repr__(self):
+        return "<%s name=%r type=%r>" % (
+            type(self).__name__, self.name, self.type)
+
+
+class Function(object):
+    """A C function signature.
+
+    Args:
+        symbol (str): the C symbol
+        args (list): list of Arg in C order
+        return_type (str): one of TYPES or "void"
+        throws (bool): if there is an additional `int* error` argument at
+            the end which gets set in case of an error
+    """
+
+    def __init__(self, symbol, args, return_type="void", throws=False):
+        if return_type != "void" and return_type not in TYPES:
+            raise ValueError("unknown type %r" % return_type)
+        py_names = [a.py_name for a in args]
+        if len(set(py_names)) != len(py_names):
+            raise ValueError("argument names clash: %r" % py_names)
+        self.symbol = symbol
+        self.args = args
+        self.return_type = return_type
+        self.throws = throws
+
+    @property
+    def lengths(self):
+        """The names of all arguments which take an array length"""
+
+        return set(a.length for a in self.args if a.length)
+
+    @property
+    def py_args(self):
+        """The arguments as exposed in Python"""
+
+        lengths = self.lengths
+        return [a for a in self.args
+                if a.name not in lengths and a.direction != "out"]
+
+    def get_cdef(self):
+        """Returns the C declaration of the function"""
+
+        if self.return_type == "void":
+            ret = "void"
+        else:
+            ret = TYPES[self.return_type].ctype
+        args = ["%s %s" % (a.get_ctype(), a.py_name) for a in self.args]
+        if self.throws:
+            args.append("int* error")
+        return "%s %s(%s);" % (ret, self.symbol, ", ".join(args) or "void")
+
+
+class VariableFactory(object):
+    """A callable the produces unique variable names"""
+
+    def __init__(self, blacklist=None):
+        self._count = 0
+        self._blacklist = set(blacklist or [])
+        self._obj_cache = {}
+
+    def __call__(self, *args):
+        """Get a random new name, pass an obj to get a cached one"""
+
+        if not args:
+            self._count += 1
+            res = "t%d" % self._count
+        else:
+            obj = args[0]
+            try:
+                # use id so this works for non hashable types
+                return self._obj_cache[id(obj)][0]
+            except KeyError:
+                self._count += 1
+                res = "e%d" % self._count
+                # keep obj alive, so id() is unique
+                self._obj_cache[id(obj)] = (res, obj)
+
+        while res in self._blacklist:
+            res += "_"
+        self._blacklist.add(res)
+        return res
+
+
+class CodeBlock(object):
+    """A piece of code with global dependencies"""
+
+    INDENTATION = 4
+
+    def __init__(self):
+        self._lines = []
+        self._deps = {}
+        # dependency name -> key for resolve_dependency(), or None
+        self.dep_keys = {}
+
+    def get_dependencies(self):
+        return self._deps
+
+    def add_dependency(self, name, obj):
+        """Add a code dependency so it gets inserted into globals"""
+
+        if name in self._deps:
+            if self._deps[name] is obj:
+                return
+            raise ValueError(
+                "There exists a different dep with the same name : %r" % name)
+        self._deps[name] = obj
+
+    def write_line(self, line, level=0):
+        """Append a new line"""
+
+        self._lines.append((line, level))
+
+    def compile(self, filename="<wrapgen>"):
+        """Execute the python code and returns the global dict"""
+
+        code = compile(str(self), filename, "exec")
+        global_dict = dict(self._deps)
+        exec(code, global_dict)
+        return global_dict
+
+    def __str__(self):
+        lines = []
+        for line, level in self._lines:
+            lines.append(" " * self.INDENTATION * level + line)
+        return "\n".join(lines)
+
+
+class BaseType(object):
+    """Generates the conversion code for one argument"""
+
+    ctype = None
+
+    def __init__(self, gen, arg, pos):
+        self.gen = gen
+        self.arg = arg
+        self.pos = pos
+
+    def type_error(self, value, expected):
+        return 'raise TypeError("%s() argument %r (position %d): ' \
+            'expected %s, got %%s" %% type(%s).__name__)' % (
+                self.gen.func.symbol, self.arg.name, self.pos, expected, value)
+
+    def overflow_error(self, value, desc):
+        return 'raise OverflowError("%s() argument %r (position %d): ' \
+            '%%r %s" %% (%s,))' % (
+                self.gen.func.symbol, self.arg.name, self.pos, desc, value)
+
+    def check(self, name, level):
+        """Writes the code checking and converting the Python value `name`
+        and returns the expression to pass to the C function.
+        """
+
+        raise NotImplementedError
+
+    def fast(self, name, level):
+        """Like check(), but only for conversions the FFI doesn't do"""
+
+        return name
+
+    def alloc(self, value, level):
+        """Writes the code allocating the memory for an out or inout
+        argument and returns the pointer to pass. `value` is the
+        converted in value or None for out arguments.
+        """
+
+        gen = self.gen
+        var = gen.var()
+        ffi = gen.dep(gen.backend.ffi)
+        if value is None:
+            gen.write('%s = %s.new("%s*")' % (var, ffi, self.ctype), level)
+        else:
+            gen.write('%s = %s.new("%s*", %s)' % (
+                var, ffi, self.ctype, value), level)
+        return var
+
+    def read(self, pointer, level):
+        """Returns the expression for the Python value of an out or inout
+        argument after the call.
+        """
+
+        return self.result("%s[0]" % pointer, level)
+
+    def result(self, name, level):
+        """Returns the expression for the Python value of the C result"""
+
+        return name
+
+
+class _Integer(BaseType):
+
+    min_value = None
+    max_value = None
+    range_desc = None
+
+    def check(self, name, level):
+        gen = self.gen
+        var = gen.var()
+        gen.write("if isinstance(%s, %s):" % (name, gen.dep(integer_types)),
+                  level)
+        gen.write("%s = %s" % (var, name), level + 1)
+        gen.write("else:", level)
+        gen.write("try:", level + 1)
+        gen.write("%s = int(%s)" % (var, name), level + 2)
+        gen.write("except (TypeError, ValueError):", level + 1)
+        gen.write(self.type_error(name, "int"), level + 2)
+        gen.write("if not %s <= %s < %s:" % (
+            self.min_value, var, self.max_value), level)
+        gen.write(self.overflow_error(var, self.range_desc), level + 1)
+        return var
+
+
+class Int32(_Integer):
+    ctype = "int32_t"
+    min_value = "-2**31"
+    max_value = "2**31"
+    range_desc = "not in int32 range"
+
+
+class UInt32(_Integer):
+    ctype = "uint32_t"
+    min_value = "0"
+    max_value = "2**32"
+    range_desc = "not in uint32 range"
+
+
+class SizeT(_Integer):
+    ctype = "size_t"
+    min_value = "0"
+    max_value = "%d" % (2 ** 64)
+    range_desc = "not in size_t range"
+
+
+class Double(BaseType):
+    ctype = "double"
+
+    def check(self, name, level):
+        gen = self.gen
+        var = gen.var()
+        gen.write("try:", level)
+        gen.write("%s = float(%s)" % (var, name), level + 1)
+        gen.write("except (TypeError, ValueError):", level)
+        gen.write(self.type_error(name, "float"), level + 1)
+        return var
+
+
+class UTF8(BaseType):
+    ctype = "char*"
+
+    def _convert(self, name, level, check):
+        gen = self.gen
+        var = gen.var()
+        first = "if"
+        if self.arg.nullable:
+            gen.write("if %s is None:" % name, level)
+            gen.write("%s = %s.NULL" % (var, gen.dep(gen.backend.ffi)),
+                      level + 1)
+            first = "elif"
+        gen.write("%s isinstance(%s, %s):" % (
+            first, name, gen.dep(text_type)), level)
+        if gen.strings is None:
+            gen.write('%s = %s.encode("utf-8")' % (var, name), level + 1)
+        else:
+            # inline the lookup, a call of StringCache.encode() costs more
+            # than encoding a short text
+            strings = gen.strings
+            entry = gen.var()
+            gen.write("%s = %s(%s(%s))" % (
+                entry, gen.dep(strings.lookup), gen.dep(id), name),
+                level + 1)
+            gen.write("if %s is not None and %s[0] is %s:" % (
+                entry, entry, name), level + 1)
+            gen.write("%s = %s[1]" % (var, entry), level + 2)
+            gen.write("else:", level + 1)
+            gen.write("%s = %s(%s)" % (
+                var, gen.dep(strings.encode), name), level + 2)
+        if check:
+            gen.write("elif isinstance(%s, bytes):" % name, level)
+            gen.write("%s = %s" % (var, name), level + 1)
+            gen.write("else:", level)
+            gen.write(self.type_error(
+                name, "str" + (" or None" if self.arg.nullable else "")),
+                level + 1)
+        else:
+            gen.write("else:", level)
+            gen.write("%s = %s" % (var, name), level + 1)
+        return var
+
+    def check(self, name, level):
+        return self._convert(name, level, True)
+
+    def fast(self, name, level):
+        return self._convert(name, level, False)
+
+    def result(self, name, level):
+        gen = self.gen
+        var = gen.var()
+        ffi = gen.dep(gen.backend.ffi)
+        gen.write("if %s == %s.NULL:" % (name, ffi), level)
+        gen.write("%s = None" % var, level + 1)
+        gen.write("else:", level)
+        gen.write("%s = %s.string(%s)" % (var, ffi, name), level + 1)
+        return var
+
+    def alloc(self, value, level):
+        if value is None:
+            return super(UTF8, self).alloc(value, level)
+
+        # the buffer has to be kept alive until after the call
+        gen = self.gen
+        ffi = gen.dep(gen.backend.ffi)
+        buf = gen.var()
+        gen.write("if isinstance(%s, bytes):" % value, level)
+        gen.write('%s = %s.new("char[]", %s)' % (buf, ffi, value), level + 1)
+        gen.write("else:", level)
+        gen.write("%s = %s" % (buf, value), level + 1)
+        return super(UTF8, self).alloc(buf, level)
+
+
+class Int32Array(BaseType):
+    ctype = "int32_t*"
+
+    def check(self, name, level):
+        gen = self.gen
+        items = gen.var()
+        item = gen.var()
+        gen.write("if not isinstance(%s, (list, tuple)):" % name, level)
+        gen.write(self.type_error(name, "a list"), level + 1)
+        gen.write("%s = []" % items, level)
+        gen.write("for %s in %s:" % (item, name), level)
+        gen.write("if not isinstance(%s, %s):" % (
+            item, gen.dep(integer_types)), level + 1)
+        gen.write("try:", level + 2)
+        gen.write("%s = int(%s)" % (item, item), level + 3)
+        gen.write("except (TypeError, ValueError):", level + 2)
+        gen.write(self.type_error(item, "a list of int"), level + 3)
+        gen.write("if not -2**31 <= %s < 2**31:" % item, level + 1)
+        gen.write(self.overflow_error(item, "not in int32 range"), level + 2)
+        gen.write("%s.append(%s)" % (items, item), level + 1)
+        gen.lengths[self.arg.length] = "len(%s)" % items
+        var = gen.var()
+        gen.write('%s = %s.new("int32_t[]", %s)' % (
+            var, gen.dep(gen.backend.ffi), items), level)
+        return var
+
+    def fast(self, name, level):
+        if self.arg.direction == "inout":
+            # needs a real array as the callee can replace it
+            return self.check(name, level)
+
+        # cffi converts lists and tuples itself
+        self.gen.lengths[self.arg.length] = "len(%s)" % name
+        return name
+
+    def alloc(self, value, level):
+        gen = self.gen
+        ffi = gen.dep(gen.backend.ffi)
+        self._length = gen.var()
+        if value is None:
+            gen.write('%s = %s.new("size_t*")' % (self._length, ffi), level)
+        else:
+            gen.write('%s = %s.new("size_t*", %s)' % (
+                self._length, ffi, gen.lengths[self.arg.length]), level)
+        gen.lengths[self.arg.length] = self._length
+        return super(Int32Array, self).alloc(value, level)
+
+    def read(self, pointer, level):
+        gen = self.gen
+        var = gen.var()
+        gen.write("if %s[0] == %s.NULL:" % (
+            pointer, gen.dep(gen.backend.ffi)), level)
+        gen.write("%s = []" % var, level + 1)
+        gen.write("else:", level)
+        gen.write("%s = list(%s[0][0:%s[0]])" % (var, pointer, self._length),
+                  level + 1)
+        return var
+
+
+class Pointer(BaseType):
+    ctype = "void*"
+
+    def check(self, name, level):
+        gen = self.gen
+        ffi = gen.dep(gen.backend.ffi)
+        var = gen.var()
+        if self.arg.nullable:
+            gen.write("if %s is None:" % name, level)
+            gen.write("%s = %s.NULL" % (var, ffi), level + 1)
+            gen.write("elif isinstance(%s, %s.CData):" % (name, ffi), level)
+        else:
+            gen.write("if isinstance(%s, %s.CData):" % (name, ffi), level)
+        gen.write("%s = %s" % (var, name), level + 1)
+        gen.write("else:", level)
+        gen.write(self.type_error(name, "a pointer"), level + 1)
+        return var
+
+    def fast(self, name, level):
+        if not self.arg.nullable:
+            return name
+        gen = self.gen
+        var = gen.var()
+        gen.write("%s = %s.NULL if %s is None else %s" % (
+            var, gen.dep(gen.backend.ffi), name, name), level)
+        return var
+
+
+TYPES = {
+    "int32": Int32,
+    "uint32": UInt32,
+    "size_t": SizeT,
+    "double": Double,
+    "utf8": UTF8,
+    "int32[]": Int32Array,
+    "pointer": Pointer,
+}
+
+
+class CFFIBackend(object):
+    """Calls the functions of a cffi library.
+
+    Args:
+        ffi (cffi.FFI): the FFI which declares the functions
+        lib: the library returned by ffi.dlopen()
+    """
+
+    NAME = "cffi"
+
+    def __init__(self, ffi, lib):
+        self.ffi = ffi
+        self.lib = lib
+
+    def get_symbol(self, symbol):
+        return getattr(self.lib, symbol)
+
+    def create_callback(self, signature, callable_, error=None):
+        return self.ffi.callback(signature, callable_, error)
+
+
+_timer = timeit.default_timer
+
+
+class CallStats(object):
+    """Call counts and times of instrumented wrappers, by C symbol.
+
+    The time of each call is split into "marshal" (checking and converting
+    the arguments), "call" (the C function) and "result" (converting the
+    return value and out arguments). Calls which raise aren't counted.
+    """
+
+    COLUMNS = ["calls", "marshal", "call", "result"]
+
+    def __init__(self):
+        # symbol -> [calls, marshal, call, result]
+        self._entries = {}
+
+    def get_entry(self, symbol):
+        """Returns the list the wrapper for `symbol` adds its counts to"""
+
+        return self._entries.setdefault(symbol, [0, 0.0, 0.0, 0.0])
+
+    def reset(self):
+        for entry in self._entries.values():
+            entry[:] = [0, 0.0, 0.0, 0.0]
+
+    def get_rows(self):
+        """Returns a list of dicts, one per called function, sorted by total
+        time, slowest first.
+        """
+
+        rows = []
+        for symbol, entry in self._entries.items():
+            if not entry[0]:
+                continue
+            row = dict(zip(self.COLUMNS, entry))
+            row["symbol"] = symbol
+            row["total"] = sum(entry[1:])
+            rows.append(row)
+        rows.sort(key=lambda r: r["total"], reverse=True)
+        return rows
+
+    def format_table(self):
+        """Returns the rows as a text table, times in microseconds per
+        call
+        """
+
+        lines = ["%-40s %10s %10s %10s %10s %10s" % (
+            "symbol", "calls", "total", "marshal", "call", "result")]
+        for row in self.get_rows():
+            calls = row["calls"]
+            lines.append("%-40s %10d %10.3f %10.3f %10.3f %10.3f" % (
+                row["symbol"], calls,
+                row["total"] * 1e6 / calls, row["marshal"] * 1e6 / calls,
+                row["call"] * 1e6 / calls, row["result"] * 1e6 / calls))
+        return "\n".join(lines)
+
+    def to_json(self):
+        """Returns the rows as JSON, times in seconds summed over all
+        calls
+        """
+
+        return json.dumps(self.get_rows(), sort_keys=True)
+
+
+class StringCache(object):
+    """Keeps the UTF-8 encoded copies of the last passed text strings,
+    keyed by the identity of the text object.
+
+    Looking up by identity doesn't need to hash or compare the text, but
+    only helps if the same object gets passed again, e.g. a constant in the
+    calling code. Texts longer than `max_length` aren't cached and once
+    `maxsize` texts are cached the cache gets cleared.
+
+    Args:
+        maxsize (int): maximum number of cached texts
+        max_length (int): maximum length of cached texts
+    """
+
+    def __init__(self, maxsize=256, max_length=64):
+        if maxsize < 1:
+            raise ValueError("maxsize has to be at least 1")
+        self.maxsize = maxsize
+        self.max_length = max_length
+        self.hits = 0
+        self.misses = 0
+        # id(text) -> (text, encoded), the reference to the text makes sure
+        # the id doesn't get reused
+        self._entries = {}
+        # generated code looks up the entries itself and only calls
+        # encode() if it doesn't find one
+        self.lookup = self._entries.get
+
+    def __len__(self):
+        return len(self._entries)
+
+    def encode(self, text):
+        """Returns text.encode("utf-8")"""
+
+        entry = self._entries.get(id(text))
+        if entry is not None and entry[0] is text:
+            self.hits += 1
+            return entry[1]
+
+        encoded = text.encode("utf-8")
+        if len(text) <= self.max_length:
+            self.misses += 1
+            if len(self._entries) >= self.maxsize:
+                self._entries.clear()
+            self._entries[id(text)] = (text, encoded)
+        return encoded
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Returns a dict with the hits, misses (of cacheable texts), size
+        (number of cached texts) and maxsize. Generated wrappers only count
+        misses, as they do the lookup themselves.
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+
+class _Generator(object):
+
+    def __init__(self, func, backend, stats=None, strings=None):
+        self.func = func
+        self.backend = backend
+        self.stats = stats
+        self.strings = strings
+        self.block = CodeBlock()
+        self.var = VariableFactory([a.py_name for a in func.args])
+        # length argument name -> expression
+        self.lengths = {}
+        self.result = self.var()
+        self.symbol = backend.get_symbol(func.symbol)
+        # dependencies which can be resolved again in another process
+        self._keys = {
+            id(backend.ffi): "ffi",
+            id(self.symbol): "symbol",
+            id(integer_types): "integer_types",
+            id(text_type): "text_type",
+            id(CallError): "CallError",
+        }
+
+    def write(self, line, level=0):
+        self.block.write_line(line, level)
+
+    def dep(self, obj):
+        name = self.var(obj)
+        self.block.add_dependency(name, obj)
+        self.block.dep_keys[name] = self._keys.get(id(obj))
+        return name
+
+    def _write_args(self, check, level):
+        """Writes the argument conversion, returns a dict mapping argument
+        names to the expression to pass and a list of (type, pointer) for
+        all out and inout arguments.
+        """
+
+        exprs = {}
+        outs = []
+        positions = dict(
+            (a.name, i + 1) for i, a in enumerate(self.func.py_args))
+        lengths = self.func.lengths
+        for arg in self.func.args:
+            if arg.name in lengths:
+                continue
+            type_ = TYPES[arg.type](self, arg, positions.get(arg.name, 0))
+            if arg.direction == "out":
+                value = None
+            elif check:
+                value = type_.check(arg.py_name, level)
+            else:
+                value = type_.fast(arg.py_name, level)
+            if arg.direction == "in":
+                exprs[arg.name] = value
+            else:
+                exprs[arg.name] = type_.alloc(value, level)
+                outs.append((type_, exprs[arg.name]))
+        return exprs, outs
+
+    def _write_call(self, exprs, level):
+        """Writes the C call, returns the error variable or None"""
+
+        func = self.func
+        args = []
+        for arg in func.args:
+            if arg.name in self.lengths:
+                args.append(self.lengths[arg.name])
+            else:
+                args.append(exprs[arg.name])
+
+        error = None
+        if func.throws:
+            error = self.var()
+            self.write('%s = %s.new("int*")' % (
+                error, self.dep(self.backend.ffi)), level)
+            args.append(error)
+
+        self.write("%s = %s(%s)" % (
+            self.result, self.dep(self.symbol),
+            ", ".join(args)), level)
+        return error
+
+    def _write_time(self, level):
+        """Writes the code getting the current time if instrumented and
+        returns the variable or None
+        """
+
+        if self.stats is None:
+            return
+        var = self.var()
+        self.write("%s = %s()" % (var, self.dep(_timer)), level)
+        return var
+
+    def _write_return(self, error, outs, level, times=None):
+        func = self.func
+        if error is not None:
+            self.write("if %s[0]:" % error, level)
+            self.write("raise %s(%r, %s[0])" % (
+                self.dep(CallError), func.symbol, error), level + 1)
+
+        values = []
+        if func.return_type != "void":
+            ret = TYPES[func.return_type](self, None, 0)
+            values.append(ret.result(self.result, level))
+        for type_, pointer in outs:
+            values.append(type_.read(pointer, level))
+
+        if not values:
+            value = None
+        elif len(values) == 1:
+            value = values[0]
+        else:
+            value = "(%s)" % ", ".join(values)
+
+        if self.stats is not None:
+            if value is not None:
+                var = self.var()
+                self.write("%s = %s" % (var, value), level)
+                value = var
+            start, before, after = times
+            end = self._write_time(level)
+            entry = self.dep(self.stats.get_entry(func.symbol))
+            self.write("%s[0] += 1" % entry, level)
+            self.write("%s[1] += %s - %s" % (entry, before, start), level)
+            self.write("%s[2] += %s - %s" % (entry, after, before), level)
+            self.write("%s[3] += %s - %s" % (entry, end, after), level)
+
+        if value is None:
+            self.write("return", level)
+        else:
+            self.write("return %s" % value, level)
+
+    def _signature(self, name):
+        return "def %s(%s):" % (
+            name, ", ".join(a.py_name for a in self.func.py_args))
+
+    def generate_eager(self, name):
+        self.write(self._signature(name))
+        start = self._write_time(1)
+        exprs, outs = self._write_args(True, 1)
+        before = self._write_time(1)
+        error = self._write_call(exprs, 1)
+        after = self._write_time(1)
+        self._write_return(error, outs, 1, (start, before, after))
+
+    def generate_deferred(self, name, fallback):
+        self._keys[id(fallback)] = "fallback"
+        self.write(self._signature(name))
+        start = self._write_time(1)
+        self.write("try:", 1)
+        exprs, outs = self._write_args(False, 2)
+        before = self._write_time(2)
+        error = self._write_call(exprs, 2)
+        after = self._write_time(2)
+        self.write("except (TypeError, OverflowError):", 1)
+        # let the checked version figure out what is wrong, it counts the
+        # call in case it succeeds
+        self.write("return %s(%s)" % (
+            self.dep(fallback),
+            ", ".join(a.py_name for a in self.func.py_args)), 2)
+        self._write_return(error, outs, 1, (start, before, after))
+
+
+_FOLD_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+_HAS_CONSTANT = sys.version_info >= (3, 8)
+
+
+def _get_constant(node):
+    """Returns (True, value) if `node` is a constant, else (False, None)"""
+
+    if _HAS_CONSTANT:
+        if isinstance(node, ast.Constant):
+            return True, node.value
+    elif isinstance(node, ast.Num):
+        return True, node.n
+    elif isinstance(node, ast.Str):
+        return True, node.s
+    elif PY2 and isinstance(node, ast.Name) and \
+            node.id in ("True", "False", "None"):
+        return True, {"True": True, "False": False, "None": None}[node.id]
+    elif not PY2 and isinstance(node, ast.NameConstant):
+        return True, node.value
+    return False, None
+
+
+def _make_constant(value, node):
+    if _HAS_CONSTANT:
+        new = ast.Constant(value=value)
+    elif isinstance(value, (bool, type(None))):
+        if PY2:
+            new = ast.Name(id=repr(value), ctx=ast.Load())
+        else:
+            new = ast.NameConstant(value=value)
+    elif isinstance(value, integer_types + (float,)):
+        new = ast.Num(n=value)
+    else:
+        return node
+    return ast.copy_location(new, node)
+
+
+class _Optimizer(ast.NodeTransformer):
+    """Folds constants, removes dead branches and collects the global
+    names which should be bound as closure variables.
+    """
+
+    # don't fold into huge numbers
+    MAX_CONSTANT = 2 ** 128
+
+    def __init__(self, deps):
+        self.deps = deps
+        # closure variable name -> object
+        self.bound = {}
+        # closure variable name -> ("dep", name), ("attr", name, attr)
+        # or ("builtin", name)
+        self.specs = {}
+
+    def _fold(self, func, node, *values):
+        try:
+            value = func(*values)
+        except Exception:
+            return node
+        if isinstance(value, integer_types) and \
+                abs(value) > self.MAX_CONSTANT:
+            return node
+        return _make_constant(value, node)
+
+    def generic_visit(self, node):
+        node = super(_Optimizer, self).generic_visit(node)
+        # removed branches can leave a block empty
+        if isinstance(getattr(node, "body", None), list) and not node.body:
+            node.body = [ast.copy_location(ast.Pass(), node)]
+        return node
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            if node.id in self.deps:
+                self.bound[node.id] = self.deps[node.id]
+                self.specs[node.id] = ("dep", node.id)
+            elif node.id not in ("True", "False", "None") and \
+                    hasattr(builtins, node.id):
+                self.bound[node.id] = getattr(builtins, node.id)
+                self.specs[node.id] = ("builtin", node.id)
+        return node
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        target = node.value
+        if isinstance(node.ctx, ast.Load) and \
+                isinstance(target, ast.Name) and target.id in self.deps:
+            name = "%s_%s" % (target.id, node.attr)
+            self.bound[name] = getattr(self.deps[target.id], node.attr)
+            self.specs[name] = ("attr", target.id, node.attr)
+            return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        is_left, left = _get_constant(node.left)
+        is_right, right = _get_constant(node.right)
+        op = _FOLD_OPS.get(type(node.op))
+        if is_left and is_right and op is not None:
+            return self._fold(op, node, left, right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        is_const, value = _get_constant(node.operand)
+        op = _FOLD_OPS.get(type(node.op))
+        if is_const and op is not None:
+            return self._fold(op, node, value)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        values = [_get_constant(n) for n in [node.left] + node.comparators]
+        ops = [_FOLD_OPS.get(type(o)) for o in node.ops]
+        if not all(v[0] for v in values) or None in ops:
+            return node
+
+        def compare():
+            for i, op in enumerate(ops):
+                if not op(values[i][1], values[i + 1][1]):
+                    return False
+            return True
+        return self._fold(compare, node)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        values = [_get_constant(n) for n in node.values]
+        if not all(v[0] for v in values):
+            return node
+        if isinstance(node.op, ast.And):
+            return self._fold(lambda: all(v[1] for v in values), node)
+        return self._fold(lambda: any(v[1] for v in values), node)
+
+    def visit_If(self, node):
+        self.generic_visit(node)
+        is_const, value = _get_constant(node.test)
+        if not is_const:
+            return node
+        if value:
+            return node.body
+        return node.orelse or None
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        is_const, value = _get_constant(node.test)
+        if not is_const:
+            return node
+        return node.body if value else node.orelse
+
+
+def _optimize(block, name, filename):
+    """Returns the code object of the factory and a list of (name, spec)
+    for its arguments, see _Optimizer.specs.
+    """
+
+    tree = ast.parse(str(block), filename)
+    optimizer = _Optimizer(block.get_dependencies())
+    tree = optimizer.visit(tree)
+
+    names = sorted(optimizer.bound)
+    factory = ast.parse("def _create(%s):\n    return %s\n" % (
+        ", ".join(names), name), filename)
+    factory.body[0].body[0:0] = tree.body
+    ast.fix_missing_locations(factory)
+
+    code = compile(factory, filename, "exec")
+    return code, [(n, optimizer.specs[n]) for n in names]
+
+
+def _run_factory(code, args):
+    namespace = {}
+    exec(code, namespace)
+    # the factory isn't needed anymore and would form a reference cycle
+    # with the globals
+    return namespace.pop("_create")(*args)
+
+
+def _resolve_spec(spec, deps):
+    if spec[0] == "dep":
+        return deps[spec[1]]
+    elif spec[0] == "attr":
+        return getattr(deps[spec[1]], spec[2])
+    return getattr(builtins, spec[1])
+
+
+def optimize_block(block, name, filename="<wrapgen>"):
+    """Optimizes and compiles the function `name` defined in `block`.
+
+    The function gets defined inside a factory which takes all global
+    names it uses as arguments, so they are looked up as closure
+    variables instead of in the globals and builtins.
+
+    Returns:
+        function
+    """
+
+    code, params = _optimize(block, name, filename)
+    deps = block.get_dependencies()
+    return _run_factory(code, [_resolve_spec(s, deps) for n, s in params])
+
+
+def _get_magic():
+    if PY2:
+        import imp
+        return imp.get_magic()
+    import importlib.util
+    return importlib.util.MAGIC_NUMBER
+
+
+def get_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "wrapgen")
+
+
+class CodeCache(object):
+    """A persistent cache of generated wrappers.
+
+    Entries are stored per namespace version, typelib content, interpreter
+    (including the bytecode magic) and backend, one file per wrapper, and
+    are only read once the wrapper is requested. The compiled bytecode is
+    stored together with how to resolve its dependencies. Files are written to
+    a temporary file first and renamed, so concurrent writers and readers
+    never see partial entries.
+
+    Args:
+        namespace (str): the namespace, e.g. "Regress"
+        version (str): the namespace version, e.g. "1.0"
+        typelib_data (bytes): the typelib content or None
+        cache_dir (str): defaults to get_cache_dir()
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, namespace, version, typelib_data=None,
+                 cache_dir=None):
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+        typelib_hash = hashlib.sha1(typelib_data or b"").hexdigest()[:16]
+        interpreter = "%s-%d.%d-%s" % (
+            platform.python_implementation().lower(),
+            sys.version_info[0], sys.version_info[1],
+            binascii.hexlify(_get_magic()).decode("ascii"))
+        self.path = os.path.join(
+            cache_dir, "%s-%s-%s" % (namespace, version, typelib_hash),
+            interpreter)
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry_path(self, func, backend, mode, optimize):
+        """Returns the file used for the wrapper"""
+
+        key = repr((
+            self.FORMAT_VERSION, func.get_cdef(),
+            [(a.name, a.type, a.length, a.nullable, a.direction)
+             for a in func.args],
+            func.return_type, func.throws, mode, bool(optimize)))
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(
+            self.path, backend.NAME, "%s-%s" % (func.symbol, digest[:16]))
+
+    def load(self, func, backend, mode, optimize):
+        """Returns the cached wrapper or None"""
+
+        path = self.get_entry_path(func, backend, mode, optimize)
+        try:
+            with open(path, "rb") as h:
+                entry = marshal.loads(h.read())
+            version, kind, payload, dep_keys, params = entry
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        if version != self.FORMAT_VERSION:
+            self.misses += 1
+            return None
+
+        deps = {}
+        for name, key in dep_keys.items():
+            deps[name] = resolve_dependency(
+                key, func, backend, optimize, self)
+
+        if kind == "factory":
+            wrapper = _run_factory(
+                payload, [_resolve_spec(s, deps) for n, s in params])
+        else:
+            namespace = dict(deps)
+            exec(payload, namespace)
+            wrapper = namespace.pop(func.symbol)
+
+        # the source isn't stored, but get_wrapper_size() also uses the
+        # attribute to tell wrappers from other functions in the globals
+        wrapper._code = None
+        self.hits += 1
+        return wrapper
+
+    def store(self, func, backend, mode, optimize, block, code,
+              params=None):
+        """Stores the compiled `code` of `block`. If `params` is given
+        `code` defines a factory as created by the optimizer.
+
+        Returns False in case the wrapper depends on objects which can't be
+        resolved in another process.
+        """
+
+        if None in block.dep_keys.values():
+            return False
+
+        if params is not None:
+            entry = (self.FORMAT_VERSION, "factory", code, block.dep_keys,
+                     params)
+        else:
+            entry = (self.FORMAT_VERSION, "module", code, block.dep_keys, [])
+
+        path = self.get_entry_path(func, backend, mode, optimize)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
+        fd, temp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        try:
+            os.chmod(temp_path, 0o644)
+            with os.fdopen(fd, "wb") as h:
+                h.write(marshal.dumps(entry))
+            os.rename(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        return True
+
+
+def resolve_dependency(key, func, backend, optimize=False, cache=None):
+    """Returns the object for a dependency key, see CodeBlock.dep_keys"""
+
+    if key == "ffi":
+        return backend.ffi
+    elif key == "symbol":
+        return backend.get_symbol(func.symbol)
+    elif key == "fallback":
+        return create_function(func, backend, "eager", optimize, cache)
+    elif key in ("integer_types", "text_type", "CallError"):
+        return globals()[key]
+    raise ValueError("unknown dependency %r" % key)
+
+
+def generate_function(func, backend, mode="eager", optimize=False,
+                      cache=None, stats=None, strings=None):
+    """Returns a CodeBlock defining a function named like the C symbol.
+
+    Args:
+        func (Function): the signature
+        backend (CFFIBackend): the backend
+        mode (str): one of MODES
+        optimize (bool): passed to create_function() for the fallback of
+            the deferred mode
+        cache (CodeCache): passed to create_function() for the fallback
+        stats (CallStats): if given the wrapper records its calls there
+        strings (StringCache): if given text arguments get encoded through
+            it
+    Returns:
+        CodeBlock
+    """
+
+    if mode not in MODES:
+        raise ValueError("unknown mode %r" % mode)
+
+    gen = _Generator(func, backend, stats, strings)
+    if mode == "eager":
+        gen.generate_eager(func.symbol)
+    else:
+        fallback = create_function(
+            func, backend, "eager", optimize, cache, stats, strings)
+        gen.generate_deferred(func.symbol, fallback)
+    return gen.block
+
+
+def create_function(func, backend, mode="eager", optimize=False,
+                    cache=None, stats=None, strings=None):
+    """Returns a Python function calling the C function `func`
+
+    Args:
+        func (Function): the signature
+        backend (CFFIBackend): the backend
+        mode (str): one of MODES
+        optimize (bool): if optimize_block() should be used
+        cache (CodeCache): a cache to load the wrapper from, or to store
+            it in if it isn't there. Not used for instrumented wrappers or
+            wrappers using a StringCache.
+        stats (CallStats): if given the wrapper records its calls there
+        strings (StringCache): if given text arguments get encoded through
+            it
+    Returns:
+        function
+    """
+
+    if stats is not None or strings is not None:
+        cache = None
+
+    if cache is not None:
+        wrapper = cache.load(func, backend, mode, optimize)
+        if wrapper is not None:
+            return wrapper
+
+    block = generate_function(
+        func, backend, mode, optimize, cache, stats, strings)
+    if optimize:
+        code, params = _optimize(block, func.symbol, "<wrapgen>")
+        deps = block.get_dependencies()
+        wrapper = _run_factory(
+            code, [_resolve_spec(s, deps) for n, s in params])
+    else:
+        code = compile(str(block), "<wrapgen>", "exec")
+        params = None
+        namespace = dict(block.get_dependencies())
+        exec(code, namespace)
+        # not referenced by the code itself, and removing it avoids a
+        # reference cycle so the wrapper gets freed without the GC
+        wrapper = namespace.pop(func.symbol)
+
+    if cache is not None:
+        cache.store(func, backend, mode, optimize, block, code, params)
+
+    wrapper._code = block
+    return wrapper
+
+
+def get_wrapper_size(wrapper):
+    """Returns an estimate of the memory used by a wrapper returned by
+    create_function(), including its code, globals, closure and the eager
+    fallback, but not objects shared with other wrappers like the FFI.
+
+    Returns:
+        int: bytes, or None in case the VM can't tell (PyPy)
+    """
+
+    seen = set()
+    sizes = []
+
+    def add(obj):
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            sizes.append(sys.getsizeof(obj))
+
+    def add_code(code):
+        add(code)
+        add(code.co_code)
+        add(code.co_consts)
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                add_code(const)
+            else:
+                add(const)
+
+    def add_function(func):
+        # the wrapper itself is part of its globals
+        if id(func) in seen:
+            return
+        add(func)
+        add_code(func.__code__)
+        if func.__globals__ is not globals():
+            add(func.__globals__)
+            values = list(func.__globals__.values())
+        else:
+            values = []
+        for cell in func.__closure__ or []:
+            add(cell)
+            values.append(cell.cell_contents)
+        for value in values:
+            if isinstance(value, types.FunctionType) and \
+                    hasattr(value, "_code"):
+                add_function(value)
+
+        block = getattr(func, "_code", None)
+        if block is not None:
+            add(block)
+            add(block._lines)
+            for line in block._lines:
+                add(line)
+                add(line[0])
+
+    try:
+        add_function(wrapper)
+    except TypeError:
+        return None
+    return sum(sizes)
+
+
+class WrapperCache(object):
+    """Keeps the wrappers created by create_function(), by C symbol.
+
+    With `maxsize` set only the most recently used wrappers are kept and
+    the others get created again when needed, which bounds the memory
+    in case many different functions get called.
+
+    Args:
+        backend (CFFIBackend): passed to create_function()
+        mode (str): passed to create_function()
+        optimize (bool): passed to create_function()
+        maxsize (int): maximum number of wrappers, or None for no limit
+        code_cache (CodeCache): passed to create_function()
+        stats (CallStats): passed to create_function(), see set_stats()
+        strings (StringCache): passed to create_function()
+    """
+
+    def __init__(self, backend, mode="eager", optimize=False, maxsize=None,
+                 code_cache=None, stats=None, strings=None):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize has to be at least 1")
+        self.backend = backend
+        self.mode = mode
+        self.optimize = optimize
+        self.maxsize = maxsize
+        self.code_cache = code_cache
+        # not "stats", that's the method returning the cache statistics
+        self.call_stats = stats
+        self.strings = strings
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # symbol -> (wrapper, estimated size), least recently used first
+        self._wrappers = OrderedDict()
+
+    def __len__(self):
+        return len(self._wrappers)
+
+    def get(self, func):
+        """Returns the wrapper for `func`, creating it if needed
+
+        Args:
+            func (Function): the signature
+        Returns:
+            function
+        """
+
+        try:
+            entry = self._wrappers.pop(func.symbol)
+        except KeyError:
+            self.misses += 1
+            wrapper = create_function(
+                func, self.backend, self.mode, self.optimize,
+                self.code_cache, self.call_stats, self.strings)
+            entry = (wrapper, get_wrapper_size(wrapper))
+        else:
+            self.hits += 1
+        self._wrappers[func.symbol] = entry
+
+        if self.maxsize is not None:
+            while len(self._wrappers) > self.maxsize:
+                self._wrappers.popitem(last=False)
+                self.evictions += 1
+
+        return entry[0]
+
+    def clear(self):
+        self._wrappers.clear()
+
+    def set_stats(self, stats):
+        """Enables instrumentation by passing a CallStats, or disables it by
+        passing None. All wrappers get created again on their next use, so
+        wrappers returned before keep their old behavior.
+        """
+
+        self.call_stats = stats
+        self.clear()
+
+    @property
+    def memory(self):
+        """The estimated size of all cached wrappers in bytes, or None, see
+        get_wrapper_size()
+        """
+
+        sizes = [size for wrapper, size in self._wrappers.values()]
+        if None in sizes:
+            return None
+        return sum(sizes)
+
+    def stats(self):
+        """Returns a dict with the hits, misses, evictions, size (number of
+        cached wrappers), maxsize and memory
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "memory": self.memory,
+        }
+
+
+class CallbackCache(object):
+    """Keeps the native callbacks created for Python callables.
+
+    The callables are compared by equality, so bound methods of the same
+    object and function share one callback. Unhashable callables get a
+    new callback each time.
+
+    Cached callables are kept alive until they get evicted, including the
+    objects bound methods belong to. That's why `maxsize` is bounded by
+    default; only pass None if the set of callables is known to be small.
+
+    Callbacks can get evicted as well, so in case C keeps the pointer after
+    the call (a signal handler for example) the caller has to keep the
+    returned callback alive.
+
+    Args:
+        backend (CFFIBackend): creates the callbacks
+        signature (str): the C type of the callback, e.g. "void(*)(void*)"
+        maxsize (int): maximum number of callbacks, or None for no limit
+        error: returned to C in case the callable raises
+    """
+
+    def __init__(self, backend, signature, maxsize=256, error=None):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize has to be at least 1")
+        self.backend = backend
+        self.signature = signature
+        self.maxsize = maxsize
+        self.error = error
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # callable -> callback, least recently used first
+        self._callbacks = OrderedDict()
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def _create(self, callable_):
+        self.misses += 1
+        return self.backend.create_callback(
+            self.signature, callable_, self.error)
+
+    def get(self, callable_):
+        """Returns the callback for `callable_`, creating it if needed"""
+
+        try:
+            callback = self._callbacks[callable_]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable
+            return self._create(callable_)
+        else:
+            self.hits += 1
+            # the order only matters for evicting, and reordering is slow
+            # with the pure Python OrderedDict of Python 2
+            if self.maxsize is not None:
+                self._callbacks[callable_] = self._callbacks.pop(callable_)
+            return callback
+
+        callback = self._callbacks[callable_] = self._create(callable_)
+        if self.maxsize is not None:
+            while len(self._callbacks) > self.maxsize:
+                self._callbacks.popitem(last=False)
+                self.evictions += 1
+
+        return callback
+
+    def clear(self):
+        self._callbacks.clear()
+
+    def stats(self):
+        """Returns a dict with the hits, misses, evictions, size (number of
+        cached callbacks) and maxsize
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+
+# field type -> ctypes type name
+FIELD_TYPES = {
+    "int8": "c_int8",
+    "uint8": "c_uint8",
+    "int16": "c_int16",
+    "uint16": "c_uint16",
+    "int32": "c_int32",
+    "uint32": "c_uint32",
+    "int64": "c_int64",
+    "uint64": "c_uint64",
+    "size_t": "c_size_t",
+    "float": "c_float",
+    "double": "c_double",
+    "pointer": "c_void_p",
+}
+
+FLOAT_FIELD_TYPES = ["float", "double"]
+
+
+class Field(object):
+    """A field of a C struct.
+
+    Args:
+        name (str): the attribute name
+        type_ (str or Struct): one of FIELD_TYPES or an embedded struct
+        offset (int): in bytes, relative to the start of the struct
+        writable (bool): if the field can be set
+    """
+
+    def __init__(self, name, type_, offset, writable=True):
+        if not isinstance(type_, Struct) and type_ not in FIELD_TYPES:
+            raise ValueError("unknown field type %r" % type_)
+        self.name = name
+        self.type = type_
+        self.offset = offset
+        self.writable = writable
+
+    def __repr__(self):
+        return "<%s name=%r type=%r offset=%r>" % (
+            type(self).__name__, self.name, self.type, self.offset)
+
+
+class Struct(object):
+    """The layout of a C struct, e.g. as found in a typelib.
+
+    Args:
+        name (str): the class name
+        size (int): in bytes
+        fields (list): list of Field
+    """
+
+    def __init__(self, name, size, fields):
+        self.name = name
+        self.size = size
+        self.fields = fields
+
+    def __repr__(self):
+        return "<%s name=%r size=%r>" % (
+            type(self).__name__, self.name, self.size)
+
+
+def _field_error(struct_name, field, value):
+    """Returns the exception for a value a field setter rejected"""
+
+    if isinstance(field.type, Struct):
+        expected_name = field.type.name
+        expected = ()
+    else:
+        expected_name = field.type
+        if field.type in FLOAT_FIELD_TYPES:
+            expected = integer_types + (float,)
+        else:
+            expected = integer_types
+    if isinstance(value, expected):
+        return OverflowError("%s.%s: %r out of range for %s" % (
+            struct_name, field.name, value, expected_name))
+    return TypeError("%s.%s: expected %s, got %s" % (
+        struct_name, field.name, expected_name, type(value).__name__))
+
+
+def _get_ctypes_fields(struct_):
+    """Returns the _fields_ for a ctypes.Structure with _pack_ = 1 which
+    places each field at its offset, padding the gaps.
+    """
+
+    import ctypes
+
+    fields = []
+    position = 0
+    for field in sorted(struct_.fields, key=lambda f: f.offset):
+        if field.offset > position:
+            fields.append(("_pad%d" % position,
+                           ctypes.c_char * (field.offset - position)))
+        if isinstance(field.type, Struct):
+            ctype = create_struct(field.type)
+        else:
+            ctype = getattr(ctypes, FIELD_TYPES[field.type])
+        fields.append((field.name, ctype))
+        position = field.offset + ctypes.sizeof(ctype)
+    if struct_.size > position:
+        fields.append(("_pad%d" % position,
+                       ctypes.c_char * (struct_.size - position)))
+    return fields
+
+
+def generate_struct(struct_):
+    """Returns a CodeBlock defining a class named like the struct, see
+    create_struct()
+    """
+
+    import ctypes
+
+    block = CodeBlock()
+    var = VariableFactory()
+
+    def dep(obj):
+        name = var(obj)
+        block.add_dependency(name, obj)
+        return name
+
+    w = block.write_line
+
+    def raise_error(field, level):
+        w("raise %s(%r, %s, value)" % (
+            dep(_field_error), struct_.name, dep(field)), level)
+
+    w("class %s(%s):" % (struct_.name, dep(ctypes.Structure)))
+    w("_pack_ = 1", 1)
+    w("_fields_ = %s" % dep(_get_ctypes_fields(struct_)), 1)
+    w("size = %d" % struct_.size, 1)
+
+    # reads go directly to the ctypes fields, writes get checked here as
+    # ctypes silently truncates integers. One __setattr__ is faster than a
+    # property per field, as that would move the reads to Python as well.
+    w("def __setattr__(self, name, value):", 1)
+    first = "if"
+    for field in struct_.fields:
+        w("%s name == %r:" % (first, field.name), 2)
+        first = "elif"
+        if not field.writable:
+            w("raise AttributeError(%r)" % (
+                "%s.%s is not writable" % (struct_.name, field.name)), 3)
+            continue
+
+        type_ = field.type
+        if isinstance(type_, Struct):
+            w("if not isinstance(value, %s):" % dep(create_struct(type_)), 3)
+            raise_error(field, 4)
+        elif type_ in FLOAT_FIELD_TYPES:
+            w("if not isinstance(value, %s):" % dep(
+                integer_types + (float,)), 3)
+            raise_error(field, 4)
+        elif type_ == "pointer":
+            w("if value is not None and not isinstance(value, %s):" % dep(
+                integer_types), 3)
+            raise_error(field, 4)
+        else:
+            ctype = getattr(ctypes, FIELD_TYPES[type_])
+            bits = ctypes.sizeof(ctype) * 8
+            if ctype(-1).value == -1:
+                low, high = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+            else:
+                low, high = 0, 2 ** bits - 1
+            w("if not isinstance(value, %s):" % dep(integer_types), 3)
+            raise_error(field, 4)
+            w("if not %d <= value <= %d:" % (low, high), 3)
+            raise_error(field, 4)
+    w("%s name.startswith('_pad'):" % first, 2)
+    w("raise AttributeError(name)", 3)
+    w("%s(self, name, value)" % dep(ctypes.Structure.__setattr__), 2)
+
+    return block
+
+
+# layout -> class, so structs embedded in different ones share a class
+_struct_classes = {}
+
+
+def _get_struct_key(struct_):
+    fields = []
+    for field in struct_.fields:
+        type_ = field.type
+        if isinstance(type_, Struct):
+            type_ = _get_struct_key(type_)
+        fields.append((field.name, type_, field.offset, field.writable))
+    return (struct_.name, struct_.size, tuple(fields))
+
+
+def create_struct(struct_):
+    """Returns a ctypes.Structure subclass for the layout.
+
+    Use cls() for a zeroed struct or cls.from_buffer(buffer, offset) for
+    one in a writable buffer, e.g. a bytearray or a ctypes array for memory
+    owned by C. Embedded structs are returned as views into the same
+    memory. Classes are cached by layout.
+
+    Args:
+        struct_ (Struct): the layout
+    Returns:
+        type
+    """
+
+    key = _get_struct_key(struct_)
+    try:
+        return _struct_classes[key]
+    except KeyError:
+        pass
+
+    block = generate_struct(struct_)
+    namespace = block.compile()
+    cls = namespace[struct_.name]
+    cls._code = block
+    _struct_classes[key] = cls
+    return cls
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# Copyright 2016 Christoph Reiter
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+"""
+Gets the wrappers of all functions and methods of a namespace from a
+wrapgen.WrapperCache a few times in a row, like a documentation generator
+or a plugin host would, and prints the time per pass, the cache statistics
+and the peak RSS.
+
+The signatures are taken from the typelib, everything wrapgen has no type
+for is passed as a pointer and functions using other types are skipped.
+The wrappers aren't called, as there are no meaningful arguments to pass.
+
+    main.py NAMESPACE VERSION [MAXSIZE] [deferred] [opt]
+"""
+
+import sys
+import resource
+import platform
+sys.path.insert(0, "..")
+from benchutils import *
+import wrapgen
+
+import cffi
+from pgi.clib.gir import *
+
+
+PASSES = 3
+
+_SCALAR_TYPES = {
+    GITypeTag.BOOLEAN: "int32",
+    GITypeTag.INT8: "int32",
+    GITypeTag.INT16: "int32",
+    GITypeTag.INT32: "int32",
+    GITypeTag.UINT8: "uint32",
+    GITypeTag.UINT16: "uint32",
+    GITypeTag.UINT32: "uint32",
+    GITypeTag.UNICHAR: "uint32",
+    GITypeTag.GTYPE: "size_t",
+    GITypeTag.DOUBLE: "double",
+}
+
+
+def get_type(type_info):
+    """Returns the wrapgen type for a GITypeInfo or None"""
+
+    tag = int(type_info.tag)
+    if type_info.is_pointer:
+        if tag in (GITypeTag.UTF8, GITypeTag.FILENAME):
+            return "utf8"
+        return "pointer"
+    elif tag == GITypeTag.INTERFACE:
+        iface_type = int(type_info.get_interface().type)
+        if iface_type in (GIInfoType.ENUM, GIInfoType.FLAGS):
+            return "int32"
+        return None
+    return _SCALAR_TYPES.get(tag)
+
+
+def get_function(info):
+    """Returns a wrapgen.Function for a GIFunctionInfo or None"""
+
+    args = []
+    if info.is_method:
+        args.append(wrapgen.Arg("self_", "pointer"))
+
+    for arg_info in info.get_args():
+        type_ = get_type(arg_info.get_type())
+        if type_ is None:
+            return
+        args.append(wrapgen.Arg(
+            arg_info.name, type_,
+            nullable=bool(arg_info.may_be_null),
+            direction=str(arg_info.direction).lower()))
+
+    if info.can_throw_gerror:
+        args.append(wrapgen.Arg("gerror", "pointer", direction="out"))
+
+    return_type = "void"
+    return_info = info.get_return_type()
+    if int(return_info.tag) != GITypeTag.VOID or return_info.is_pointer:
+        return_type = get_type(return_info)
+        if return_type is None:
+            return
+
+    return wrapgen.Function(info.symbol, args, return_type)
+
+
+def get_functions(namespace, version):
+    """Returns the signatures of all functions and methods we can wrap and
+    the name of the shared library.
+    """
+
+    repo = GIRepository.get_default()
+    repo.require(namespace, version, 0)
+    library = repo.get_shared_library(namespace).split(",")[0]
+
+    function_infos = []
+    for info in repo.get_infos(namespace):
+        info_type = int(info.type)
+        if info_type == GIInfoType.FUNCTION:
+            function_infos.append(info)
+        elif info_type in (GIInfoType.OBJECT, GIInfoType.INTERFACE,
+                           GIInfoType.STRUCT, GIInfoType.UNION,
+                           GIInfoType.ENUM, GIInfoType.FLAGS):
+            function_infos.extend(info.get_methods())
+
+    # some functions are also exposed as static methods
+    functions = []
+    symbols = set()
+    for info in function_infos:
+        if info.symbol in symbols:
+            continue
+        symbols.add(info.symbol)
+        func = get_function(info)
+        if func is not None:
+            functions.append(func)
+    return functions, library
+
+
+def get_max_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main(argv):
+    namespace, version = argv[1:3]
+    maxsize = None
+    if len(argv) > 3 and argv[3].isdigit():
+        maxsize = int(argv[3])
+    mode = "deferred" if "deferred" in argv[1:] else "eager"
+    optimize = "opt" in argv[1:]
+
+    functions, library = get_functions(namespace, version)
+    ffi = cffi.FFI()
+    ffi.cdef("\n".join(f.get_cdef() for f in functions))
+    lib = ffi.dlopen(library)
+    # skip symbols missing in the library, e.g. platform specific ones
+    functions = [f for f in functions if hasattr(lib, f.symbol)]
+
+    backend = wrapgen.CFFIBackend(ffi, lib)
+    cache = wrapgen.WrapperCache(backend, mode, optimize, maxsize)
+    base_rss = get_max_rss()
+
+    times = []
+    for i in xrange(PASSES):
+        t = timer()
+        for func in functions:
+            cache.get(func)
+        times.append(timer() - t)
+
+    stats = cache.stats()
+    rss = get_max_rss() - base_rss
+    desc = "%s-%s-%s%s" % (namespace, maxsize or "unbounded", mode,
+                           "-opt" if optimize else "")
+    print platform.python_implementation(), desc, \
+        "functions=%d" % len(functions), \
+        "passes=%s" % ",".join("%.3f" % t for t in times), \
+        " ".join("%s=%s" % i for i in sorted(stats.items())), \
+        "rss=%.1fMiB" % (rss / 1024.0 ** 2)
+    report("wrappers-" + desc, times, backend="cffi", functions=len(functions),
+           rss=rss, **stats)
+
+
+if __name__ == "__main__":
+    main(sys.argv)